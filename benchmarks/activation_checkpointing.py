@@ -0,0 +1,75 @@
+"""
+Reports peak memory and training throughput of each activation checkpointing policy.
+
+    python -m benchmarks.activation_checkpointing --model_def config/yolov3.cfg --img_size 608 --batch_size 8
+
+Every policy runs in a fresh interpreter, the reported memory is the peak RSS of the training steps
+minus the RSS after building the model.
+"""
+from __future__ import division
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_policy(policy, model_def, img_size, batch_size, steps):
+    import torch
+    from models import load_model
+
+    model = load_model(model_def, img_size=img_size)
+    segments = model.set_activation_checkpointing(None if policy == "none" else policy)
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters())
+    imgs = torch.rand(batch_size, 3, img_size, img_size)
+    targets = torch.tensor([[i, 0, 0.5, 0.5, 0.2, 0.3] for i in range(batch_size)])
+    base_rss = peak_rss_mb()
+
+    # The first step allocates the optimizer state and warms up the allocator
+    times = []
+    for _ in range(steps + 1):
+        start_time = time.time()
+        loss, _ = model(imgs, targets)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        times.append(time.time() - start_time)
+
+    return {
+        "policy": policy,
+        "segments": len(segments),
+        "peak_mb": peak_rss_mb() - base_rss,
+        "images_per_s": batch_size * steps / sum(times[1:]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--img_size", type=int, default=608, help="size of each image dimension")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of each image batch")
+    parser.add_argument("--steps", type=int, default=3, help="number of measured training steps")
+    parser.add_argument("--policies", type=str, nargs="+", default=["none", "block", "stage"], help="policies to compare")
+    parser.add_argument("--policy", type=str, help="internal: run a single policy in this process")
+    opt = parser.parse_args()
+
+    if opt.policy:
+        print(json.dumps(run_policy(opt.policy, opt.model_def, opt.img_size, opt.batch_size, opt.steps)))
+        sys.exit(0)
+
+    print("%-8s %10s %18s %12s" % ("Policy", "Segments", "Peak memory (MB)", "Images/s"))
+    for policy in opt.policies:
+        out = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.activation_checkpointing", "--policy", policy,
+             "--model_def", opt.model_def, "--img_size", str(opt.img_size),
+             "--batch_size", str(opt.batch_size), "--steps", str(opt.steps)]
+        )
+        result = json.loads(out.decode().strip().split("\n")[-1])
+        print("%-8s %10d %18.1f %12.2f" % (policy, result["segments"], result["peak_mb"], result["images_per_s"]))
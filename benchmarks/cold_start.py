@@ -0,0 +1,70 @@
+"""
+Measures cold-start time and peak RSS of building a Darknet and loading its .weights file.
+
+    python -m benchmarks.cold_start --model_def config/yolov3.cfg --weights_path weights/yolov3.weights
+
+"legacy" reproduces the previous path (random init of every layer, then reading the whole file
+with np.fromfile before copying it into the parameters), "fast" uses load_model. Every mode runs
+in a fresh interpreter so the peak RSS of one mode does not leak into the other.
+"""
+from __future__ import division
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode, model_def, weights_path):
+    import numpy as np
+    import torch
+    from models import Darknet, load_model
+    from utils.utils import weights_init_normal
+
+    base_rss = peak_rss_mb()
+    start_time = time.time()
+    if mode == "legacy":
+        model = Darknet(model_def)
+        model.apply(weights_init_normal)
+        with open(weights_path, "rb") as f:
+            header = np.fromfile(f, dtype=np.int32, count=5)
+            weights = np.fromfile(f, dtype=np.float32)
+        model.header_info, model.seen = header, header[3]
+        model.load_darknet_buffer(weights)
+    else:
+        model = load_model(model_def, weights_path, device=torch.device("cpu"))
+    elapsed = time.time() - start_time
+
+    return {"mode": mode, "seconds": elapsed, "peak_rss_mb": peak_rss_mb(), "import_rss_mb": base_rss}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--repeats", type=int, default=3, help="number of fresh processes per mode")
+    parser.add_argument("--mode", type=str, help="internal: run a single mode in this process")
+    opt = parser.parse_args()
+
+    if opt.mode:
+        print(json.dumps(run_mode(opt.mode, opt.model_def, opt.weights_path)))
+        sys.exit(0)
+
+    print("%-8s %12s %16s %16s" % ("Mode", "Time (s)", "Peak RSS (MB)", "Load RSS (MB)"))
+    for mode in ["legacy", "fast"]:
+        for _ in range(opt.repeats):
+            out = subprocess.check_output(
+                [sys.executable, "-m", "benchmarks.cold_start", "--mode", mode,
+                 "--model_def", opt.model_def, "--weights_path", opt.weights_path]
+            )
+            result = json.loads(out.decode().strip().split("\n")[-1])
+            print(
+                "%-8s %12.3f %16.1f %16.1f"
+                % (mode, result["seconds"], result["peak_rss_mb"], result["peak_rss_mb"] - result["import_rss_mb"])
+            )
@@ -0,0 +1,82 @@
+"""
+Measures training throughput of train() with 1/2/4/8 local gloo ranks on a synthetic dataset.
+
+    python -m benchmarks.ddp_scaling --model_def config/yolov3-tiny.cfg --ranks 1 2 4 8
+
+Timings include process start-up and model construction, so use enough images / epochs for the
+training loop to dominate.
+"""
+from __future__ import division
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def make_synthetic_dataset(directory, num_images, num_classes, img_size):
+    """ Writes random images with random boxes in the layout ListDataset expects, returns the data config path """
+    os.makedirs(os.path.join(directory, "images"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "labels"), exist_ok=True)
+    img_paths = []
+    for i in range(num_images):
+        img_path = os.path.join(directory, "images", "%06d.jpg" % i)
+        Image.fromarray(np.random.randint(0, 255, (img_size, img_size, 3), dtype=np.uint8)).save(img_path)
+        boxes = np.random.uniform(0.2, 0.8, (4, 5))
+        boxes[:, 0] = np.random.randint(0, num_classes, 4)
+        boxes[:, 3:] /= 4
+        np.savetxt(img_path.replace("images", "labels").replace(".jpg", ".txt"), boxes, fmt="%g")
+        img_paths.append(img_path)
+
+    with open(os.path.join(directory, "list.txt"), "w") as f:
+        f.write("\n".join(img_paths) + "\n")
+    with open(os.path.join(directory, "classes.names"), "w") as f:
+        f.write("\n".join("class_%d" % c for c in range(num_classes)) + "\n")
+    data_config = os.path.join(directory, "synthetic.data")
+    with open(data_config, "w") as f:
+        f.write("classes=%d\n" % num_classes)
+        f.write("train=%s\n" % os.path.join(directory, "list.txt"))
+        f.write("valid=%s\n" % os.path.join(directory, "list.txt"))
+        f.write("names=%s\n" % os.path.join(directory, "classes.names"))
+    return data_config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--ranks", type=int, nargs="+", default=[1, 2, 4, 8], help="world sizes to benchmark")
+    parser.add_argument("--num_images", type=int, default=256, help="number of synthetic training images")
+    parser.add_argument("--num_classes", type=int, default=80, help="number of classes of the model")
+    parser.add_argument("--batch_size", type=int, default=8, help="per rank batch size")
+    parser.add_argument("--epochs", type=int, default=1, help="number of epochs per run")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    opt = parser.parse_args()
+    print(opt)
+
+    from models import train
+
+    model_def = os.path.abspath(opt.model_def)
+    with tempfile.TemporaryDirectory() as directory:
+        data_config = make_synthetic_dataset(directory, opt.num_images, opt.num_classes, opt.img_size)
+        # train() writes its logs and checkpoints relative to the working directory
+        os.chdir(directory)
+
+        results = []
+        for world_size in opt.ranks:
+            start_time = time.time()
+            train(
+                model_def, None, data_config, opt.img_size,
+                epochs=opt.epochs, batch_size=opt.batch_size,
+                checkpoint_interval=0, evaluation_interval=0,
+                multiscale_training=False, n_cpu=1,
+                world_size=world_size,
+            )
+            elapsed = time.time() - start_time
+            results.append((world_size, elapsed, opt.num_images * opt.epochs / elapsed))
+
+    print("\n%6s %12s %12s %10s" % ("Ranks", "Time (s)", "Images/s", "Speedup"))
+    for world_size, elapsed, throughput in results:
+        print("%6d %12.2f %12.2f %9.2fx" % (world_size, elapsed, throughput, throughput / results[0][2]))
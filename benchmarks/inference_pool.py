@@ -0,0 +1,60 @@
+"""
+Throughput of the multi-process InferencePool against the number of workers.
+
+    python -m benchmarks.inference_pool --model_def config/yolov3-tiny.cfg --workers 1 2 4 8
+
+Every configuration splits the available cores evenly between its workers. The baseline is one
+process using all the cores as intra-op threads.
+"""
+from __future__ import division
+
+import argparse
+import os
+import time
+
+import torch
+
+from models import load_model
+from utils.inference_pool import InferencePool
+from utils.utils import non_max_suppression
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--batch_size", type=int, default=4, help="images per submitted batch")
+    parser.add_argument("--batches", type=int, default=32, help="number of submitted batches")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to compare")
+    opt = parser.parse_args()
+    print(opt)
+
+    num_cores = len(os.sched_getaffinity(0))
+    imgs = torch.rand(opt.batch_size, 3, opt.img_size, opt.img_size)
+    total = opt.batch_size * opt.batches
+
+    print("%-22s %8s %10s" % ("Configuration", "Threads", "Images/s"))
+    # Pools are created (forked) before this process runs any forward
+    for num_workers in opt.workers:
+        model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+        pool = InferencePool(model, num_workers=num_workers)
+        pool.submit(imgs).result()  # warm up
+        start_time = time.time()
+        futures = [pool.submit(imgs) for _ in range(opt.batches)]
+        for future in futures:
+            future.result()
+        elapsed = time.time() - start_time
+        pool.close()
+        print("%-22s %8d %10.2f" % (f"pool, {num_workers} workers", max(1, num_cores // num_workers), total / elapsed))
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+    torch.set_num_threads(num_cores)
+    with torch.no_grad():
+        non_max_suppression(model(imgs))
+        start_time = time.time()
+        for _ in range(opt.batches):
+            non_max_suppression(model(imgs))
+    elapsed = time.time() - start_time
+    print("%-22s %8d %10.2f" % ("single process", num_cores, total / elapsed))
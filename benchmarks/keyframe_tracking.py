@@ -0,0 +1,119 @@
+"""
+Throughput against detection recall of keyframe detection with tracking in between.
+
+    python -m benchmarks.keyframe_tracking --model_def config/yolov3.cfg --weights_path weights/yolov3.weights --video clip.mp4
+    python -m benchmarks.keyframe_tracking --model_def config/yolov3-tiny.cfg
+
+The reference is the detector run on every frame, the recall of a configuration is the fraction of reference
+boxes matched (same class, IoU >= --iou_thres) by its output. Without --video a synthetic clip of moving
+rectangles is generated; without weights the detector can't see them, so its forward is still timed but its
+boxes are replaced by the ground truth (--oracle, implied), which measures the tracker alone.
+"""
+from __future__ import division
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from models import load_model
+from utils.tracking import KeyframeDetector, KeyframeScheduler, box_iou_matrix
+from utils.video import detect_frame, open_capture, write_synthetic_video
+
+
+def read_frames(source):
+    capture = open_capture(source)
+    frames = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def to_array(detections):
+    return detections.numpy() if detections is not None else np.zeros((0, 7), dtype=np.float32)
+
+
+def recall(reference, outputs, iou_thres):
+    matched, total = 0, 0
+    for expected, found in zip(reference, outputs):
+        total += len(expected)
+        if len(expected) and len(found):
+            iou = box_iou_matrix(expected[:, :4], found[:, :4])
+            iou[expected[:, None, 6] != found[None, :, 6]] = 0
+            matched += int((iou.max(1) >= iou_thres).sum())
+    return matched / total if total else 1.0
+
+
+def run(detect, frames, scheduler):
+    keyframe_detector = KeyframeDetector(detect, scheduler)
+    outputs = []
+    start_time = time.time()
+    for i, frame in enumerate(frames):
+        detect.frame_index = i
+        detections, _, _ = keyframe_detector.process(frame)
+        outputs.append(to_array(detections))
+    return outputs, len(frames) / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--video", type=str, help="sample clip, a synthetic one if not given")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames of the synthetic clip")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--conf_thres", type=float, default=0.5, help="object confidence threshold")
+    parser.add_argument("--nms_thres", type=float, default=0.4, help="iou thresshold for non-maximum suppression")
+    parser.add_argument("--iou_thres", type=float, default=0.5, help="iou for a box to count as recalled")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 5, 10, 15, 30], help="fixed keyframe intervals")
+    parser.add_argument("--min_confidences", type=float, nargs="+", default=[0.3, 0.5, 0.7], help="adaptive tracking confidence thresholds")
+    parser.add_argument("--oracle", action="store_true", help="use the ground truth of the synthetic clip as detections")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ground_truth = None
+        if opt.video is None:
+            opt.video = os.path.join(directory, "synthetic.avi")
+            ground_truth = write_synthetic_video(opt.video, opt.frames)
+        frames = read_frames(opt.video)
+
+    oracle = ground_truth is not None and (opt.oracle or opt.weights_path is None)
+
+    def detect(frame):
+        detections = detect_frame(model, frame, opt.img_size, opt.conf_thres, opt.nms_thres)
+        if oracle:
+            boxes = ground_truth[detect.frame_index]
+            return np.concatenate((boxes, np.ones((len(boxes), 2)), np.zeros((len(boxes), 1))), 1).astype(np.float32)
+        return detections
+
+    # Reference: the detector on every frame
+    detect.frame_index = 0
+    reference = []
+    start_time = time.time()
+    for i, frame in enumerate(frames):
+        detect.frame_index = i
+        detections = detect(frame)
+        reference.append(detections if isinstance(detections, np.ndarray) else to_array(detections))
+    reference_fps = len(frames) / (time.time() - start_time)
+
+    print("%-24s %10s %8s %8s %8s" % ("Configuration", "Keyframes", "FPS", "Speedup", "Recall"))
+    print("%-24s %10.3f %8.2f %8.2f %8.3f" % ("every frame", 1.0, reference_fps, 1.0, 1.0))
+    configurations = [(f"interval {interval}", KeyframeScheduler(interval=interval)) for interval in opt.intervals]
+    configurations += [
+        (f"adaptive, conf {min_confidence}", KeyframeScheduler(adaptive=True, min_confidence=min_confidence))
+        for min_confidence in opt.min_confidences
+    ]
+    for name, scheduler in configurations:
+        outputs, fps = run(detect, frames, scheduler)
+        print("%-24s %10.3f %8.2f %8.2f %8.3f" % (
+            name, scheduler.stats()["keyframe_ratio"], fps, fps / reference_fps, recall(reference, outputs, opt.iou_thres)))
@@ -0,0 +1,82 @@
+"""
+Sends concurrent detection requests to server.py and reports client-side latency and throughput,
+followed by the server metrics (latency percentiles and batch size histogram).
+
+    python server.py --model_def config/yolov3-tiny.cfg --weights_path weights/yolov3-tiny.weights &
+    python -m benchmarks.load_generator --concurrency 16 --requests 500
+
+Without --images, random noise jpegs are generated locally.
+"""
+from __future__ import division
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+from utils.batching import percentile
+
+
+def synthetic_images(count, height, width):
+    rng = np.random.RandomState(0)
+    return [
+        cv2.imencode(".jpg", rng.randint(0, 256, (height, width, 3), dtype=np.uint8))[1].tobytes()
+        for _ in range(count)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8080", help="address of the server")
+    parser.add_argument("--images", type=str, nargs="*", help="image files to send, synthetic jpegs if not given")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="total number of requests")
+    parser.add_argument("--height", type=int, default=480, help="height of the synthetic images")
+    parser.add_argument("--width", type=int, default=640, help="width of the synthetic images")
+    opt = parser.parse_args()
+    print(opt)
+
+    if opt.images:
+        payloads = [open(path, "rb").read() for path in opt.images]
+    else:
+        payloads = synthetic_images(16, opt.height, opt.width)
+
+    latencies, errors = [], []
+    counter = iter(range(opt.requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            request = urllib.request.Request(
+                opt.url + "/detect", data=payloads[i % len(payloads)], headers={"Content-Type": "application/octet-stream"}
+            )
+            start_time = time.time()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    json.loads(response.read())
+                with lock:
+                    latencies.append(time.time() - start_time)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(opt.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    print(f"{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.2f} req/s), {len(errors)} errors")
+    print("Client latency (ms): p50 %.1f, p90 %.1f, p99 %.1f" % tuple(1000 * percentile(latencies, q) for q in [50, 90, 99]))
+    with urllib.request.urlopen(opt.url + "/metrics") as response:
+        print("Server metrics:", json.dumps(json.loads(response.read()), indent=2))
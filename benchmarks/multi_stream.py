@@ -0,0 +1,103 @@
+"""
+Throughput and latency of the MultiStreamScheduler against one batch-1 forward per stream.
+
+    python -m benchmarks.multi_stream --model_def config/yolov3-tiny.cfg --streams 4 16 32 --fps 5
+
+Every stream is a synthetic clip replayed as a live camera at --fps. The baseline gives every stream its own
+thread running the model on its latest frame, the scheduler batches the latest frames of all streams.
+"""
+from __future__ import division
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import torch
+
+from models import load_model
+from utils.batching import letterbox_frame, percentile
+from utils.streams import MultiStreamScheduler, StreamSource
+from utils.utils import non_max_suppression
+from utils.video import write_synthetic_video
+
+
+def per_stream_baseline(model, sources, img_size, duration):
+    """ One thread per stream, each running batch-1 forwards on its latest frame """
+    processed, latencies = [0] * len(sources), []
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def serve(i, source):
+        last_index = -1
+        while not stopped.is_set():
+            item = source.take(last_index)
+            if item is None:
+                time.sleep(0.001)
+                continue
+            last_index, capture_time, frame = item
+            with torch.no_grad():
+                non_max_suppression(model(letterbox_frame(frame, img_size).unsqueeze(0)))
+            with lock:
+                processed[i] += 1
+                latencies.append(time.time() - capture_time)
+
+    threads = [threading.Thread(target=serve, args=(i, source), daemon=True) for i, source in enumerate(sources)]
+    for source in sources:
+        source.start()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    for source in sources:
+        source.stop()
+    return processed, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--streams", type=int, nargs="+", default=[4, 16, 32], help="numbers of streams to compare")
+    parser.add_argument("--fps", type=float, default=5, help="frame rate of every stream")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per configuration")
+    parser.add_argument("--max_batch_size", type=int, default=16, help="maximum number of streams per forward")
+    parser.add_argument("--max_staleness_ms", type=float, default=1000, help="scheduler skips frames older than this")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+
+    with tempfile.TemporaryDirectory() as directory:
+        clips = []
+        for seed in range(4):
+            clips.append(os.path.join(directory, f"stream{seed}.avi"))
+            write_synthetic_video(clips[-1], num_frames=100, height=360, width=640, seed=seed)
+
+        def fake_streams(count):
+            return [StreamSource(i, clips[i % len(clips)], fps=opt.fps, loop=True) for i in range(count)]
+
+        print("%-28s %10s %10s %10s %12s" % ("Configuration", "Frames/s", "p50 ms", "p99 ms", "min/max"))
+        for num_streams in opt.streams:
+            processed, latencies = per_stream_baseline(model, fake_streams(num_streams), opt.img_size, opt.duration)
+            print("%-28s %10.2f %10.1f %10.1f %12s" % (
+                f"{num_streams} streams, batch 1", sum(processed) / opt.duration,
+                1000 * percentile(latencies, 50), 1000 * percentile(latencies, 99), f"{min(processed)}/{max(processed)}"))
+
+            scheduler = MultiStreamScheduler(
+                model, dict(enumerate(fake_streams(num_streams))), img_size=opt.img_size,
+                max_batch_size=opt.max_batch_size, max_staleness=opt.max_staleness_ms / 1000,
+            )
+            stats = scheduler.run(opt.duration)
+            processed = [stream["processed"] for stream in stats["streams"].values()]
+            print("%-28s %10.2f %10.1f %10.1f %12s" % (
+                f"{num_streams} streams, scheduler", sum(processed) / opt.duration,
+                stats["batches"]["latency_ms"]["p50"], stats["batches"]["latency_ms"]["p99"],
+                f"{min(processed)}/{max(processed)}"))
+            print("\tmean batch size %.2f, stale frames %d" % (
+                stats["batches"]["mean_batch_size"], sum(stream["stale"] for stream in stats["streams"].values())))
@@ -0,0 +1,55 @@
+"""
+Compares the CPU throughput of onnxruntime with PyTorch eager at several batch sizes and thread counts.
+
+    python -m benchmarks.onnx_runtime --model_def config/yolov3-tiny.cfg --weights_path weights/yolov3-tiny.weights
+
+The model is exported without NMS to a temporary file first (see export.py for the parity check).
+"""
+from __future__ import division
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from models import InferenceDarknet, load_model
+from utils.onnx_backend import OnnxDarknet, export_onnx
+
+
+def throughput(fn, imgs, steps):
+    with torch.no_grad():
+        fn(imgs)  # warm up
+        start_time = time.time()
+        for _ in range(steps):
+            fn(imgs)
+    return imgs.size(0) * steps / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8], help="batch sizes to compare")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="intra-op thread counts to compare")
+    parser.add_argument("--steps", type=int, default=10, help="number of timed batches")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+    onnx_path = os.path.join(tempfile.mkdtemp(), "model.onnx")
+    export_onnx(InferenceDarknet(model), onnx_path, img_size=opt.img_size)
+
+    print("%8s %6s %16s %16s %8s" % ("Threads", "Batch", "PyTorch img/s", "ORT img/s", "Speedup"))
+    for n_threads in opt.threads:
+        torch.set_num_threads(n_threads)
+        session = OnnxDarknet(onnx_path, n_threads=n_threads)
+        for batch_size in opt.batch_sizes:
+            imgs = torch.rand(batch_size, 3, opt.img_size, opt.img_size)
+            torch_throughput = throughput(model, imgs, opt.steps)
+            ort_throughput = throughput(session, imgs, opt.steps)
+            print("%8d %6d %16.2f %16.2f %7.2fx" % (
+                n_threads, batch_size, torch_throughput, ort_throughput, ort_throughput / torch_throughput))
@@ -0,0 +1,86 @@
+"""
+Compares fp32 / bf16 autocast and NCHW / channels_last modes of the conv stack.
+
+    python -m benchmarks.precision --model_def config/yolov3-tiny.cfg --weights_path weights/yolov3-tiny.weights
+
+For every mode reports inference and training throughput and the deviation of the decoded outputs from
+fp32 NCHW. With --data_config the validation mAP of every mode is computed with evaluate as well.
+"""
+from __future__ import division
+
+import argparse
+import time
+
+import torch
+
+from models import load_model, evaluate
+from utils.parse_config import parse_data_config
+
+MODES = [("fp32", False), ("fp32", True), ("bf16", False), ("bf16", True)]
+
+
+def throughput(fn, batch_size, steps):
+    fn()  # warm up
+    start_time = time.time()
+    for _ in range(steps):
+        fn()
+    return batch_size * steps / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--data_config", type=str, help="if given, computes the validation mAP of every mode")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of each image batch")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--steps", type=int, default=10, help="number of timed batches")
+    opt = parser.parse_args()
+    print(opt)
+
+    imgs = torch.rand(opt.batch_size, 3, opt.img_size, opt.img_size)
+    targets = torch.tensor([[i, 0, 0.5, 0.5, 0.2, 0.3] for i in range(opt.batch_size)])
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+    with torch.no_grad():
+        reference = model(imgs)
+
+    print("%-6s %-13s %14s %14s %12s %12s %10s" % (
+        "Mode", "Memory format", "Infer img/s", "Train img/s", "Max |dconf|", "Max |dbox|", "mAP"))
+    for precision, channels_last in MODES:
+        model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+        model.set_precision(precision, channels_last)
+
+        model.eval()
+        with torch.no_grad():
+            outputs = model(imgs)
+            infer_throughput = throughput(lambda: model(imgs), opt.batch_size, opt.steps)
+        conf_diff = (outputs[..., 4:] - reference[..., 4:]).abs().max().item()
+        box_diff = (outputs[..., :4] - reference[..., :4]).abs().max().item()
+
+        model.train()
+        optimizer = torch.optim.Adam(model.parameters())
+
+        def train_step():
+            loss, _ = model(imgs, targets)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+        train_throughput = throughput(train_step, opt.batch_size, opt.steps)
+
+        mAP = float("nan")
+        if opt.data_config:
+            # Evaluate the pretrained weights, not the ones updated by the timed training steps
+            model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+            model.set_precision(precision, channels_last)
+            _, _, AP, _, _ = evaluate(
+                model, path=parse_data_config(opt.data_config)["valid"], iou_thres=0.5, conf_thres=0.001,
+                nms_thres=0.5, img_size=opt.img_size, batch_size=opt.batch_size,
+            )
+            mAP = AP.mean()
+
+        print("%-6s %-13s %14.2f %14.2f %12.5f %12.3f %10.4f" % (
+            precision, "channels_last" if channels_last else "NCHW",
+            infer_throughput, train_throughput, conf_diff, box_diff, mAP))
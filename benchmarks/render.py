@@ -0,0 +1,91 @@
+"""
+Frames per second of drawing 10 / 100 / 1000 detections on a 1280x720 frame.
+
+    python -m benchmarks.render --class_path data/coco.names
+
+"legacy" reproduces the previous annotate_frame_with_objects (frame copy, colormap and color sampling
+on every call, text boxes drawn with cv2_put_text), "renderer" draws in place into a reused buffer
+with the cached palette and label images, "matplotlib" is the figure + savefig path detect.py used.
+"""
+from __future__ import division
+
+import argparse
+import copy
+import io
+import random
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import torch
+
+from utils.render import DetectionRenderer
+from utils.utils import cv2_put_text, load_classes, plot_rescaled_boxes_on_image
+
+import cv2
+
+
+def random_detections(num_boxes, num_classes, height, width, rng):
+    x1 = rng.uniform(0, width - 50, num_boxes)
+    y1 = rng.uniform(20, height - 50, num_boxes)
+    w, h = rng.uniform(10, 200, (2, num_boxes))
+    conf = rng.uniform(0.5, 1, (2, num_boxes))
+    cls = rng.randint(0, num_classes, num_boxes)
+    return np.stack([x1, y1, np.minimum(x1 + w, width - 1), np.minimum(y1 + h, height - 1), *conf, cls], 1).astype(np.float32)
+
+
+def legacy_annotate(frame, detections, class_names):
+    masked_frame = copy.copy(frame)
+    cmap = plt.get_cmap("tab20b")
+    colors = [cmap(i) for i in np.linspace(0, 1, 20)]
+    unique_labels = np.unique(detections[:, -1])
+    bbox_colors = random.sample(colors * (len(unique_labels) // 20 + 1), len(unique_labels))
+    for x1, y1, x2, y2, conf, cls_conf, cls_id in detections:
+        color = bbox_colors[int(np.where(unique_labels == int(cls_id))[0])]
+        color = tuple([int(ch * 255) for ch in color])[:3]
+        cv2.rectangle(masked_frame, (int(x1), int(y1)), (int(x2), int(y2)), color=color, thickness=2)
+        cv2_put_text(masked_frame, class_names[int(cls_id)], int(x1), int(y1) - 1, font_scale=0.5, background_color=color)
+    return masked_frame
+
+
+def matplotlib_render(frame, detections, class_names):
+    fig = plot_rescaled_boxes_on_image(frame, torch.from_numpy(detections), class_names, max(frame.shape[:2]))
+    fig.savefig(io.BytesIO(), format="png", bbox_inches="tight", pad_inches=0.0)
+    plt.close(fig)
+
+
+def fps(fn, runs):
+    fn()  # warm up
+    start_time = time.time()
+    for _ in range(runs):
+        fn()
+    return runs / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--boxes", type=int, nargs="+", default=[10, 100, 1000], help="numbers of boxes per frame")
+    parser.add_argument("--runs", type=int, default=50, help="number of timed frames")
+    parser.add_argument("--skip_matplotlib", action="store_true", help="don't time the (slow) matplotlib path")
+    opt = parser.parse_args()
+    print(opt)
+
+    class_names = load_classes(opt.class_path)
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, (720, 1280, 3), dtype=np.uint8)
+    renderer = DetectionRenderer(class_names)
+    buffer = np.empty_like(frame)
+
+    print("%8s %12s %14s %14s" % ("Boxes", "legacy fps", "renderer fps", "matplotlib fps"))
+    for num_boxes in opt.boxes:
+        detections = random_detections(num_boxes, len(class_names), 720, 1280, rng)
+        legacy_fps = fps(lambda: legacy_annotate(frame, detections, class_names), opt.runs)
+        renderer_fps = fps(lambda: renderer.render(frame, detections, out=buffer), opt.runs)
+        matplotlib_fps = float("nan")
+        if not opt.skip_matplotlib:
+            matplotlib_fps = fps(lambda: matplotlib_render(frame, detections, class_names), max(1, opt.runs // 10))
+        print("%8d %12.1f %14.1f %14.2f" % (num_boxes, legacy_fps, renderer_fps, matplotlib_fps))
@@ -0,0 +1,61 @@
+"""
+Stress test of one shared Darknet serving concurrent threads with mixed input resolutions.
+
+    python -m benchmarks.thread_safety --model_def config/yolov3-tiny.cfg --threads 8 --iterations 20
+
+Reference outputs are computed sequentially first, then every thread repeatedly runs random
+(size, input) pairs on the shared model and compares with the reference. Exits with 1 on any mismatch.
+"""
+from __future__ import division
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import torch
+
+from models import load_model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--img_sizes", type=int, nargs="+", default=[320, 416, 512, 608], help="input sizes to mix")
+    parser.add_argument("--threads", type=int, default=8, help="number of concurrent threads")
+    parser.add_argument("--iterations", type=int, default=20, help="forwards per thread")
+    parser.add_argument("--atol", type=float, default=1e-4, help="maximum abs difference with the reference")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path)
+    model.eval()
+    inputs = [torch.rand(1, 3, img_size, img_size) for img_size in opt.img_sizes]
+    with torch.no_grad():
+        references = [model(imgs) for imgs in inputs]
+
+    mismatches = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(opt.iterations):
+            i = rng.randrange(len(inputs))
+            with torch.no_grad():
+                outputs = model(inputs[i])
+            if outputs.shape != references[i].shape or (outputs - references[i]).abs().max().item() > opt.atol:
+                mismatches.append(opt.img_sizes[i])
+
+    start_time = time.time()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(opt.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    total = opt.threads * opt.iterations
+    print(f"{total} forwards on {opt.threads} threads in {elapsed:.2f}s ({total / elapsed:.2f} img/s)")
+    print(f"Mismatches: {len(mismatches)}" + (f" at sizes {sorted(set(mismatches))}" if mismatches else ""))
+    sys.exit(1 if mismatches else 0)
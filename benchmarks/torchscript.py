@@ -0,0 +1,53 @@
+"""
+Compares the CPU latency of the eager Darknet with InferenceDarknet in eager mode, scripted and
+torch.compile'd (dynamic shapes), at several stride-32 input sizes.
+
+    python -m benchmarks.torchscript --model_def config/yolov3.cfg --weights_path weights/yolov3.weights
+
+The compiled variant is skipped when torch.compile isn't available. The first call at every size is
+not timed (scripting profiles and compilation happen there).
+"""
+from __future__ import division
+
+import argparse
+import time
+
+import torch
+
+from models import InferenceDarknet, load_model
+
+
+def latency_ms(model, imgs, runs):
+    with torch.no_grad():
+        model(imgs)  # warm up
+        model(imgs)
+        start_time = time.time()
+        for _ in range(runs):
+            model(imgs)
+    return 1000 * (time.time() - start_time) / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--img_sizes", type=int, nargs="+", default=[320, 416, 608], help="input sizes (multiples of 32)")
+    parser.add_argument("--batch_size", type=int, default=1, help="size of each image batch")
+    parser.add_argument("--runs", type=int, default=10, help="number of timed forwards per size")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path)
+    model.eval()
+    variants = [("eager Darknet", model), ("eager InferenceDarknet", InferenceDarknet(model))]
+    variants.append(("scripted", torch.jit.freeze(torch.jit.script(InferenceDarknet(model)))))
+    if hasattr(torch, "compile"):
+        variants.append(("compiled", torch.compile(InferenceDarknet(model), dynamic=True)))
+
+    print("%-24s" % "Variant" + "".join("%12s" % f"{img_size} (ms)" for img_size in opt.img_sizes))
+    for name, m in variants:
+        row = "%-24s" % name
+        for img_size in opt.img_sizes:
+            imgs = torch.rand(opt.batch_size, 3, img_size, img_size)
+            row += "%12.2f" % latency_ms(m, imgs, opt.runs)
+        print(row)
@@ -0,0 +1,83 @@
+"""
+Throughput of the threaded VideoPipeline against a serial loop on a synthetic video.
+
+    python -m benchmarks.video_pipeline --model_def config/yolov3-tiny.cfg --frames 300
+
+The serial loop is what callers used to write: read, letterbox, forward, NMS, draw and write one frame at
+a time. The pipeline runs the same work in five threads with bounded queues, once without dropping frames
+(offline) and once dropping the oldest frames (live), and prints the per stage latencies.
+"""
+from __future__ import division
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+from models import load_model
+from utils.batching import letterbox_frame
+from utils.render import get_renderer
+from utils.utils import load_classes, non_max_suppression, rescale_boxes
+from utils.video import VideoPipeline, open_capture, video_writer, write_synthetic_video
+
+
+def serial_loop(model, source, output, class_names, img_size):
+    capture = open_capture(source)
+    writer = None
+    frames = 0
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        with torch.no_grad():
+            detections = non_max_suppression(model(letterbox_frame(frame, img_size).unsqueeze(0)))[0]
+        if detections is not None:
+            detections = rescale_boxes(detections, img_size, frame.shape[:2])
+        get_renderer(class_names).draw(frame, detections)
+        if writer is None:
+            writer = video_writer(output, 30, frame.shape[1], frame.shape[0])
+        writer.write(frame)
+        frames += 1
+    capture.release()
+    writer.release()
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_def", type=str, default="config/yolov3-tiny.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, help="path to weights file, random weights if not given")
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames of the synthetic video")
+    parser.add_argument("--height", type=int, default=720, help="height of the synthetic video")
+    parser.add_argument("--width", type=int, default=1280, help="width of the synthetic video")
+    parser.add_argument("--batch_size", type=int, default=1, help="maximum number of waiting frames per forward")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    model.eval()
+    class_names = load_classes(opt.class_path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "synthetic.avi")
+        output = os.path.join(directory, "output.avi")
+        write_synthetic_video(source, opt.frames, opt.height, opt.width)
+
+        start_time = time.time()
+        frames = serial_loop(model, source, output, class_names, opt.img_size)
+        print("%-24s %8d frames %8.2f fps" % ("serial", frames, frames / (time.time() - start_time)))
+
+        for drop_policy in ["none", "drop_oldest"]:
+            pipeline = VideoPipeline(
+                model, source, output=output, class_names=class_names, img_size=opt.img_size,
+                batch_size=opt.batch_size, drop_policy=drop_policy,
+            )
+            stats = pipeline.run()
+            print("%-24s %8d frames %8.2f fps %6d dropped" % (
+                f"pipeline ({drop_policy})", stats["frames"], stats["fps"], stats["dropped"]))
+            print(json.dumps(stats["stages"], indent=2))
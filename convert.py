@@ -0,0 +1,39 @@
+from __future__ import division
+
+from models import *
+
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts between .weights, .ckpt and .pth model files")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--input", type=str, required=True, help="path to the .weights, .ckpt or .pth file to convert")
+    parser.add_argument("--output", type=str, required=True, help="path to the .weights or .ckpt file to write")
+    parser.add_argument("--cutoff", type=int, help="only convert layers between 0 and cutoff (75 for darknet53.conv.74)")
+    opt = parser.parse_args()
+    print(opt)
+
+    if opt.input.endswith(".pth"):
+        # Same loading as everywhere else: plain state dicts and resumable training checkpoints
+        model = load_model(opt.model_def, opt.input)
+        if not isinstance(model, Darknet):
+            raise ValueError(f"{opt.input} is an int8 model, only float models can be converted")
+        loaded_layers = len(model.module_list)
+    else:
+        model = Darknet(opt.model_def, device="meta").to_empty(device="cpu")
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.num_batches_tracked.zero_()
+        if opt.input.endswith(".ckpt"):
+            loaded_layers = model.load_checkpoint(opt.input, cutoff=opt.cutoff)
+        else:
+            loaded_layers = model.load_darknet_weights(opt.input, cutoff=opt.cutoff)
+    if opt.cutoff is not None:
+        loaded_layers = min(loaded_layers, opt.cutoff)
+
+    if opt.output.endswith(".ckpt"):
+        model.save_checkpoint(opt.output, cutoff=loaded_layers)
+    else:
+        model.save_darknet_weights(opt.output, cutoff=loaded_layers)
+
+    print(f"Converted {loaded_layers} layers of {opt.input} to {opt.output}")
@@ -3,12 +3,17 @@ from __future__ import division
 from models import *
 from utils.utils import *
 from utils.datasets import *
+from utils.onnx_backend import *
+from utils.detection_io import *
+from utils.render import get_renderer
 
 import os
 import sys
 import time
 import datetime
 import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
 
 from PIL import Image
 
@@ -17,9 +22,16 @@ from torch.utils.data import DataLoader
 from torchvision import datasets
 from torch.autograd import Variable
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.ticker import NullLocator
+import cv2
+
+
+def render_image(path, detections, classes):
+    """ Saves output/<name>.png with the 'detections' (original image coordinates) of the image at 'path' """
+    img = cv2.imread(path)
+    get_renderer(classes).draw(img, detections)
+    filename = path.split("/")[-1].split(".")[0]
+    cv2.imwrite(f"output/{filename}.png", img)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -32,7 +44,14 @@ if __name__ == "__main__":
     parser.add_argument("--batch_size", type=int, default=1, help="size of the batches")
     parser.add_argument("--n_cpu", type=int, default=0, help="number of cpu threads to use during batch generation")
     parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--onnx", type=str, help="run this exported ONNX graph (without NMS) with onnxruntime instead")
     parser.add_argument("--checkpoint_model", type=str, help="path to checkpoint model")
+    parser.add_argument("--output_format", type=str, default="jsonl", help="detections output: jsonl or columnar")
+    parser.add_argument("--output", type=str, help="detections file (jsonl) or directory (columnar), in output/ by default")
+    parser.add_argument("--no_render", action="store_true", help="don't save images with the detections drawn")
+    parser.add_argument("--render_workers", type=int, default=2, help="number of processes rendering images")
     opt = parser.parse_args()
     print(opt)
 
@@ -41,14 +60,11 @@ if __name__ == "__main__":
     os.makedirs("output", exist_ok=True)
 
     # Set up model
-    model = Darknet(opt.model_def, img_size=opt.img_size).to(device)
-
-    if opt.weights_path.endswith(".weights"):
-        # Load darknet weights
-        model.load_darknet_weights(opt.weights_path)
+    if opt.onnx:
+        model = OnnxDarknet(opt.onnx)
     else:
-        # Load checkpoint weights
-        model.load_state_dict(torch.load(opt.weights_path))
+        model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size, device=device)
+    model.set_precision(opt.precision, opt.channels_last)
 
     model.eval()  # Set in evaluation mode
 
@@ -63,8 +79,17 @@ if __name__ == "__main__":
 
     Tensor = torch.cuda.FloatTensor if torch.cuda.is_available() else torch.FloatTensor
 
-    imgs = []  # Stores image paths
-    img_detections = []  # Stores detections for each image index
+    # Detections are written as soon as each batch is done, nothing is kept across batches
+    if opt.output_format == "jsonl":
+        writer = JsonlDetectionWriter(opt.output or "output/detections.jsonl", classes)
+    elif opt.output_format == "columnar":
+        writer = ColumnarDetectionWriter(opt.output or "output/detections")
+    else:
+        raise ValueError(f"Unknown output format {opt.output_format}")
+
+    # Rendering runs in worker processes, with at most two pending images per worker
+    render_pool = None if opt.no_render else ProcessPoolExecutor(max_workers=opt.render_workers)
+    pending_renders = collections.deque()
 
     print("\nPerforming object detection:")
     prev_time = time.time()
@@ -83,59 +108,23 @@ if __name__ == "__main__":
         prev_time = current_time
         print("\t+ Batch %d, Inference Time: %s" % (batch_i, inference_time))
 
-        # Save image and detections
-        imgs.extend(img_paths)
-        img_detections.extend(detections)
-
-    # Bounding-box colors
-    cmap = plt.get_cmap("tab20b")
-    colors = [cmap(i) for i in np.linspace(0, 1, 20)]
-
-    print("\nSaving images:")
-    # Iterate through images and save plot of detections
-    for img_i, (path, detections) in enumerate(zip(imgs, img_detections)):
-
-        print("(%d) Image: '%s'" % (img_i, path))
-
-        # Create plot
-        img = np.array(Image.open(path))
-        plt.figure()
-        fig, ax = plt.subplots(1)
-        ax.imshow(img)
-
-        # Draw bounding boxes and labels of detections
-        if detections is not None:
-            # Rescale boxes to original image
-            detections = rescale_boxes(detections, opt.img_size, img.shape[:2])
-            unique_labels = detections[:, -1].cpu().unique()
-            n_cls_preds = len(unique_labels)
-            bbox_colors = random.sample(colors, n_cls_preds)
-            for x1, y1, x2, y2, conf, cls_conf, cls_pred in detections:
-
-                print("\t+ Label: %s, Conf: %.5f" % (classes[int(cls_pred)], cls_conf.item()))
-
-                box_w = x2 - x1
-                box_h = y2 - y1
-
-                color = bbox_colors[int(np.where(unique_labels == int(cls_pred))[0])]
-                # Create a Rectangle patch
-                bbox = patches.Rectangle((x1, y1), box_w, box_h, linewidth=2, edgecolor=color, facecolor="none")
-                # Add the bbox to the plot
-                ax.add_patch(bbox)
-                # Add label
-                plt.text(
-                    x1,
-                    y1,
-                    s=classes[int(cls_pred)],
-                    color="white",
-                    verticalalignment="top",
-                    bbox={"color": color, "pad": 0},
-                )
-
-        # Save generated image with detections
-        plt.axis("off")
-        plt.gca().xaxis.set_major_locator(NullLocator())
-        plt.gca().yaxis.set_major_locator(NullLocator())
-        filename = path.split("/")[-1].split(".")[0]
-        plt.savefig(f"output/{filename}.png", bbox_inches="tight", pad_inches=0.0)
-        plt.close()
+        # Rescale boxes to the original images (only their headers are read)
+        detections = [
+            rescale_boxes(image_detections, opt.img_size, Image.open(path).size[::-1])
+            if image_detections is not None else None
+            for path, image_detections in zip(img_paths, detections)
+        ]
+        writer.write(img_paths, detections)
+
+        if render_pool is not None:
+            for path, image_detections in zip(img_paths, detections):
+                while len(pending_renders) >= 2 * opt.render_workers:
+                    pending_renders.popleft().result()
+                image_detections = image_detections.cpu().numpy() if image_detections is not None else None
+                pending_renders.append(render_pool.submit(render_image, path, image_detections, classes))
+
+    writer.close()
+    if render_pool is not None:
+        for render in pending_renders:
+            render.result()
+        render_pool.shutdown()
@@ -0,0 +1,63 @@
+from __future__ import division
+
+from models import *
+from utils.onnx_backend import *
+
+import argparse
+import sys
+
+import torch
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports a Darknet as a standalone TorchScript module or ONNX graph")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--format", type=str, default="torchscript", help="torchscript or onnx")
+    parser.add_argument("--output", type=str, default="weights/yolov3.torchscript.pt", help="path of the exported file")
+    parser.add_argument("--no_freeze", action="store_true", help="torchscript: keep the parameters as attributes instead of inlining them")
+    parser.add_argument("--nms", action="store_true", help="onnx: include confidence thresholding and NMS in the graph")
+    parser.add_argument("--conf_thres", type=float, default=0.5, help="onnx: object confidence threshold of the NMS")
+    parser.add_argument("--nms_thres", type=float, default=0.4, help="onnx: iou threshold of the NMS")
+    parser.add_argument("--opset", type=int, default=17, help="onnx: opset version")
+    parser.add_argument("--check_sizes", type=int, nargs="*", default=[320, 416, 608], help="input sizes compared with PyTorch")
+    parser.add_argument("--check_batch_size", type=int, default=2, help="batch size of the comparison with PyTorch")
+    parser.add_argument("--atol", type=float, default=1e-3, help="maximum abs difference with PyTorch, exits with 1 above it")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path)
+    model.eval()
+    if opt.format == "torchscript":
+        reference = model
+        exported = torch.jit.script(InferenceDarknet(model))
+        if not opt.no_freeze:
+            exported = torch.jit.freeze(exported)
+        exported.save(opt.output)
+        # The saved file runs with torch.jit.load alone
+        exported = torch.jit.load(opt.output)
+    elif opt.format == "onnx":
+        reference = InferenceDarknet(model)
+        if opt.nms:
+            reference = DetectionsWithNMS(reference, model.yolo_layers[0].num_classes, opt.conf_thres, opt.nms_thres)
+        export_onnx(reference, opt.output, opset=opt.opset)
+        exported = OnnxDarknet(opt.output)
+    else:
+        raise ValueError(f"Unknown format {opt.format}")
+    print(f"Saved {opt.format} model to {opt.output}")
+
+    # Parity of the exported model with PyTorch at several input sizes
+    max_diff = 0
+    with torch.no_grad():
+        for img_size in opt.check_sizes:
+            imgs = torch.rand(opt.check_batch_size, 3, img_size, img_size)
+            outputs, expected = exported(imgs), reference(imgs)
+            if outputs.shape != expected.shape:
+                print(f"{img_size}x{img_size}: shape {tuple(outputs.shape)} instead of {tuple(expected.shape)}")
+                max_diff = float("inf")
+                continue
+            diff = (outputs - expected).abs().max().item() if outputs.numel() else 0
+            max_diff = max(max_diff, diff)
+            print(f"{img_size}x{img_size}: max abs difference with PyTorch {diff:.6f}")
+    if max_diff > opt.atol:
+        print(f"Parity check failed: {max_diff} > {opt.atol}")
+        sys.exit(1)
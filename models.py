@@ -8,6 +8,7 @@ from torch.utils.data import DataLoader
 from torchvision import datasets
 from torchvision import transforms
 import torch.optim as optim
+from torch.utils.checkpoint import checkpoint
 
 
 import numpy as np
@@ -19,19 +20,30 @@ from utils.logger import *
 from utils.utils import *
 from utils.datasets import *
 from utils.parse_config import *
+from utils.checkpoint import *
+from utils.quantization import *
+from utils.distillation import *
+from utils.feature_cache import *
 
 from terminaltables import AsciiTable
 
 import os
 import sys
 import time
+import queue
+import socket
+import contextlib
+import random
+import copy
 import datetime
 import argparse
+from typing import List
 
 
-def create_modules(module_defs):
+def create_modules(module_defs, device=None):
     """
-    Constructs module list of layer blocks from module configuration in module_defs
+    Constructs module list of layer blocks from module configuration in module_defs.
+    Parameters are allocated on 'device' ("meta" allocates them without any storage).
     """
     hyperparams = module_defs.pop(0)
     output_filters = [int(hyperparams["channels"])]
@@ -53,10 +65,11 @@ def create_modules(module_defs):
                     stride=int(module_def["stride"]),
                     padding=pad,
                     bias=not bn,
+                    device=device,
                 ),
             )
             if bn:
-                modules.add_module(f"batch_norm_{module_i}", nn.BatchNorm2d(filters, momentum=0.9, eps=1e-5))
+                modules.add_module(f"batch_norm_{module_i}", nn.BatchNorm2d(filters, momentum=0.9, eps=1e-5, device=device))
             if module_def["activation"] == "leaky":
                 modules.add_module(f"leaky_{module_i}", nn.LeakyReLU(0.1))
 
@@ -134,36 +147,49 @@ class YOLOLayer(nn.Module):
         self.noobj_scale = 100
         self.metrics = {}
         self.img_dim = img_dim
-        self.grid_size = 0  # grid size
-
-    def compute_grid_offsets(self, grid_size, cuda=True):
-        self.grid_size = grid_size
-        g = self.grid_size
-        FloatTensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
-        self.stride = self.img_dim / self.grid_size
-        # Calculate offsets for each grid
-        self.grid_x = torch.arange(g).repeat(g, 1).view([1, 1, g, g]).type(FloatTensor)
-        self.grid_y = torch.arange(g).repeat(g, 1).t().view([1, 1, g, g]).type(FloatTensor)
-        self.scaled_anchors = FloatTensor([(a_w / self.stride, a_h / self.stride) for a_w, a_h in self.anchors])
-        self.anchor_w = self.scaled_anchors[:, 0:1].view((1, self.num_anchors, 1, 1))
-        self.anchor_h = self.scaled_anchors[:, 1:2].view((1, self.num_anchors, 1, 1))
+        self.grid_size = 0  # grid size of the last training forward
+        self.grids = {}  # (grid size, img dim, device) -> offsets, entries are never modified once stored
 
-    def forward(self, x, targets=None, img_dim=None):
-
-        # Tensors for cuda support
-        FloatTensor = torch.cuda.FloatTensor if x.is_cuda else torch.FloatTensor
-        LongTensor = torch.cuda.LongTensor if x.is_cuda else torch.LongTensor
-        ByteTensor = torch.cuda.ByteTensor if x.is_cuda else torch.ByteTensor
+    def compute_grid_offsets(self, grid_size, img_dim, device="cpu"):
+        """
+        Returns (grid_x, grid_y, anchor_w, anchor_h, scaled_anchors, stride) of a grid_size x grid_size output.
+        The tensors are cached and shared between calls (and threads), they must not be modified.
+        """
+        key = (grid_size, img_dim, str(device))
+        grid = self.grids.get(key)
+        if grid is None:
+            g = grid_size
+            stride = img_dim / grid_size
+            # Calculate offsets for each grid
+            grid_x = torch.arange(g, dtype=torch.float, device=device).repeat(g, 1).view([1, 1, g, g])
+            grid_y = torch.arange(g, dtype=torch.float, device=device).repeat(g, 1).t().view([1, 1, g, g])
+            scaled_anchors = torch.tensor(
+                [(a_w / stride, a_h / stride) for a_w, a_h in self.anchors], dtype=torch.float, device=device
+            )
+            anchor_w = scaled_anchors[:, 0:1].view((1, self.num_anchors, 1, 1))
+            anchor_h = scaled_anchors[:, 1:2].view((1, self.num_anchors, 1, 1))
+            grid = (grid_x, grid_y, anchor_w, anchor_h, scaled_anchors, stride)
+            # Threads racing on a missing entry store equal values, a dict assignment is atomic
+            self.grids[key] = grid
+        return grid
+
+    def raw_prediction(self, x):
+        """Splits the head conv output per anchor: (batch, anchors, grid, grid, 5 + classes), not decoded"""
+        num_samples, grid_size = x.size(0), x.size(2)
+        # x may be channels_last, it is made contiguous before being split per anchor
+        return (
+            x.contiguous().view(num_samples, self.num_anchors, self.num_classes + 5, grid_size, grid_size)
+            .permute(0, 1, 3, 4, 2)
+            .contiguous()
+        )
 
-        self.img_dim = img_dim
+    def forward(self, x, targets=None, img_dim=None):
+        # Without targets nothing is written to self, so one layer can serve concurrent threads
+        img_dim = img_dim or self.img_dim
         num_samples = x.size(0)
         grid_size = x.size(2)
 
-        prediction = (
-            x.view(num_samples, self.num_anchors, self.num_classes + 5, grid_size, grid_size)
-            .permute(0, 1, 3, 4, 2)
-            .contiguous()
-        )
+        prediction = self.raw_prediction(x)
 
         # Get outputs
         x = torch.sigmoid(prediction[..., 0])  # Center x
@@ -173,20 +199,20 @@ class YOLOLayer(nn.Module):
         pred_conf = torch.sigmoid(prediction[..., 4])  # Conf
         pred_cls = torch.sigmoid(prediction[..., 5:])  # Cls pred.
 
-        # If grid size does not match current we compute new offsets
-        if grid_size != self.grid_size:
-            self.compute_grid_offsets(grid_size, cuda=x.is_cuda)
+        grid_x, grid_y, anchor_w, anchor_h, scaled_anchors, stride = self.compute_grid_offsets(
+            grid_size, img_dim, device=x.device
+        )
 
         # Add offset and scale with anchors
-        pred_boxes = FloatTensor(prediction[..., :4].shape)
-        pred_boxes[..., 0] = x.data + self.grid_x
-        pred_boxes[..., 1] = y.data + self.grid_y
-        pred_boxes[..., 2] = torch.exp(w.data) * self.anchor_w
-        pred_boxes[..., 3] = torch.exp(h.data) * self.anchor_h
+        pred_boxes = prediction.new_empty(prediction[..., :4].shape)
+        pred_boxes[..., 0] = x.data + grid_x
+        pred_boxes[..., 1] = y.data + grid_y
+        pred_boxes[..., 2] = torch.exp(w.data) * anchor_w
+        pred_boxes[..., 3] = torch.exp(h.data) * anchor_h
 
         output = torch.cat(
             (
-                pred_boxes.view(num_samples, -1, 4) * self.stride,
+                pred_boxes.view(num_samples, -1, 4) * stride,
                 pred_conf.view(num_samples, -1, 1),
                 pred_cls.view(num_samples, -1, self.num_classes),
             ),
@@ -196,11 +222,13 @@ class YOLOLayer(nn.Module):
         if targets is None:
             return output, 0
         else:
+            self.img_dim = img_dim
+            self.grid_size = grid_size
             iou_scores, class_mask, obj_mask, noobj_mask, tx, ty, tw, th, tcls, tconf = build_targets(
                 pred_boxes=pred_boxes,
                 pred_cls=pred_cls,
                 target=targets,
-                anchors=self.scaled_anchors,
+                anchors=scaled_anchors,
                 ignore_thres=self.ignore_thres,
             )
 
@@ -250,87 +278,222 @@ class YOLOLayer(nn.Module):
 class Darknet(nn.Module):
     """YOLOv3 object detection model"""
 
-    def __init__(self, config_path, img_size=416):
+    def __init__(self, config_path, img_size=416, device=None):
+        """
+            @:param config_path - path of the layer configuration file, or a list of module definitions
+                                  starting with the [net] block
+        """
         super(Darknet, self).__init__()
-        self.module_defs = parse_model_config(config_path)
-        self.hyperparams, self.module_list = create_modules(self.module_defs)
+        if isinstance(config_path, str):
+            self.module_defs = parse_model_config(config_path)
+        else:
+            self.module_defs = copy.deepcopy(config_path)
+        self.hyperparams, self.module_list = create_modules(self.module_defs, device=device)
         self.yolo_layers = [layer[0] for layer in self.module_list if hasattr(layer[0], "metrics")]
         self.img_size = img_size
         self.seen = 0
         self.header_info = np.array([0, 0, 0, self.seen, 0], dtype=np.int32)
+        self.checkpoint_segments = {}  # start layer -> (end layer, layers whose outputs are kept)
+        self.precision = "fp32"
+        self.memory_format = torch.contiguous_format
 
-    def forward(self, x, targets=None):
+    def set_precision(self, precision="fp32", channels_last=False):
+        """
+        Sets the precision ("fp32" or "bf16" autocast) and memory format of the conv stack.
+        The yolo layers always decode and compute the loss in fp32.
+        """
+        if precision not in ["fp32", "bf16"]:
+            raise ValueError(f"Unknown precision {precision}")
+        self.precision = precision
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        return self.to(memory_format=self.memory_format)
+
+    def forward(self, x, targets=None, heads=None, layer_outputs=None):
+        """
+            @:param heads           - if given a list, the raw prediction of every yolo layer is appended to it
+                                      (see YOLOLayer.raw_prediction), gradients flow through them
+            @:param layer_outputs   - precomputed outputs of layers 0..len(layer_outputs)-1 (None for those no
+                                      later layer reads), the forward starts after them (see utils/feature_cache.py)
+        """
+        if layer_outputs is not None:
+            layer_outputs = [
+                output if output is None else output.contiguous(memory_format=self.memory_format)
+                for output in layer_outputs
+            ]
+        with torch.autocast(x.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            return self._forward(x.contiguous(memory_format=self.memory_format), targets, heads, layer_outputs)
+
+    def forward_heads(self, x):
+        """Raw predictions of the yolo layers, each (batch, anchors, grid, grid, 5 + classes)"""
+        heads = []
+        self.forward(x, heads=heads)
+        return heads
+
+    def _forward(self, x, targets=None, heads=None, layer_outputs=None):
         img_dim = x.shape[2]
         loss = 0
-        layer_outputs, yolo_outputs = [], []
+        layer_outputs, yolo_outputs = list(layer_outputs or []), []
+        recompute = self.training and torch.is_grad_enabled()
         for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
-            if module_def["type"] in ["convolutional", "upsample", "maxpool"]:
-                x = module(x)
-            elif module_def["type"] == "route":
-                x = torch.cat([layer_outputs[int(layer_i)] for layer_i in module_def["layers"].split(",")], 1)
-            elif module_def["type"] == "shortcut":
-                layer_i = int(module_def["from"])
-                x = layer_outputs[-1] + layer_outputs[layer_i]
-            elif module_def["type"] == "yolo":
-                x, layer_loss = module[0](x, targets, img_dim)
+            if i < len(layer_outputs):
+                # Computed as part of a checkpointed segment
+                x = layer_outputs[-1]
+                continue
+            if recompute and i in self.checkpoint_segments:
+                end, exported = self.checkpoint_segments[i]
+                x = self._checkpoint_segment(i, end, exported, x, layer_outputs)
+                continue
+            if module_def["type"] == "yolo":
+                with torch.autocast(x.device.type, enabled=False):
+                    x = x.float()
+                    if heads is not None:
+                        heads.append(module[0].raw_prediction(x))
+                    x, layer_loss = module[0](x, targets, img_dim)
                 loss += layer_loss
                 yolo_outputs.append(x)
+            else:
+                x = self._layer_forward(i, x, layer_outputs)
             layer_outputs.append(x)
         yolo_outputs = to_cpu(torch.cat(yolo_outputs, 1))
         return yolo_outputs if targets is None else (loss, yolo_outputs)
 
-    def load_darknet_weights(self, weights_path):
-        """Parses and loads the weights stored in 'weights_path'"""
+    def _layer_forward(self, i, x, layer_outputs):
+        """Output of the (non yolo) layer i given the previous output x and the outputs of layers 0..i-1"""
+        module_def = self.module_defs[i]
+        if module_def["type"] in ["convolutional", "upsample", "maxpool"]:
+            return self.module_list[i](x)
+        elif module_def["type"] == "route":
+            return torch.cat([layer_outputs[int(layer_i)] for layer_i in module_def["layers"].split(",")], 1)
+        elif module_def["type"] == "shortcut":
+            layer_i = int(module_def["from"])
+            return layer_outputs[-1] + layer_outputs[layer_i]
+
+    def _checkpoint_segment(self, start, end, exported, x, layer_outputs):
+        """
+        Runs layers start..end-1 without keeping their outputs for backward, they are recomputed instead.
+        Appends the outputs of the segment to layer_outputs (None for those no later layer reads).
+        """
+        batch_norms = [m for m in self.module_list[start:end].modules() if isinstance(m, nn.BatchNorm2d)]
+        calls = []
+        # The outputs before the segment, layer_outputs keeps growing until backward recomputes the segment
+        prefix = list(layer_outputs)
+
+        def run_segment(x):
+            # Running statistics are only updated by the first pass, not by the recomputation
+            momentums = [bn.momentum for bn in batch_norms]
+            if calls:
+                for bn in batch_norms:
+                    bn.momentum = 0.0
+            calls.append(True)
+            try:
+                outputs = list(prefix)
+                for i in range(start, end):
+                    x = self._layer_forward(i, x, outputs)
+                    outputs.append(x)
+                return tuple(outputs[i] for i in exported)
+            finally:
+                # The recomputation can be stopped early by an exception raised from inside the segment
+                for bn, momentum in zip(batch_norms, momentums):
+                    bn.momentum = momentum
+
+        exported_outputs = dict(zip(exported, checkpoint(run_segment, x, use_reentrant=False)))
+        layer_outputs.extend(exported_outputs.get(i) for i in range(start, end))
+        return layer_outputs[-1]
+
+    def layer_inputs(self, i):
+        """Indices of the layers whose outputs layer i reads (-1 is the network input)"""
+        module_def = self.module_defs[i]
+        if module_def["type"] == "route":
+            layers = [int(layer_i) for layer_i in module_def["layers"].split(",")]
+            return [layer_i if layer_i >= 0 else i + layer_i for layer_i in layers]
+        elif module_def["type"] == "shortcut":
+            layer_i = int(module_def["from"])
+            return [i - 1, layer_i if layer_i >= 0 else i + layer_i]
+        return [i - 1]
+
+    def set_activation_checkpointing(self, policy=None):
+        """
+        Enables activation recomputation in training for segments of layers derived from the cfg:
+            None     - disabled
+            "block"  - each residual block (the layers after the source of a shortcut, up to the shortcut)
+            "stage"  - each run of consecutive residual blocks (a Darknet-53 stage without its downsampling conv)
+        Returns the segments as a list of (start, end) layer ranges.
+        """
+        blocks = []
+        if policy is not None:
+            for i, module_def in enumerate(self.module_defs):
+                if module_def["type"] == "shortcut":
+                    blocks.append([min(self.layer_inputs(i)) + 1, i + 1])
+        if policy == "stage":
+            stages = []
+            for block in blocks:
+                if stages and stages[-1][1] == block[0]:
+                    stages[-1][1] = block[1]
+                else:
+                    stages.append(block)
+            blocks = stages
+        elif policy not in [None, "block"]:
+            raise ValueError(f"Unknown activation checkpointing policy {policy}")
+
+        self.checkpoint_segments = {}
+        for start, end in blocks:
+            if any(module_def["type"] == "yolo" for module_def in self.module_defs[start:end]):
+                continue
+            # The last output and every output read by a layer after the segment has to be kept
+            exported = {end - 1}
+            for i in range(end, len(self.module_defs)):
+                exported |= {layer_i for layer_i in self.layer_inputs(i) if start <= layer_i < end}
+            self.checkpoint_segments[start] = (end, sorted(exported))
+        return [(start, end) for start, (end, _) in sorted(self.checkpoint_segments.items())]
+
+    def load_darknet_weights(self, weights_path, cutoff=None):
+        """
+            Parses and loads the weights stored in 'weights_path'
+            @:param cutoff  - load layers between 0 and cutoff (cutoff = None -> all are loaded)
+            @:return number of layers loaded
+        """
 
         # Open the weights file
         with open(weights_path, "rb") as f:
             header = np.fromfile(f, dtype=np.int32, count=5)  # First five are header values
             self.header_info = header  # Needed to write header when saving weights
             self.seen = header[3]  # number of images seen during training
-            weights = np.fromfile(f, dtype=np.float32)  # The rest are weights
 
-        # Establish cutoff for loading backbone weights
-        cutoff = None
-        if "darknet53.conv.74" in weights_path:
+        # The rest are weights, mapped copy-on-write so each tensor is copied straight from the file pages
+        weights = np.memmap(weights_path, dtype=np.float32, mode="c", offset=header.nbytes)
+
+        # Backbone-only weights files from the darknet release don't record their cutoff
+        if cutoff is None and "darknet53.conv.74" in weights_path:
             cutoff = 75
 
+        return self.load_darknet_buffer(weights, cutoff)
+
+    def load_darknet_buffer(self, weights, cutoff=None):
+        """
+            Loads weights from a flat float32 buffer laid out as in a .weights file (without the header)
+            @:param weights - float32 array
+            @:param cutoff  - load layers between 0 and cutoff (cutoff = None -> all are loaded)
+            @:return number of layers loaded
+        """
+        if cutoff is None:
+            cutoff = len(self.module_list)
+
         ptr = 0
-        for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
-            if i == cutoff:
-                break
+        for module_def, module in zip(self.module_defs[:cutoff], self.module_list[:cutoff]):
             if module_def["type"] == "convolutional":
                 conv_layer = module[0]
                 if module_def["batch_normalize"]:
                     # Load BN bias, weights, running mean and running variance
                     bn_layer = module[1]
-                    num_b = bn_layer.bias.numel()  # Number of biases
-                    # Bias
-                    bn_b = torch.from_numpy(weights[ptr : ptr + num_b]).view_as(bn_layer.bias)
-                    bn_layer.bias.data.copy_(bn_b)
-                    ptr += num_b
-                    # Weight
-                    bn_w = torch.from_numpy(weights[ptr : ptr + num_b]).view_as(bn_layer.weight)
-                    bn_layer.weight.data.copy_(bn_w)
-                    ptr += num_b
-                    # Running Mean
-                    bn_rm = torch.from_numpy(weights[ptr : ptr + num_b]).view_as(bn_layer.running_mean)
-                    bn_layer.running_mean.data.copy_(bn_rm)
-                    ptr += num_b
-                    # Running Var
-                    bn_rv = torch.from_numpy(weights[ptr : ptr + num_b]).view_as(bn_layer.running_var)
-                    bn_layer.running_var.data.copy_(bn_rv)
-                    ptr += num_b
+                    for tensor in [bn_layer.bias, bn_layer.weight, bn_layer.running_mean, bn_layer.running_var]:
+                        ptr = _copy_from_buffer(tensor, weights, ptr)
                 else:
                     # Load conv. bias
-                    num_b = conv_layer.bias.numel()
-                    conv_b = torch.from_numpy(weights[ptr : ptr + num_b]).view_as(conv_layer.bias)
-                    conv_layer.bias.data.copy_(conv_b)
-                    ptr += num_b
+                    ptr = _copy_from_buffer(conv_layer.bias, weights, ptr)
                 # Load conv. weights
-                num_w = conv_layer.weight.numel()
-                conv_w = torch.from_numpy(weights[ptr : ptr + num_w]).view_as(conv_layer.weight)
-                conv_layer.weight.data.copy_(conv_w)
-                ptr += num_w
+                ptr = _copy_from_buffer(conv_layer.weight, weights, ptr)
+
+        return min(cutoff, len(self.module_list))
 
     def save_darknet_weights(self, path, cutoff=-1):
         """
@@ -360,14 +523,225 @@ class Darknet(nn.Module):
 
         fp.close()
 
-def evaluate(model, path, iou_thres, conf_thres, nms_thres, img_size, batch_size):
+    def save_checkpoint(self, path, cutoff=None):
+        """
+            Saves the model in the native checkpoint format (see utils/checkpoint.py)
+            @:param path    - path of the new checkpoint file
+            @:param cutoff  - save layers between 0 and cutoff (cutoff = None -> all are saved)
+        """
+        self.header_info[3] = self.seen
+        metadata = {"seen": int(self.seen), "header_info": [int(v) for v in self.header_info]}
+        save_checkpoint(path, self.state_dict(), metadata, cutoff=cutoff)
+
+    def load_checkpoint(self, path, cutoff=None, assign=False):
+        """
+            Loads a native checkpoint, the layers it contains must form a prefix of the model
+            @:param cutoff  - load layers between 0 and cutoff (cutoff = None -> all stored layers are loaded)
+            @:param assign  - make the parameters zero-copy views of the mapped file instead of copying into them
+            @:return number of layers loaded
+        """
+        state_dict, metadata = load_checkpoint(path, cutoff=cutoff)
+        loaded_layers = 1 + max([int(name.split(".")[1]) for name in state_dict if name.startswith("module_list.")], default=-1)
+        # Layers without parameters (route, shortcut, yolo, ...) directly after the prefix are covered as well
+        while loaded_layers < len(self.module_list) and not list(self.module_list[loaded_layers].state_dict()):
+            loaded_layers += 1
+        if cutoff is not None:
+            loaded_layers = min(loaded_layers, cutoff)
+
+        missing, unexpected = self.load_state_dict(state_dict, strict=False, assign=assign)
+        if assign:
+            # Storages backed by the file mapping, they don't count as resident memory (see utils/registry.py)
+            self.mapped_storages = {tensor.untyped_storage().data_ptr() for tensor in state_dict.values()}
+        missing = [name for name in missing if int(name.split(".")[1]) < loaded_layers]
+        if missing or unexpected:
+            raise RuntimeError(f"Checkpoint {path} does not match the model: missing {missing}, unexpected {unexpected}")
+
+        if "header_info" in metadata:
+            self.header_info = np.array(metadata["header_info"], dtype=np.int32)
+        self.seen = metadata.get("seen", 0)
+        return loaded_layers
+
+
+class InferenceLayer(nn.Module):
+    """Conv / maxpool / upsample layer of an InferenceDarknet"""
+
+    is_yolo: bool
+
+    def __init__(self, module):
+        super(InferenceLayer, self).__init__()
+        self.module = module
+        self.is_yolo = False
+
+    def forward(self, x, outputs: List[torch.Tensor], img_size: int) -> torch.Tensor:
+        return self.module(x)
+
+
+class RouteLayer(nn.Module):
+    """Concatenates the outputs of 'layers' (absolute indices)"""
+
+    is_yolo: bool
+
+    def __init__(self, layers):
+        super(RouteLayer, self).__init__()
+        self.layers = layers
+        self.is_yolo = False
+
+    def forward(self, x, outputs: List[torch.Tensor], img_size: int) -> torch.Tensor:
+        return torch.cat([outputs[i] for i in self.layers], 1)
+
+
+class ShortcutLayer(nn.Module):
+    """Adds the output of layer 'source' (absolute index) to the previous output"""
+
+    is_yolo: bool
+
+    def __init__(self, source):
+        super(ShortcutLayer, self).__init__()
+        self.source = source
+        self.is_yolo = False
+
+    def forward(self, x, outputs: List[torch.Tensor], img_size: int) -> torch.Tensor:
+        return x + outputs[self.source]
+
+
+class YOLODecodeLayer(nn.Module):
+    """Stateless decode of a yolo layer: grid offsets and stride are derived from the input of every call"""
+
+    is_yolo: bool
+
+    def __init__(self, anchors, num_classes):
+        super(YOLODecodeLayer, self).__init__()
+        self.register_buffer("anchors", torch.tensor(anchors, dtype=torch.float).view(1, -1, 1, 1, 2))
+        self.num_anchors = len(anchors)
+        self.num_classes = num_classes
+        self.is_yolo = True
+
+    def forward(self, x, outputs: List[torch.Tensor], img_size: int) -> torch.Tensor:
+        num_samples, grid_h, grid_w = x.size(0), x.size(2), x.size(3)
+        # Kept as a division of sizes so that ONNX tracing keeps the stride dynamic
+        stride = img_size / grid_h
+        prediction = (
+            x.contiguous().view(num_samples, self.num_anchors, self.num_classes + 5, grid_h, grid_w)
+            .permute(0, 1, 3, 4, 2)
+        )
+        grid_x = torch.arange(grid_w, dtype=x.dtype, device=x.device).view(1, 1, 1, grid_w)
+        grid_y = torch.arange(grid_h, dtype=x.dtype, device=x.device).view(1, 1, grid_h, 1)
+        boxes = torch.stack(
+            [
+                (torch.sigmoid(prediction[..., 0]) + grid_x) * stride,
+                (torch.sigmoid(prediction[..., 1]) + grid_y) * stride,
+                torch.exp(prediction[..., 2]) * self.anchors[..., 0],
+                torch.exp(prediction[..., 3]) * self.anchors[..., 1],
+            ],
+            -1,
+        )
+        output = torch.cat((boxes, torch.sigmoid(prediction[..., 4:])), -1)
+        return output.reshape(num_samples, -1, self.num_classes + 5)
+
+
+class InferenceDarknet(nn.Module):
+    """
+    Inference only variant of a Darknet that torch.jit.script and torch.compile accept: layers are dispatched
+    by type at construction time, every layer has the same forward signature and the yolo decode keeps no state.
+    Inputs can be any multiple of 32 (height and width). Conv / batch norm pairs are fused unless 'fuse' is False.
+    Returns the decoded detections like Darknet, on the device of the input.
+    """
+
+    def __init__(self, model, fuse=True):
+        super(InferenceDarknet, self).__init__()
+        layers = []
+        for i, (module_def, module) in enumerate(zip(model.module_defs, model.module_list)):
+            if module_def["type"] == "convolutional":
+                modules = copy.deepcopy(module)
+                if fuse and int(module_def["batch_normalize"]):
+                    modules = nn.Sequential(
+                        torch.nn.utils.fusion.fuse_conv_bn_eval(modules[0].eval(), modules[1].eval()), *modules[2:]
+                    )
+                layers.append(InferenceLayer(modules))
+            elif module_def["type"] == "maxpool":
+                layers.append(InferenceLayer(copy.deepcopy(module)))
+            elif module_def["type"] == "upsample":
+                layers.append(InferenceLayer(nn.Upsample(scale_factor=float(module_def["stride"]), mode="nearest")))
+            elif module_def["type"] == "route":
+                layers.append(RouteLayer(model.layer_inputs(i)))
+            elif module_def["type"] == "shortcut":
+                layers.append(ShortcutLayer(model.layer_inputs(i)[1]))
+            elif module_def["type"] == "yolo":
+                layers.append(YOLODecodeLayer(module[0].anchors, module[0].num_classes))
+        self.layers = nn.ModuleList(layers)
+        self.eval()
+
+    def forward(self, x):
+        img_size = x.size(2)
+        outputs: List[torch.Tensor] = []
+        yolo_outputs: List[torch.Tensor] = []
+        for layer in self.layers:
+            x = layer(x, outputs, img_size)
+            if layer.is_yolo:
+                yolo_outputs.append(x)
+            outputs.append(x)
+        return torch.cat(yolo_outputs, 1)
+
+
+def _copy_from_buffer(tensor, weights, ptr):
+    """Copies the next tensor.numel() values of 'weights' starting at 'ptr' into 'tensor', returns the new ptr"""
+    num = tensor.numel()
+    tensor.data.copy_(torch.from_numpy(weights[ptr : ptr + num]).view_as(tensor))
+    return ptr + num
+
+
+def load_model(model_cfg, model_weights=None, img_size=416, device="cpu"):
+    """
+    Builds a Darknet from 'model_cfg' on 'device' and loads 'model_weights' (.weights, .ckpt or .pth) if given,
+    int8 .pth files written by quantize.py are loaded as a QuantizableDarknet.
+    When weights are given the parameters are allocated without being initialized, only the layers
+    the weights file does not cover (e.g. a backbone-only checkpoint) get 'weights_init_normal'.
+    """
+    if not model_weights:
+        model = Darknet(model_cfg, img_size=img_size).to(device)
+        model.apply(weights_init_normal)
+        return model
+
+    state_dict = torch.load(model_weights, map_location="cpu") if model_weights.endswith(".pth") else None
+    if state_dict is not None and "quantization" in state_dict:
+        # int8 models saved by quantize.py, they only run on the CPU
+        model = Darknet(model_cfg, img_size=img_size, device="meta").to_empty(device="cpu")
+        return load_quantized_model(model, state_dict)
+
+    model = Darknet(model_cfg, img_size=img_size, device="meta")
+    if model_weights.endswith(".ckpt"):
+        # Parameters become views of the mapped checkpoint, nothing is allocated for them
+        loaded_layers = model.load_checkpoint(model_weights, assign=True)
+    else:
+        model.to_empty(device=device)
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.num_batches_tracked.zero_()
+        if state_dict is not None:
+            # Resumable training checkpoints hold the model weights under "model"
+            model.load_state_dict(state_dict.get("model", state_dict))
+            loaded_layers = len(model.module_list)
+        else:
+            loaded_layers = model.load_darknet_weights(model_weights)
+
+    for module in model.module_list[loaded_layers:]:
+        module.to_empty(device=device)
+        for layer in module.modules():
+            if isinstance(layer, (nn.Conv2d, nn.BatchNorm2d)):
+                layer.reset_parameters()
+        module.apply(weights_init_normal)
+
+    return model.to(device)
+
+
+def evaluate(model, path, iou_thres, conf_thres, nms_thres, img_size, batch_size, n_cpu=1):
     
     model.eval()
 
     # Get dataloader
     dataset = ListDataset(path, img_size=img_size, augment=False, multiscale=False)
     dataloader = torch.utils.data.DataLoader(
-        dataset, batch_size=batch_size, shuffle=False, num_workers=1, collate_fn=dataset.collate_fn
+        dataset, batch_size=batch_size, shuffle=False, num_workers=n_cpu, collate_fn=dataset.collate_fn
     )
 
     Tensor = torch.cuda.FloatTensor if torch.cuda.is_available() else torch.FloatTensor
@@ -397,49 +771,313 @@ def evaluate(model, path, iou_thres, conf_thres, nms_thres, img_size, batch_size
     return precision, recall, AP, f1, ap_class
 
 
+def _evaluation_worker(model_cfg, weights_path, epoch, eval_kwargs, n_threads, precision, channels_last, results):
+    """ Entry point of the AsyncEvaluator processes """
+    torch.set_num_threads(n_threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(model_cfg, weights_path, img_size=eval_kwargs["img_size"], device=device)
+    model.set_precision(precision, channels_last)
+    results.put((epoch, *evaluate(model, **eval_kwargs)))
+
+
+class AsyncEvaluator(object):
+    """
+    Runs 'evaluate' on saved weights in a separate process, so training continues meanwhile.
+    Evaluations run one at a time in submission order, results are collected with poll().
+    """
+
+    def __init__(self, model_cfg, path, iou_thres, conf_thres, nms_thres, img_size, batch_size, n_cpu=1, n_threads=1,
+                 precision="fp32", channels_last=False):
+        self.model_cfg = model_cfg
+        self.eval_kwargs = dict(
+            path=path, iou_thres=iou_thres, conf_thres=conf_thres, nms_thres=nms_thres,
+            img_size=img_size, batch_size=batch_size, n_cpu=n_cpu,
+        )
+        self.n_threads = n_threads
+        self.precision = precision
+        self.channels_last = channels_last
+        self.context = torch.multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.pending = []  # (epoch, weights_path) waiting for the running evaluation to finish
+        self.running = None  # (epoch, process)
+
+    def submit(self, epoch, weights_path):
+        self.pending.append((epoch, weights_path))
+        self._start_next()
+
+    def poll(self):
+        """ Returns the finished evaluations as (epoch, precision, recall, AP, f1, ap_class) without blocking """
+        finished = []
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        if self.running is not None and not self.running[1].is_alive():
+            epoch, process = self.running
+            process.join()
+            if process.exitcode != 0 and epoch not in [result[0] for result in finished]:
+                print(f"---- Evaluation of epoch {epoch} failed with exit code {process.exitcode} ----")
+                finished.append((epoch, None, None, None, None, None))
+            self.running = None
+        self._start_next()
+        return finished
+
+    def close(self):
+        """ Waits for every submitted evaluation and returns the results poll() has not returned yet """
+        finished = []
+        while self.running is not None or self.pending:
+            if self.running is not None:
+                self.running[1].join()
+            finished += self.poll()
+        return finished
+
+    def _start_next(self):
+        if self.running is not None or not self.pending:
+            return
+        epoch, weights_path = self.pending.pop(0)
+        process = self.context.Process(
+            target=_evaluation_worker,
+            args=(
+                self.model_cfg, weights_path, epoch, self.eval_kwargs, self.n_threads,
+                self.precision, self.channels_last, self.results,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self.running = (epoch, process)
+
+
+def log_evaluation(logger, class_names, epoch, precision, recall, AP, f1, ap_class):
+    """ Logs the results of 'evaluate' for 'epoch' and prints the class APs """
+    evaluation_metrics = [
+        ("val_precision", precision.mean()),
+        ("val_recall", recall.mean()),
+        ("val_mAP", AP.mean()),
+        ("val_f1", f1.mean()),
+    ]
+    logger.list_of_scalars_summary(evaluation_metrics, epoch)
+
+    # Print class APs and mAP
+    ap_table = [["Index", "Class name", "AP"]]
+    for i, c in enumerate(ap_class):
+        ap_table += [[c, class_names[c], "%.5f" % AP[i]]]
+    print(AsciiTable(ap_table).table)
+    print(f"---- mAP {AP.mean()} (epoch {epoch})")
+
+
+def training_state(epoch, model, optimizer, dataset):
+    """ Everything needed to resume training right after 'epoch' """
+    np_state = np.random.get_state()
+    return {
+        "epoch": epoch,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "seen": int(model.seen),
+        # Position in the multiscale schedule of ListDataset.collate_fn
+        "multiscale": {"img_size": dataset.img_size, "batch_count": dataset.batch_count},
+        "rng": {
+            "torch": torch.get_rng_state(),
+            "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+            "numpy": [np_state[0], torch.from_numpy(np_state[1].astype(np.int64)), *np_state[2:]],
+            "random": random.getstate(),
+        },
+    }
+
+
+def restore_training_state(state, model, optimizer, dataset):
+    """ Restores a 'training_state' into 'model', 'optimizer', 'dataset' and the RNGs, returns the next epoch """
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    model.seen = state["seen"]
+    dataset.img_size = state["multiscale"]["img_size"]
+    dataset.batch_count = state["multiscale"]["batch_count"]
+
+    rng = state["rng"]
+    torch.set_rng_state(rng["torch"])
+    if rng["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng["cuda"])
+    name, keys, *rest = rng["numpy"]
+    np.random.set_state((name, keys.numpy().astype(np.uint32), *rest))
+    version, internal_state, gauss_next = rng["random"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+    return state["epoch"] + 1
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _distributed_train(rank, train_kwargs):
+    """ Entry point of the processes spawned by train(world_size > 1) """
+    torch.distributed.init_process_group(
+        "gloo", rank=rank, world_size=train_kwargs["world_size"],
+        timeout=datetime.timedelta(minutes=train_kwargs["distributed_timeout"]),
+    )
+    try:
+        train(**train_kwargs)
+    finally:
+        torch.distributed.destroy_process_group()
+
+
 def train(model_cfg, model_weights, data_cfg, img_size, 
           epochs=100, batch_size=8, gradient_accumulations=2,
           checkpoint_interval=5, evaluation_interval=5,
           compute_map=False, multiscale_training=True,
           freeze_model_to=0,
-          n_cpu=8):
-    
-    logger = Logger("logs")
+          n_cpu=8,
+          resume=False, keep_checkpoints=3,
+          async_evaluation=False, evaluation_n_cpu=1, evaluation_threads=1,
+          world_size=1, threads_per_rank=None, master_port=None, distributed_timeout=120,
+          activation_checkpointing=None,
+          precision="fp32", channels_last=False,
+          qat=False, qat_backend="fbgemm", qat_freeze_bn_epoch=None, qat_freeze_observer_epoch=None,
+          teacher_cfg=None, teacher_weights=None, distillation_weight=1.0, distillation_cache=None,
+          feature_cache=None):
+    """
+    Trains the model described by 'model_cfg' on the data in 'data_cfg'.
+    With world_size > 1, spawns world_size local processes training on shards of the dataset with
+    torch.distributed (gloo backend); gradients are all-reduced, only rank 0 logs, evaluates and checkpoints.
+    The other ranks wait for it in a barrier at the end of every epoch, which times out (like every collective)
+    after 'distributed_timeout' minutes, so it must exceed the evaluation time. 'master_port' defaults to
+    $MASTER_PORT, or a free port.
+    An 'evaluation_interval' or 'checkpoint_interval' of 0 disables evaluation or checkpointing.
+    With 'async_evaluation', the evaluations run in a background process on the checkpoint of the epoch, or on
+    a temporary weights-only file when the epoch has no checkpoint, without waiting for the file to be written.
+    'activation_checkpointing' selects the segments recomputed in backward (see Darknet.set_activation_checkpointing).
+    'precision' ("fp32" or "bf16") and 'channels_last' configure the conv stack (see Darknet.set_precision).
+    With 'qat', fine-tunes 'model_weights' with fake-quantization inserted in the conv layers, freezes the batch
+    norm statistics from 'qat_freeze_bn_epoch' and the observers from 'qat_freeze_observer_epoch', and finally
+    writes the converted int8 model to checkpoints/yolov3_int8.pth (loadable with load_model).
+    With a 'teacher_cfg', a frozen teacher runs on every batch and 'distillation_weight' times the soft loss
+    between its heads and the student ones is added (see utils/distillation.py). With a 'distillation_cache'
+    directory the teacher outputs are cached on disk and the training images are no longer augmented, so
+    every epoch after the first reuses them.
+    With a 'feature_cache' directory, the outputs of the layers frozen by 'freeze_model_to' are computed once per
+    image and resolution (in eval mode, without augmentation) and only the trainable layers run afterwards.
+    Returns the trained model (None in the process spawning a distributed run).
+    """
+    if qat and async_evaluation:
+        raise ValueError("Background evaluation can't load quantization-aware training checkpoints")
+    if qat and (activation_checkpointing or precision != "fp32" or channels_last):
+        raise ValueError("Quantization-aware training doesn't support activation checkpointing, bf16 or channels_last")
+    if qat and teacher_cfg:
+        raise ValueError("Distillation isn't supported with quantization-aware training")
+    if feature_cache and (qat or not freeze_model_to):
+        raise ValueError("The feature cache needs frozen layers (freeze_model_to) and no quantization-aware training")
+    if world_size > 1 and not torch.distributed.is_initialized():
+        train_kwargs = dict(
+            model_cfg=model_cfg, model_weights=model_weights, data_cfg=data_cfg, img_size=img_size,
+            epochs=epochs, batch_size=batch_size, gradient_accumulations=gradient_accumulations,
+            checkpoint_interval=checkpoint_interval, evaluation_interval=evaluation_interval,
+            compute_map=compute_map, multiscale_training=multiscale_training,
+            freeze_model_to=freeze_model_to,
+            n_cpu=n_cpu,
+            resume=resume, keep_checkpoints=keep_checkpoints,
+            async_evaluation=async_evaluation, evaluation_n_cpu=evaluation_n_cpu, evaluation_threads=evaluation_threads,
+            world_size=world_size, threads_per_rank=threads_per_rank,
+            master_port=master_port, distributed_timeout=distributed_timeout,
+            activation_checkpointing=activation_checkpointing,
+            precision=precision, channels_last=channels_last,
+            qat=qat, qat_backend=qat_backend, qat_freeze_bn_epoch=qat_freeze_bn_epoch,
+            qat_freeze_observer_epoch=qat_freeze_observer_epoch,
+            teacher_cfg=teacher_cfg, teacher_weights=teacher_weights, distillation_weight=distillation_weight,
+            distillation_cache=distillation_cache,
+            feature_cache=feature_cache,
+        )
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        # A free port unless one is given, so concurrent jobs on one host don't collide
+        if master_port:
+            os.environ["MASTER_PORT"] = str(master_port)
+        elif "MASTER_PORT" not in os.environ:
+            os.environ["MASTER_PORT"] = str(_free_port())
+        torch.multiprocessing.spawn(_distributed_train, args=(train_kwargs,), nprocs=world_size)
+        return
+
+    rank = torch.distributed.get_rank() if world_size > 1 else 0
+    is_main = rank == 0
+    if world_size > 1:
+        # Split the cores between the ranks instead of letting every rank use all of them
+        torch.set_num_threads(threads_per_rank or max(1, os.cpu_count() // world_size))
+
+    logger = Logger("logs") if is_main else None
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     os.makedirs("output", exist_ok=True)
     os.makedirs("checkpoints", exist_ok=True)
 
+    # Checkpoints are written in the background, the last 'keep_checkpoints' and the best mAP one are kept
+    checkpoints = None
+    resume_path = None
+    if is_main:
+        checkpoints = CheckpointManager("checkpoints", prefix="yolov3_ckpt", keep_last=keep_checkpoints)
+        resume_path = checkpoints.latest() if resume else None
+    if world_size > 1:
+        resume_paths = [resume_path]
+        torch.distributed.broadcast_object_list(resume_paths, src=0)
+        resume_path = resume_paths[0]
+    if resume_path:
+        if is_main:
+            print(f"---- Resuming from {resume_path} ----")
+        # Quantization-aware checkpoints are restored into the prepared model below
+        if not qat:
+            model_weights = resume_path
+
     # Get data configuration
     data_cfg = parse_data_config(data_cfg)
     train_path = data_cfg["train"]
     valid_path = data_cfg["valid"]
     class_names = load_classes(data_cfg["names"])
 
-    # Initiate model
-    model = Darknet(model_cfg).to(device)
-    model.apply(weights_init_normal)
-
-    # If specified we start from checkpoint
-    if model_weights:
-        if model_weights.endswith(".pth"):
-            model.load_state_dict(torch.load(model_weights))
-        else:
-            model.load_darknet_weights(model_weights)
+    # Initiate model, if specified we start from checkpoint
+    model = load_model(model_cfg, model_weights, img_size=img_size, device=device)
 
     if freeze_model_to:
         freeze_model_until_layer(model, freeze_model_to)
+
+    # Trade compute for memory by recomputing the outputs of cfg segments in backward
+    model.set_activation_checkpointing(activation_checkpointing)
+    model.set_precision(precision, channels_last)
+
+    # Fake-quantization observers are inserted into the (fused) conv layers
+    if qat:
+        model = prepare_quantization(model, backend=qat_backend, qat=True)
+
+    # The teacher is frozen and always runs in fp32 eval mode
+    teacher = None
+    if teacher_cfg:
+        teacher = TeacherOutputs(load_model(teacher_cfg, teacher_weights, img_size=img_size, device=device), distillation_cache)
+    student_anchors = [yolo.anchors for yolo in model.yolo_layers]
+
+    # Every rank starts from the weights of rank 0 and all-reduces its gradients
+    train_model = model
+    if world_size > 1:
+        train_model = torch.nn.parallel.DistributedDataParallel(model)
     
-    # Get dataloader
-    dataset = ListDataset(train_path, augment=True, multiscale=multiscale_training)
+    # Get dataloader, each rank iterates over its own shard
+    # Cached teacher outputs and features depend on the image tensors, augmentation would make them stale
+    augment = distillation_cache is None and feature_cache is None
+    dataset = ListDataset(train_path, augment=augment, multiscale=multiscale_training)
+    sampler = None
+    if world_size > 1:
+        sampler = torch.utils.data.distributed.DistributedSampler(dataset, num_replicas=world_size, rank=rank)
     dataloader = torch.utils.data.DataLoader(
         dataset,
         batch_size=batch_size,
-        shuffle=True,
+        shuffle=sampler is None,
+        sampler=sampler,
         num_workers= n_cpu,
         pin_memory= True,
         collate_fn=dataset.collate_fn,
     )
 
+    features = None
+    if feature_cache:
+        img_files = [path.rstrip() for path in dataset.img_files]
+        features = FeatureCache(model, freeze_model_to, img_files, feature_cache)
+
     optimizer = torch.optim.Adam(model.parameters())
 
     metrics = [ "grid_size", "loss",
@@ -449,26 +1087,81 @@ def train(model_cfg, model_weights, data_cfg, img_size,
     "conf_obj", "conf_noobj",
     ]
 
-    for epoch in range(epochs):
-
+    # Evaluations of saved checkpoints run in a separate process while training continues
+    evaluator = None
+    if async_evaluation and is_main:
+        evaluator = AsyncEvaluator(
+            model_cfg, valid_path, iou_thres=0.5, conf_thres=0.5, nms_thres=0.5, img_size=img_size, batch_size=8,
+            n_cpu=evaluation_n_cpu, n_threads=evaluation_threads, precision=precision, channels_last=channels_last,
+        )
+        # Weights of the evaluated epochs without a training checkpoint, deleted once evaluated
+        evaluation_weights = CheckpointManager("checkpoints", prefix="yolov3_eval", keep_last=0)
+    awaiting_evaluation = {}  # Epoch -> CheckpointManager writing its weights, submitted once they are on disk
+    evaluating = {}  # Epoch -> CheckpointManager holding the weights being evaluated
+
+    def submit_written_weights():
+        for eval_epoch, manager in list(awaiting_evaluation.items()):
+            if manager.saved(eval_epoch):
+                evaluator.submit(eval_epoch, manager.path(eval_epoch))
+                evaluating[eval_epoch] = awaiting_evaluation.pop(eval_epoch)
+
+    def log_async_evaluations(finished):
+        for eval_epoch, precision, recall, AP, f1, ap_class in finished:
+            if AP is not None:
+                print(f"\n---- Evaluation of epoch {eval_epoch} finished ----")
+                log_evaluation(logger, class_names, eval_epoch, precision, recall, AP, f1, ap_class)
+                checkpoints.set_metric(eval_epoch, float(AP.mean()))
+            evaluating.pop(eval_epoch).release(eval_epoch)
+
+    start_epoch = 0
+    if resume_path:
+        start_epoch = restore_training_state(torch.load(resume_path, map_location=device), model, optimizer, dataset)
+
+    for epoch in range(start_epoch, epochs):
+
+        val_mAP = None
         model.train()
         start_time = time.time()
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+
+        if qat and qat_freeze_bn_epoch is not None and epoch >= qat_freeze_bn_epoch:
+            model.apply(torch.ao.nn.intrinsic.qat.freeze_bn_stats)
+        if qat and qat_freeze_observer_epoch is not None and epoch >= qat_freeze_observer_epoch:
+            model.apply(torch.ao.quantization.disable_observer)
 
-        for batch_i, (_, imgs, targets) in enumerate(dataloader):
+        for batch_i, (img_paths, imgs, targets) in enumerate(dataloader):
             batches_done = len(dataloader) * epoch + batch_i
 
             imgs = imgs.to(device)
             targets = targets.to(device)
+            forward_kwargs = {}
+            if features is not None:
+                forward_kwargs["layer_outputs"] = features(img_paths, imgs)
+
+            # Gradients are only all-reduced on the batches that end with an optimizer step
+            step = batches_done % gradient_accumulations
+            with contextlib.nullcontext() if step or world_size == 1 else train_model.no_sync():
+                if teacher is None:
+                    loss, outputs = train_model(imgs, targets, **forward_kwargs)
+                else:
+                    heads = []
+                    loss, outputs = train_model(imgs, targets, heads=heads, **forward_kwargs)
+                    distill_loss = distillation_loss(heads, teacher(imgs), student_anchors, teacher.anchors)
+                    loss = loss + distillation_weight * distill_loss
 
-            loss, outputs = model(imgs, targets)
-
-            loss.backward()
+                loss.backward()
 
-            if batches_done % gradient_accumulations:
+            if step:
                 # Accumulates gradient before each step
                 optimizer.step()
                 optimizer.zero_grad()
 
+            model.seen += imgs.size(0) * world_size
+
+            if not is_main:
+                continue
+
             # ----------------
             #   Log progress
             # ----------------
@@ -492,10 +1185,18 @@ def train(model_cfg, model_weights, data_cfg, img_size,
                         if name != "grid_size":
                             tensorboard_log += [(f"{name}_{j+1}", metric)]
                 tensorboard_log += [("loss", loss.item())]
+                if teacher is not None:
+                    tensorboard_log += [("distillation", distill_loss.item())]
                 logger.list_of_scalars_summary(tensorboard_log, batches_done)
 
             log_str += AsciiTable(metric_table).table
             log_str += f"\nTotal loss {loss.item()}"
+            if teacher is not None:
+                log_str += f"\nDistillation loss {distill_loss.item()}"
+                if teacher.cache_dir is not None:
+                    log_str += f", teacher cache hits {teacher.hits}/{teacher.hits + teacher.misses}"
+            if features is not None:
+                log_str += f"\nFeature cache hits {features.hits}/{features.hits + features.misses}"
 
             # Determine approximate time left for epoch
             epoch_batches_left = len(dataloader) - (batch_i + 1)
@@ -504,9 +1205,31 @@ def train(model_cfg, model_weights, data_cfg, img_size,
 
             print(log_str)
 
-            model.seen += imgs.size(0)
-
-        if epoch % evaluation_interval == 0:
+            if evaluator is not None:
+                submit_written_weights()
+                log_async_evaluations(evaluator.poll())
+
+        if not is_main:
+            if world_size > 1:
+                # Wait for the evaluation and checkpoint of rank 0 here rather than in the next all-reduce
+                torch.distributed.barrier()
+            continue
+
+        evaluation_epoch = evaluation_interval and epoch % evaluation_interval == 0
+        checkpoint_epoch = checkpoint_interval and epoch % checkpoint_interval == 0
+
+        if evaluation_epoch and evaluator is not None:
+            # The weights are handed to the evaluation process once written in the background: the checkpoint
+            # of this epoch if there is one, a weights-only file otherwise
+            print("\n---- Evaluating Model in the background ----")
+            if checkpoint_epoch:
+                checkpoints.hold(epoch)
+                awaiting_evaluation[epoch] = checkpoints
+            else:
+                evaluation_weights.hold(epoch)
+                evaluation_weights.save(epoch, {"model": model.state_dict()})
+                awaiting_evaluation[epoch] = evaluation_weights
+        elif evaluation_epoch:
             print("\n---- Evaluating Model ----")
             # Evaluate the model on the validation set
             precision, recall, AP, f1, ap_class = evaluate(
@@ -518,23 +1241,29 @@ def train(model_cfg, model_weights, data_cfg, img_size,
                 img_size=img_size,
                 batch_size=8,
             )
-            evaluation_metrics = [
-                ("val_precision", precision.mean()),
-                ("val_recall", recall.mean()),
-                ("val_mAP", AP.mean()),
-                ("val_f1", f1.mean()),
-            ]
-            logger.list_of_scalars_summary(evaluation_metrics, epoch)
+            log_evaluation(logger, class_names, epoch, precision, recall, AP, f1, ap_class)
+            val_mAP = float(AP.mean())
+
+        if checkpoint_epoch:
+            checkpoints.save(epoch, training_state(epoch, model, optimizer, dataset), metric=val_mAP)
+
+        if world_size > 1:
+            torch.distributed.barrier()
+
+    if evaluator is not None:
+        checkpoints.wait()
+        evaluation_weights.wait()
+        submit_written_weights()
+        log_async_evaluations(evaluator.close())
+        evaluation_weights.close()
+    if checkpoints is not None:
+        checkpoints.close()
 
-            # Print class APs and mAP
-            ap_table = [["Index", "Class name", "AP"]]
-            for i, c in enumerate(ap_class):
-                ap_table += [[c, class_names[c], "%.5f" % AP[i]]]
-            print(AsciiTable(ap_table).table)
-            print(f"---- mAP {AP.mean()}")
+    if qat and is_main:
+        save_quantized_model(convert_quantized(model), "checkpoints/yolov3_int8.pth", backend=qat_backend)
+        print("---- Saved int8 model to checkpoints/yolov3_int8.pth ----")
 
-        if epoch % checkpoint_interval == 0:
-            torch.save(model.state_dict(), f"checkpoints/yolov3_ckpt_%d.pth" % epoch)
+    return model
 
 
 def freeze_model_until_layer(model, freeze_until_layer):
@@ -0,0 +1,69 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.parse_config import *
+from utils.prune import *
+
+import argparse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structured channel pruning of a Darknet model by batch norm gamma")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--data_config", type=str, default="config/coco.data", help="path to data config file")
+    parser.add_argument("--output_def", type=str, default="config/yolov3-pruned.cfg", help="path of the pruned model definition")
+    parser.add_argument("--output_weights", type=str, default="weights/yolov3-pruned.weights", help="path of the pruned weights")
+    parser.add_argument("--ratio", type=float, default=0.5, help="fraction of the prunable channels to remove")
+    parser.add_argument("--min_keep", type=float, default=0.1, help="minimum fraction of channels kept in every layer")
+    parser.add_argument("--divisor", type=int, default=8, help="round the kept channels of every layer to a multiple of this")
+    parser.add_argument("--finetune_epochs", type=int, default=0, help="number of fine-tuning epochs of the pruned model")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of each image batch")
+    parser.add_argument("--n_cpu", type=int, default=4, help="number of cpu threads to use during batch generation")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--latency_runs", type=int, default=20, help="number of forwards used to measure latency")
+    parser.add_argument("--skip_eval", action="store_true", help="don't compute the mAP of the models")
+    opt = parser.parse_args()
+    print(opt)
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    masks = select_channels(model, opt.ratio, min_keep=opt.min_keep, divisor=opt.divisor)
+    module_defs = prune_module_defs(model, masks)
+    write_model_config(opt.output_def, model.hyperparams, module_defs)
+
+    pruned_model = copy_pruned_weights(model, Darknet(opt.output_def, img_size=opt.img_size), masks)
+    pruned_model.save_darknet_weights(opt.output_weights, cutoff=len(pruned_model.module_list))
+    print(f"Saved pruned model to {opt.output_def} and {opt.output_weights}")
+
+    # Reload through the regular loader, so the report covers exactly what was written
+    pruned_model = load_model(opt.output_def, opt.output_weights, img_size=opt.img_size)
+    candidates = [("original", opt.model_def, model), ("pruned", opt.output_def, pruned_model)]
+    if opt.finetune_epochs:
+        print("\nFine-tuning the pruned model:")
+        finetuned_model = train(
+            opt.output_def, opt.output_weights, opt.data_config, opt.img_size,
+            epochs=opt.finetune_epochs, batch_size=opt.batch_size, checkpoint_interval=0, evaluation_interval=0,
+            n_cpu=opt.n_cpu,
+        )
+        finetuned_model.save_darknet_weights(opt.output_weights, cutoff=len(finetuned_model.module_list))
+        print(f"Saved fine-tuned weights to {opt.output_weights}")
+        candidates.append(("fine-tuned", opt.output_def, finetuned_model))
+
+    valid_path = parse_data_config(opt.data_config)["valid"]
+    table = [["Model", "GFLOPs", "Parameters", "Latency (ms)", "mAP"]]
+    for name, model_def, m in candidates:
+        m.eval()
+        flops = count_flops(parse_model_config(model_def)[1:], int(m.hyperparams["channels"]), opt.img_size)
+        num_params = sum(p.numel() for p in m.parameters())
+        latency = measure_latency(m, opt.img_size, opt.latency_runs)
+        mAP = float("nan")
+        if not opt.skip_eval:
+            print(f"\nEvaluating {name} model:")
+            _, _, AP, _, _ = evaluate(
+                m, path=valid_path, iou_thres=0.5, conf_thres=0.001, nms_thres=0.5,
+                img_size=opt.img_size, batch_size=opt.batch_size, n_cpu=opt.n_cpu,
+            )
+            mAP = AP.mean()
+        table += [[name, "%.2f" % (flops / 1e9), "%d" % num_params, "%.2f" % latency, "%.5f" % mAP]]
+    print(AsciiTable(table).table)
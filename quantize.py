@@ -0,0 +1,63 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.datasets import *
+from utils.parse_config import *
+from utils.quantization import *
+
+import argparse
+
+import torch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-training static int8 quantization of a Darknet model")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--data_config", type=str, default="config/coco.data", help="path to data config file")
+    parser.add_argument("--output", type=str, default="weights/yolov3_int8.pth", help="path of the quantized model")
+    parser.add_argument("--backend", type=str, default="fbgemm", help="quantized engine: fbgemm (x86) or qnnpack (arm)")
+    parser.add_argument("--calib_images", type=int, default=100, help="number of training images used for calibration")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of each image batch")
+    parser.add_argument("--n_cpu", type=int, default=4, help="number of cpu threads to use during batch generation")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--latency_runs", type=int, default=20, help="number of forwards used to measure latency")
+    parser.add_argument("--skip_eval", action="store_true", help="don't compute the fp32 and int8 mAP")
+    opt = parser.parse_args()
+    print(opt)
+
+    data_config = parse_data_config(opt.data_config)
+
+    # Calibrate on un-augmented training images at the evaluation resolution
+    print("\nCalibrating on %d images:" % opt.calib_images)
+    dataset = ListDataset(data_config["train"], img_size=opt.img_size, augment=False, multiscale=False)
+    dataloader = torch.utils.data.DataLoader(
+        dataset, batch_size=opt.batch_size, shuffle=True, num_workers=opt.n_cpu, collate_fn=dataset.collate_fn
+    )
+    qmodel = prepare_quantization(load_model(opt.model_def, opt.weights_path, img_size=opt.img_size), opt.backend)
+    calibrate(qmodel, dataloader, opt.calib_images)
+    qmodel = convert_quantized(qmodel)
+    save_quantized_model(qmodel, opt.output, backend=opt.backend)
+    print(f"Saved int8 model to {opt.output}")
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    results = []
+    for name, m in [("fp32", model), ("int8", qmodel)]:
+        m.eval()
+        latency = measure_latency(m, opt.img_size, opt.latency_runs)
+        mAP = float("nan")
+        if not opt.skip_eval:
+            print(f"\nEvaluating {name} model:")
+            _, _, AP, _, _ = evaluate(
+                m, path=data_config["valid"], iou_thres=0.5, conf_thres=0.001, nms_thres=0.5,
+                img_size=opt.img_size, batch_size=opt.batch_size, n_cpu=opt.n_cpu,
+            )
+            mAP = AP.mean()
+        results.append((name, latency, mAP))
+
+    table = [["Model", "Latency (ms)", "mAP"]]
+    for name, latency, mAP in results:
+        table += [[name, "%.2f" % latency, "%.5f" % mAP]]
+    print(AsciiTable(table).table)
+    print("mAP delta: %.5f, speedup: %.2fx" % (results[1][2] - results[0][2], results[0][1] / results[1][1]))
@@ -0,0 +1,176 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.batching import *
+from utils.detection_cache import *
+
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import torch
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect   - body is an encoded image, returns {"detections": [...]} in original image coordinates,
+                     ?model=<name> selects one of the served models ("default" otherwise)
+    GET  /metrics  - latency percentiles and batch size histogram of every loaded model, model registry and
+                     detection cache statistics, failed detections per model
+    GET  /health   - liveness
+    """
+
+    server_version = "YOLOv3Server/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, model_name, error):
+        """ 500 for a model that failed to load or a failed forward, counted in /metrics """
+        with self.server.errors_lock:
+            self.server.errors[model_name] = self.server.errors.get(model_name, 0) + 1
+        self.log_error("Detection with model %s failed: %r", model_name, error)
+        self._send_json(500, {"error": f"Detection failed: {error!r}"})
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            metrics = self.server.batchers.metrics()
+            with self.server.errors_lock:
+                metrics["errors"] = dict(self.server.errors)
+            if self.server.cache is not None:
+                metrics["cache"] = self.server.cache.stats()
+            self._send_json(200, metrics)
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/detect":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        model_name = parse_qs(url.query).get("model", ["default"])[0]
+        if model_name not in self.server.class_names:
+            self._send_json(404, {"error": f"Unknown model {model_name}"})
+            return
+        class_names = self.server.class_names[model_name]
+
+        # Repeated images are answered from the cache before being decoded
+        cache = self.server.cache
+        if cache is not None:
+            try:
+                key = cache.key(data, self.server.batchers.model_key(model_name))
+            except Exception as e:
+                # e.g. the weights file can't be read
+                self._send_error(model_name, e)
+                return
+            hit, detections = cache.get(key)
+            if hit:
+                self._send_json(200, {"detections": detections_to_dicts(detections, class_names)})
+                return
+
+        start_time = time.time()
+        try:
+            img, original_shape = self.server.decode_pool.submit(decode_image, data, self.server.img_size).result()
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            # Loading the model or its forward may fail, the client gets a response either way
+            detections = self.server.batchers.submit(model_name, img).result()
+        except Exception as e:
+            self._send_error(model_name, e)
+            return
+        if detections is not None:
+            detections = rescale_boxes(detections, self.server.img_size, original_shape)
+        if cache is not None:
+            cache.put(key, detections)
+            cache.record_compute(time.time() - start_time)
+        self._send_json(200, {"detections": detections_to_dicts(detections, class_names)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(DetectionHandler, self).log_message(format, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves detections over HTTP with dynamic micro-batching")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--models", type=str, nargs="*", default=[], help="more models to serve as name=cfg,weights[,class_path]")
+    parser.add_argument("--memory_budget_mb", type=float, default=2048, help="least recently used models are unloaded above this")
+    parser.add_argument("--conf_thres", type=float, default=0.8, help="object confidence threshold")
+    parser.add_argument("--nms_thres", type=float, default=0.4, help="iou thresshold for non-maximum suppression")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--max_batch_size", type=int, default=8, help="maximum number of images per forward")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="maximum wait for a batch to fill after its first image")
+    parser.add_argument("--decode_workers", type=int, default=4, help="number of threads decoding and letterboxing images")
+    parser.add_argument("--cache_entries", type=int, default=0, help="detections of this many images cached in memory (0 disables the cache)")
+    parser.add_argument("--cache_dir", type=str, help="also store the cached detections on disk in this directory")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    opt = parser.parse_args()
+    print(opt)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # Models by name, "default" is --model_def / --weights_path
+    catalog = {"default": (opt.model_def, opt.weights_path)}
+    class_paths = {"default": opt.class_path}
+    for entry in opt.models:
+        name, _, paths = entry.partition("=")
+        paths = paths.split(",")
+        if not name or len(paths) not in [2, 3]:
+            raise ValueError(f"Invalid model {entry}, expected name=cfg,weights[,class_path]")
+        catalog[name] = (paths[0], paths[1])
+        class_paths[name] = paths[2] if len(paths) == 3 else opt.class_path
+
+    server = ThreadingHTTPServer((opt.host, opt.port), DetectionHandler)
+    server.daemon_threads = True
+    server.img_size = opt.img_size
+    server.class_names = {name: load_classes(path) for name, path in class_paths.items()}
+    server.verbose = opt.verbose
+    server.errors = {}  # model name -> failed detections
+    server.errors_lock = threading.Lock()
+    # cv2.imdecode and the resize release the GIL, decoding scales with threads
+    server.decode_pool = ThreadPoolExecutor(max_workers=opt.decode_workers)
+    # Models are loaded on their first request and unloaded past the memory budget
+    server.batchers = ModelBatchers(
+        catalog, load_model, memory_budget_mb=opt.memory_budget_mb, img_size=opt.img_size,
+        precision=opt.precision, channels_last=opt.channels_last, device=device,
+        conf_thres=opt.conf_thres, nms_thres=opt.nms_thres,
+        max_batch_size=opt.max_batch_size, max_wait=opt.max_wait_ms / 1000,
+    )
+    server.batchers.batcher("default")
+
+    server.cache = None
+    if opt.cache_entries or opt.cache_dir:
+        # Detections depend on the model (hashed per request), input size and thresholds, not only on the image
+        identity = (opt.img_size, opt.precision, opt.conf_thres, opt.nms_thres)
+        server.cache = DetectionCache(identity, max_entries=opt.cache_entries, directory=opt.cache_dir)
+
+    print(f"Serving on http://{opt.host}:{opt.port} (POST /detect, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batchers.close()
+        server.decode_pool.shutdown()
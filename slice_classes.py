@@ -0,0 +1,57 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.parse_config import *
+from utils.prune import *
+
+import argparse
+
+import torch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derives a model that only detects a subset of the classes")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--classes", type=str, required=True, help="comma separated class names or ids to keep, e.g. person,car,2")
+    parser.add_argument("--output_def", type=str, default="config/yolov3-subset.cfg", help="path of the reduced model definition")
+    parser.add_argument("--output_weights", type=str, default="weights/yolov3-subset.weights", help="path of the reduced weights")
+    parser.add_argument("--output_names", type=str, default="data/subset.names", help="path of the reduced class label file")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    opt = parser.parse_args()
+    print(opt)
+
+    classes = load_classes(opt.class_path)
+    class_ids = []
+    for name in opt.classes.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        class_ids.append(int(name) if name.isdigit() else classes.index(name))
+
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size)
+    sliced_model = slice_classes(model, class_ids)
+
+    write_model_config(opt.output_def, sliced_model.hyperparams, sliced_model.module_defs)
+    sliced_model.save_darknet_weights(opt.output_weights, cutoff=len(sliced_model.module_list))
+    with open(opt.output_names, "w") as fp:
+        fp.write("".join(classes[c] + "\n" for c in class_ids))
+    print(f"Saved the {len(class_ids)} class model to {opt.output_def}, {opt.output_weights} and {opt.output_names}")
+
+    channels = int(model.hyperparams["channels"])
+    imgs = torch.rand(1, channels, opt.img_size, opt.img_size)
+    table = [["Model", "Classes", "Network GFLOPs", "Head GFLOPs", "Decoded values per image"]]
+    for name, m in [("original", model), ("sliced", sliced_model)]:
+        m.eval()
+        with torch.no_grad():
+            outputs = m(imgs)
+        flops = count_flops(m.module_defs, channels, opt.img_size)
+        # The convs feeding the yolo layers are the only layers slicing changes
+        heads = [i - 1 for i, module_def in enumerate(m.module_defs) if module_def["type"] == "yolo"]
+        head_flops = count_flops(m.module_defs, channels, opt.img_size, layers=heads)
+        table += [[
+            name, str(outputs.size(2) - 5), "%.2f" % (flops / 1e9), "%.3f" % (head_flops / 1e9), str(outputs[0].numel())
+        ]]
+    print(AsciiTable(table).table)
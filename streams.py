@@ -0,0 +1,61 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.detection_io import *
+from utils.streams import *
+
+import json
+import argparse
+
+import torch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs detection on many video streams with one batch per tick")
+    parser.add_argument("--sources", type=str, nargs="+", required=True, help="video files, camera indices or stream urls")
+    parser.add_argument("--fake_fps", type=float, help="replay the files as live streams at this frame rate")
+    parser.add_argument("--loop", action="store_true", help="restart the files at their end")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--detections", type=str, help="write the detections of every processed frame to this jsonl file")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--conf_thres", type=float, default=0.8, help="object confidence threshold")
+    parser.add_argument("--nms_thres", type=float, default=0.4, help="iou thresshold for non-maximum suppression")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--max_batch_size", type=int, default=16, help="maximum number of streams per forward")
+    parser.add_argument("--tick_ms", type=float, default=0, help="minimum time between two batches")
+    parser.add_argument("--max_staleness_ms", type=float, help="skip frames older than this")
+    opt = parser.parse_args()
+    print(opt)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size, device=device)
+    model.set_precision(opt.precision, opt.channels_last)
+    model.eval()
+
+    classes = load_classes(opt.class_path)
+    writer = JsonlDetectionWriter(opt.detections, classes) if opt.detections else None
+
+    def on_detections(stream_id, index, frame, detections):
+        if writer is not None:
+            writer.write([f"{stream_id}#{index}"], [detections])
+
+    sources = {source: StreamSource(source, source, fps=opt.fake_fps, loop=opt.loop) for source in opt.sources}
+    scheduler = MultiStreamScheduler(
+        model, sources, img_size=opt.img_size, conf_thres=opt.conf_thres, nms_thres=opt.nms_thres,
+        max_batch_size=opt.max_batch_size, tick=opt.tick_ms / 1000,
+        max_staleness=opt.max_staleness_ms / 1000 if opt.max_staleness_ms is not None else None,
+        device=device, on_detections=on_detections,
+    )
+    try:
+        stats = scheduler.run(opt.duration)
+    except KeyboardInterrupt:
+        stats = scheduler.stats()
+    finally:
+        if writer is not None:
+            writer.close()
+    print(json.dumps(stats, indent=2))
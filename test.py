@@ -3,6 +3,7 @@ from __future__ import division
 from models import *
 from utils.utils import *
 from utils.datasets import *
+from utils.onnx_backend import *
 from utils.parse_config import *
 
 import os
@@ -68,6 +69,9 @@ if __name__ == "__main__":
     parser.add_argument("--nms_thres", type=float, default=0.5, help="iou thresshold for non-maximum suppression")
     parser.add_argument("--n_cpu", type=int, default=8, help="number of cpu threads to use during batch generation")
     parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--onnx", type=str, help="run this exported ONNX graph (without NMS) with onnxruntime instead")
     opt = parser.parse_args()
     print(opt)
 
@@ -78,13 +82,11 @@ if __name__ == "__main__":
     class_names = load_classes(data_config["names"])
 
     # Initiate model
-    model = Darknet(opt.model_def).to(device)
-    if opt.weights_path.endswith(".weights"):
-        # Load darknet weights
-        model.load_darknet_weights(opt.weights_path)
+    if opt.onnx:
+        model = OnnxDarknet(opt.onnx)
     else:
-        # Load checkpoint weights
-        model.load_state_dict(torch.load(opt.weights_path))
+        model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size, device=device)
+    model.set_precision(opt.precision, opt.channels_last)
 
     print("Compute mAP...")
 
@@ -1,164 +1,9 @@
 from __future__ import division
 
 from models import *
-from utils.logger import *
-from utils.utils import *
-from utils.datasets import *
-from utils.parse_config import *
 
-from terminaltables import AsciiTable
-
-import os
-import sys
-import time
-import datetime
 import argparse
 
-import torch
-from torch.utils.data import DataLoader
-from torchvision import datasets
-from torchvision import transforms
-from torch.autograd import Variable
-import torch.optim as optim
-
-from test import evaluate
-
-
-
-def train(model_cfg, model_weights, data_cfg, img_size, 
-          epochs=100, batch_size=8, gradient_ccumulations=2,
-          checkpoint_interval=5, evaluation_interval=5,
-          compute_map=False, multiscale_training=True,
-          n_cpu=8):
-    
-    logger = Logger("logs")
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    os.makedirs("output", exist_ok=True)
-    os.makedirs("checkpoints", exist_ok=True)
-
-    # Get data configuration
-    data_config = parse_data_config(data_cfg)
-    train_path = data_cfg["train"]
-    valid_path = data_cfg["valid"]
-    class_names = load_classes(data_cfg["names"])
-
-    # Initiate model
-    model = Darknet(model_cfg).to(device)
-    model.apply(weights_init_normal)
-
-    # If specified we start from checkpoint
-    if model_weights:
-        if model_weights.endswith(".pth"):
-            model.load_state_dict(torch.load(model_weights))
-        else:
-            model.load_darknet_weights(model_weights)
-    
-    # Get dataloader
-    dataset = ListDataset(train_path, augment=True, multiscale=multiscale_training)
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers= n_cpu,
-        pin_memory= True,
-        collate_fn=dataset.collate_fn,
-    )
-
-    optimizer = torch.optim.Adam(model.parameters())
-
-    metrics = [ "grid_size", "loss",
-    "x", "y", "w", "h",
-    "conf", "cls", "cls_acc", 
-    "recall50", "recall75", "precision",
-    "conf_obj", "conf_noobj",
-    ]
-
-    for epoch in range(epochs):
-
-        model.train()
-        start_time = time.time()
-
-        for batch_i, (_, imgs, targets) in enumerate(dataloader):
-            batches_done = len(dataloader) * epoch + batch_i
-
-            imgs = imgs.to(device)
-            targets = targets.to(device)
-
-            loss, outputs = model(imgs, targets)
-
-            loss.backward()
-
-            if batches_done % opt.gradient_accumulations:
-                # Accumulates gradient before each step
-                optimizer.step()
-                optimizer.zero_grad()
-
-            # ----------------
-            #   Log progress
-            # ----------------
-
-            log_str = "\n---- [Epoch %d/%d, Batch %d/%d] ----\n" % (epoch, epochs, batch_i, len(dataloader))
-
-            metric_table = [["Metrics", *[f"YOLO Layer {i}" for i in range(len(model.yolo_layers))]]]
-
-            # Log metrics at each YOLO layer
-            for i, metric in enumerate(metrics):
-                formats = {m: "%.6f" for m in metrics}
-                formats["grid_size"] = "%2d"
-                formats["cls_acc"] = "%.2f%%"
-                row_metrics = [formats[metric] % yolo.metrics.get(metric, 0) for yolo in model.yolo_layers]
-                metric_table += [[metric, *row_metrics]]
-
-                # Tensorboard logging
-                tensorboard_log = []
-                for j, yolo in enumerate(model.yolo_layers):
-                    for name, metric in yolo.metrics.items():
-                        if name != "grid_size":
-                            tensorboard_log += [(f"{name}_{j+1}", metric)]
-                tensorboard_log += [("loss", loss.item())]
-                logger.list_of_scalars_summary(tensorboard_log, batches_done)
-
-            log_str += AsciiTable(metric_table).table
-            log_str += f"\nTotal loss {loss.item()}"
-
-            # Determine approximate time left for epoch
-            epoch_batches_left = len(dataloader) - (batch_i + 1)
-            time_left = datetime.timedelta(seconds=epoch_batches_left * (time.time() - start_time) / (batch_i + 1))
-            log_str += f"\n---- ETA {time_left}"
-
-            print(log_str)
-
-            model.seen += imgs.size(0)
-
-        if epoch % evaluation_interval == 0:
-            print("\n---- Evaluating Model ----")
-            # Evaluate the model on the validation set
-            precision, recall, AP, f1, ap_class = evaluate(
-                model,
-                path=valid_path,
-                iou_thres=0.5,
-                conf_thres=0.5,
-                nms_thres=0.5,
-                img_size=img_size,
-                batch_size=8,
-            )
-            evaluation_metrics = [
-                ("val_precision", precision.mean()),
-                ("val_recall", recall.mean()),
-                ("val_mAP", AP.mean()),
-                ("val_f1", f1.mean()),
-            ]
-            logger.list_of_scalars_summary(evaluation_metrics, epoch)
-
-            # Print class APs and mAP
-            ap_table = [["Index", "Class name", "AP"]]
-            for i, c in enumerate(ap_class):
-                ap_table += [[c, class_names[c], "%.5f" % AP[i]]]
-            print(AsciiTable(ap_table).table)
-            print(f"---- mAP {AP.mean()}")
-
-        if epoch % checkpoint_interval == 0:
-            torch.save(model.state_dict(), f"checkpoints/yolov3_ckpt_%d.pth" % epoch)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -174,143 +19,48 @@ if __name__ == "__main__":
     parser.add_argument("--evaluation_interval", type=int, default=1, help="interval evaluations on validation set")
     parser.add_argument("--compute_map", default=False, help="if True computes mAP every tenth batch")
     parser.add_argument("--multiscale_training", default=True, help="allow for multi-scale training")
+    parser.add_argument("--freeze_model_to", type=int, default=0, help="freeze the layers up to this index")
+    parser.add_argument("--resume", action="store_true", help="resume from the latest checkpoint in checkpoints/")
+    parser.add_argument("--keep_checkpoints", type=int, default=3, help="number of recent checkpoints kept (plus the best)")
+    parser.add_argument("--async_evaluation", action="store_true", help="evaluate checkpoints in a background process")
+    parser.add_argument("--evaluation_n_cpu", type=int, default=1, help="data loading workers of the background evaluation")
+    parser.add_argument("--evaluation_threads", type=int, default=1, help="torch threads of the background evaluation")
+    parser.add_argument("--world_size", type=int, default=1, help="number of local data-parallel processes (gloo)")
+    parser.add_argument("--threads_per_rank", type=int, help="torch threads of every process, cores / world_size by default")
+    parser.add_argument("--master_port", type=int, help="rendezvous port of the processes, a free port by default")
+    parser.add_argument("--distributed_timeout", type=float, default=120, help="minutes before a collective (or the evaluation barrier) times out")
+    parser.add_argument("--activation_checkpointing", type=str, help="recompute activations in backward: block or stage")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--qat", action="store_true", help="quantization-aware fine-tuning, writes checkpoints/yolov3_int8.pth")
+    parser.add_argument("--qat_backend", type=str, default="fbgemm", help="quantized engine: fbgemm (x86) or qnnpack (arm)")
+    parser.add_argument("--qat_freeze_bn_epoch", type=int, help="freeze the batch norm statistics from this epoch")
+    parser.add_argument("--qat_freeze_observer_epoch", type=int, help="freeze the quantization observers from this epoch")
+    parser.add_argument("--teacher_cfg", type=str, help="model definition of a teacher to distill from")
+    parser.add_argument("--teacher_weights", type=str, help="weights of the teacher")
+    parser.add_argument("--distillation_weight", type=float, default=1.0, help="weight of the distillation loss")
+    parser.add_argument("--distillation_cache", type=str, help="directory caching the teacher outputs (disables augmentation)")
+    parser.add_argument("--feature_cache", type=str, help="directory caching the outputs of the frozen layers (needs --freeze_model_to)")
     opt = parser.parse_args()
     print(opt)
 
-    logger = Logger("logs")
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    os.makedirs("output", exist_ok=True)
-    os.makedirs("checkpoints", exist_ok=True)
-
-    # Get data configuration
-    data_config = parse_data_config(opt.data_config)
-    train_path = data_config["train"]
-    valid_path = data_config["valid"]
-    class_names = load_classes(data_config["names"])
-
-    # Initiate model
-    model = Darknet(opt.model_def).to(device)
-    model.apply(weights_init_normal)
-
-    # If specified we start from checkpoint
-    if opt.pretrained_weights:
-        if opt.pretrained_weights.endswith(".pth"):
-            model.load_state_dict(torch.load(opt.pretrained_weights))
-        else:
-            model.load_darknet_weights(opt.pretrained_weights)
-
-    # Get dataloader
-    dataset = ListDataset(train_path, augment=True, multiscale=opt.multiscale_training)
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=opt.batch_size,
-        shuffle=True,
-        num_workers=opt.n_cpu,
-        pin_memory=True,
-        collate_fn=dataset.collate_fn,
+    train(
+        opt.model_def, opt.pretrained_weights, opt.data_config, opt.img_size,
+        epochs=opt.epochs, batch_size=opt.batch_size, gradient_accumulations=opt.gradient_accumulations,
+        checkpoint_interval=opt.checkpoint_interval, evaluation_interval=opt.evaluation_interval,
+        compute_map=opt.compute_map, multiscale_training=opt.multiscale_training,
+        freeze_model_to=opt.freeze_model_to,
+        n_cpu=opt.n_cpu,
+        resume=opt.resume, keep_checkpoints=opt.keep_checkpoints,
+        async_evaluation=opt.async_evaluation, evaluation_n_cpu=opt.evaluation_n_cpu,
+        evaluation_threads=opt.evaluation_threads,
+        world_size=opt.world_size, threads_per_rank=opt.threads_per_rank,
+        master_port=opt.master_port, distributed_timeout=opt.distributed_timeout,
+        activation_checkpointing=opt.activation_checkpointing,
+        precision=opt.precision, channels_last=opt.channels_last,
+        qat=opt.qat, qat_backend=opt.qat_backend, qat_freeze_bn_epoch=opt.qat_freeze_bn_epoch,
+        qat_freeze_observer_epoch=opt.qat_freeze_observer_epoch,
+        teacher_cfg=opt.teacher_cfg, teacher_weights=opt.teacher_weights,
+        distillation_weight=opt.distillation_weight, distillation_cache=opt.distillation_cache,
+        feature_cache=opt.feature_cache,
     )
-
-    optimizer = torch.optim.Adam(model.parameters())
-
-    metrics = [
-        "grid_size",
-        "loss",
-        "x",
-        "y",
-        "w",
-        "h",
-        "conf",
-        "cls",
-        "cls_acc",
-        "recall50",
-        "recall75",
-        "precision",
-        "conf_obj",
-        "conf_noobj",
-    ]
-
-    for epoch in range(opt.epochs):
-        model.train()
-        start_time = time.time()
-        for batch_i, (_, imgs, targets) in enumerate(dataloader):
-            batches_done = len(dataloader) * epoch + batch_i
-
-            imgs = Variable(imgs.to(device))
-            targets = Variable(targets.to(device), requires_grad=False)
-
-            loss, outputs = model(imgs, targets)
-            loss.backward()
-
-            if batches_done % opt.gradient_accumulations:
-                # Accumulates gradient before each step
-                optimizer.step()
-                optimizer.zero_grad()
-
-            # ----------------
-            #   Log progress
-            # ----------------
-
-            log_str = "\n---- [Epoch %d/%d, Batch %d/%d] ----\n" % (epoch, opt.epochs, batch_i, len(dataloader))
-
-            metric_table = [["Metrics", *[f"YOLO Layer {i}" for i in range(len(model.yolo_layers))]]]
-
-            # Log metrics at each YOLO layer
-            for i, metric in enumerate(metrics):
-                formats = {m: "%.6f" for m in metrics}
-                formats["grid_size"] = "%2d"
-                formats["cls_acc"] = "%.2f%%"
-                row_metrics = [formats[metric] % yolo.metrics.get(metric, 0) for yolo in model.yolo_layers]
-                metric_table += [[metric, *row_metrics]]
-
-                # Tensorboard logging
-                tensorboard_log = []
-                for j, yolo in enumerate(model.yolo_layers):
-                    for name, metric in yolo.metrics.items():
-                        if name != "grid_size":
-                            tensorboard_log += [(f"{name}_{j+1}", metric)]
-                tensorboard_log += [("loss", loss.item())]
-                logger.list_of_scalars_summary(tensorboard_log, batches_done)
-
-            log_str += AsciiTable(metric_table).table
-            log_str += f"\nTotal loss {loss.item()}"
-
-            # Determine approximate time left for epoch
-            epoch_batches_left = len(dataloader) - (batch_i + 1)
-            time_left = datetime.timedelta(seconds=epoch_batches_left * (time.time() - start_time) / (batch_i + 1))
-            log_str += f"\n---- ETA {time_left}"
-
-            print(log_str)
-
-            model.seen += imgs.size(0)
-
-        if epoch % opt.evaluation_interval == 0:
-            print("\n---- Evaluating Model ----")
-            # Evaluate the model on the validation set
-            precision, recall, AP, f1, ap_class = evaluate(
-                model,
-                path=valid_path,
-                iou_thres=0.5,
-                conf_thres=0.5,
-                nms_thres=0.5,
-                img_size=opt.img_size,
-                batch_size=8,
-            )
-            evaluation_metrics = [
-                ("val_precision", precision.mean()),
-                ("val_recall", recall.mean()),
-                ("val_mAP", AP.mean()),
-                ("val_f1", f1.mean()),
-            ]
-            logger.list_of_scalars_summary(evaluation_metrics, epoch)
-
-            # Print class APs and mAP
-            ap_table = [["Index", "Class name", "AP"]]
-            for i, c in enumerate(ap_class):
-                ap_table += [[c, class_names[c], "%.5f" % AP[i]]]
-            print(AsciiTable(ap_table).table)
-            print(f"---- mAP {AP.mean()}")
-
-        if epoch % opt.checkpoint_interval == 0:
-            torch.save(model.state_dict(), f"checkpoints/yolov3_ckpt_%d.pth" % epoch)
@@ -0,0 +1,210 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import torch
+
+from utils.datasets import pad_to_square, resize
+from utils.utils import non_max_suppression
+from utils.registry import ModelRegistry
+
+
+class BatcherClosed(RuntimeError):
+    """ Raised by MicroBatcher.submit after close() """
+
+
+def letterbox_frame(frame, img_size):
+    """ Letterboxes a BGR uint8 frame like ImageFolder, returns the (3, img_size, img_size) tensor """
+    img = torch.from_numpy(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).permute(2, 0, 1).float().div_(255)
+    img, _ = pad_to_square(img, 0)
+    return resize(img, img_size)
+
+
+def decode_image(data, img_size):
+    """
+    Decodes an encoded image (jpeg, png, ...) and letterboxes it like ImageFolder.
+    Returns the (3, img_size, img_size) tensor and the original (height, width).
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Can't decode the image")
+    return letterbox_frame(img, img_size), tuple(img.shape[:2])
+
+
+def percentile(values, q):
+    """ q-th percentile (0-100) of 'values', nan if empty """
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+
+class BatchingMetrics(object):
+    """ Thread-safe latency window and batch size histogram of a MicroBatcher """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.Counter()
+        self.requests = 0
+        self.batches = 0
+
+    def record_batch(self, latencies):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes[len(latencies)] += 1
+            self.requests += len(latencies)
+            self.batches += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            requests, batches = self.requests, self.batches
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": requests / batches if batches else 0,
+            "batch_size_histogram": batch_sizes,
+            "latency_ms": {f"p{q}": 1000 * percentile(latencies, q) for q in [50, 90, 99]},
+        }
+
+
+class MicroBatcher(object):
+    """
+    Collects concurrent single-image requests into batches of at most 'max_batch_size' images, waiting at most
+    'max_wait' seconds after the first request of a batch, and runs one forward and one NMS per batch on a
+    background thread. submit returns a Future of the image detections (non_max_suppression format).
+    close() serves the requests already submitted, later submits raise BatcherClosed.
+    """
+
+    def __init__(self, model, conf_thres=0.5, nms_thres=0.4, max_batch_size=8, max_wait=0.01, device="cpu"):
+        self.model = model
+        self.conf_thres = conf_thres
+        self.nms_thres = nms_thres
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.device = device
+        self.metrics = BatchingMetrics()
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, img):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise BatcherClosed()
+            self.requests.put((img, future, time.time()))
+        return future
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve what was collected, then stop
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            imgs, futures, submit_times = zip(*batch)
+            try:
+                with torch.no_grad():
+                    outputs = self.model(torch.stack(imgs).to(self.device))
+                    detections = non_max_suppression(outputs, self.conf_thres, self.nms_thres)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            now = time.time()
+            self.metrics.record_batch([now - submit_time for submit_time in submit_times])
+            for future, image_detections in zip(futures, detections):
+                future.set_result(image_detections)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.requests.put(None)
+        self.thread.join()
+
+
+class ModelBatchers(object):
+    """
+    Serves several named models, each through its own MicroBatcher. 'catalog' maps names to
+    (model_cfg, model_weights), the models are loaded and evicted by a ModelRegistry built with 'loader'
+    (see utils/registry.py), and the batcher of an evicted model is closed.
+    """
+
+    def __init__(self, catalog, loader, memory_budget_mb=2048, img_size=416, precision="fp32", channels_last=False,
+                 device="cpu", **batcher_kwargs):
+        self.catalog = catalog
+        self.model_kwargs = dict(img_size=img_size, precision=precision, channels_last=channels_last)
+        self.batcher_kwargs = dict(batcher_kwargs, device=device)
+        self.registry = ModelRegistry(loader, memory_budget_mb=memory_budget_mb, device=device, on_evict=self._evicted)
+        self.lock = threading.Lock()
+        self.batchers = {}  # id(model) -> (name, MicroBatcher)
+
+    def batcher(self, name):
+        """ The batcher of the model 'name', loading the model if needed. Raises KeyError for an unknown name """
+        model_cfg, model_weights = self.catalog[name]
+        model = self.registry.get(model_cfg, model_weights, **self.model_kwargs)
+        with self.lock:
+            entry = self.batchers.get(id(model))
+            if entry is None or entry[1].model is not model:
+                entry = self.batchers[id(model)] = (name, MicroBatcher(model, **self.batcher_kwargs))
+            return entry[1]
+
+    def model_key(self, name):
+        """ Identity of the model 'name' (cfg path, weights hash, input size, precision...) """
+        model_cfg, model_weights = self.catalog[name]
+        return self.registry.key(model_cfg, model_weights, **self.model_kwargs)
+
+    def submit(self, name, img):
+        while True:
+            try:
+                return self.batcher(name).submit(img)
+            except BatcherClosed:
+                # Evicted between the lookup and the submit, load it again
+                continue
+
+    def _evicted(self, model):
+        with self.lock:
+            entry = self.batchers.pop(id(model), None)
+        if entry is not None:
+            entry[1].close()
+
+    def metrics(self):
+        """ Batching metrics of every loaded model, by name, and the registry statistics """
+        with self.lock:
+            batchers = list(self.batchers.values())
+        return {
+            "models": {name: batcher.metrics.snapshot() for name, batcher in batchers},
+            "registry": self.registry.stats(),
+        }
+
+    def close(self):
+        with self.lock:
+            batchers, self.batchers = list(self.batchers.values()), {}
+        for _, batcher in batchers:
+            batcher.close()
@@ -0,0 +1,255 @@
+"""
+Native checkpoint format (.ckpt):
+
+    8 bytes   magic "DNETCKPT"
+    8 bytes   little endian uint64, length of the JSON header
+    n bytes   JSON header {"version", "metadata", "tensors": [{"name", "dtype", "shape", "offset", "nbytes"}]}
+    ...       zero padding up to the next multiple of ALIGNMENT, where the data section starts
+    ...       raw little endian tensor buffers, each at 'offset' bytes from the data section start
+              ('offset' is a multiple of ALIGNMENT)
+
+Tensors are stored in state_dict order, so the tensors of a prefix of the layers form a prefix of the file.
+"""
+
+import json
+import os
+import queue
+import re
+import struct
+import threading
+
+import numpy as np
+import torch
+
+
+MAGIC = b"DNETCKPT"
+VERSION = 1
+ALIGNMENT = 64
+
+_DTYPES = {
+    torch.float32: "float32",
+    torch.float16: "float16",
+    torch.float64: "float64",
+    torch.bfloat16: "bfloat16",
+    torch.int64: "int64",
+    torch.int32: "int32",
+    torch.int8: "int8",
+    torch.uint8: "uint8",
+    torch.bool: "bool",
+}
+
+
+def _layer_index(name):
+    """ Index of the Darknet layer a state_dict entry belongs to ('module_list.<i>.'), None otherwise """
+    match = re.match(r"module_list\.(\d+)\.", name)
+    return int(match.group(1)) if match else None
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_checkpoint(path, state_dict, metadata=None, cutoff=None):
+    """
+    Writes 'state_dict' to 'path' in the native checkpoint format
+    :param metadata: JSON serializable dict stored in the header
+    :param cutoff: only save the tensors of layers between 0 and cutoff (cutoff = None -> all are saved)
+    """
+    tensors = []
+    for name, tensor in state_dict.items():
+        layer_i = _layer_index(name)
+        if cutoff is not None and layer_i is not None and layer_i >= cutoff:
+            continue
+        tensors.append((name, tensor.detach().cpu().contiguous()))
+
+    entries, offset = [], 0
+    for name, tensor in tensors:
+        nbytes = tensor.numel() * tensor.element_size()
+        entries.append(
+            {"name": name, "dtype": _DTYPES[tensor.dtype], "shape": list(tensor.shape), "offset": offset, "nbytes": nbytes}
+        )
+        offset = _align(offset + nbytes)
+    header = {"version": VERSION, "metadata": metadata or {}, "tensors": entries}
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for (name, tensor), entry in zip(tensors, entries):
+            f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            f.write(tensor.numpy().tobytes())
+
+
+def read_checkpoint_header(path):
+    """ Returns the JSON header of the checkpoint at 'path', with the data section start under "data_start" """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a native checkpoint")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len).decode())
+    header["data_start"] = _align(len(MAGIC) + 8 + header_len)
+    if header["version"] > VERSION:
+        raise ValueError(f"{path} has unsupported checkpoint version {header['version']}")
+    return header
+
+
+def load_checkpoint(path, cutoff=None):
+    """
+    Memory-maps the checkpoint at 'path' and returns (state_dict, metadata). The tensors are zero-copy,
+    copy-on-write views of the mapped file.
+    :param cutoff: only return the tensors of layers between 0 and cutoff (cutoff = None -> all are returned)
+    """
+    header = read_checkpoint_header(path)
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+
+    state_dict = {}
+    for entry in header["tensors"]:
+        layer_i = _layer_index(entry["name"])
+        if cutoff is not None and layer_i is not None and layer_i >= cutoff:
+            continue
+        start = header["data_start"] + entry["offset"]
+        raw = buffer[start : start + entry["nbytes"]]
+        if entry["dtype"] == "bfloat16":
+            tensor = torch.from_numpy(raw.view(np.int16)).view(torch.bfloat16)
+        else:
+            tensor = torch.from_numpy(raw.view(entry["dtype"]))
+        state_dict[entry["name"]] = tensor.view(entry["shape"])
+
+    return state_dict, header["metadata"]
+
+
+def _to_host(state):
+    """ Recursively copies every tensor in 'state' to host memory, so it can't be modified by training """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _to_host(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_host(value) for value in state)
+    return state
+
+
+class CheckpointManager(object):
+    """
+    Writes training checkpoints '<directory>/<prefix>_<epoch>.pth' from a background thread.
+    save() snapshots the state to host memory and returns, the file is written to a temporary path and
+    renamed into place once complete, so a checkpoint on disk is never partially written.
+    The last 'keep_last' checkpoints and the one with the best metric are kept, older ones are deleted.
+    """
+
+    def __init__(self, directory="checkpoints", prefix="yolov3_ckpt", keep_last=3):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        os.makedirs(directory, exist_ok=True)
+
+        # Epoch -> metric (None if not evaluated) of the checkpoints on disk, persisted next to them
+        self.index_path = os.path.join(directory, f"{prefix}_index.json")
+        self.checkpoints = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.checkpoints = {int(epoch): metric for epoch, metric in json.load(f).items()}
+            self.checkpoints = {epoch: m for epoch, m in self.checkpoints.items() if os.path.exists(self.path(epoch))}
+
+        self.held = set()  # Epochs that must not be deleted yet (e.g. still being read by an evaluator)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=1)  # At most one snapshot waits while another one is written
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def path(self, epoch):
+        return os.path.join(self.directory, f"{self.prefix}_{epoch}.pth")
+
+    def latest(self):
+        """ Path of the most recent checkpoint on disk, None if there is none """
+        with self._lock:
+            return self.path(max(self.checkpoints)) if self.checkpoints else None
+
+    def best(self):
+        """ Path of the checkpoint with the best metric, None if no checkpoint has a metric """
+        with self._lock:
+            epoch = self._best_epoch()
+        return self.path(epoch) if epoch is not None else None
+
+    def saved(self, epoch):
+        """ Whether the checkpoint of 'epoch' is completely written """
+        with self._lock:
+            return epoch in self.checkpoints
+
+    def save(self, epoch, state, metric=None):
+        """ Snapshots 'state' to host memory and queues it to be written, blocks only if a write is pending """
+        self._raise_error()
+        self._queue.put((epoch, _to_host(state), metric))
+
+    def set_metric(self, epoch, metric):
+        """ Records the metric of an already saved checkpoint (e.g. evaluated after saving) """
+        with self._lock:
+            if epoch in self.checkpoints:
+                self.checkpoints[epoch] = metric
+                self._prune()
+
+    def hold(self, epoch):
+        """ Prevents the checkpoint of 'epoch' from being deleted until release(epoch) """
+        with self._lock:
+            self.held.add(epoch)
+
+    def release(self, epoch):
+        with self._lock:
+            self.held.discard(epoch)
+            self._prune()
+
+    def wait(self):
+        """ Blocks until every queued checkpoint is on disk """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            epoch, state, metric = item
+            try:
+                path = self.path(epoch)
+                torch.save(state, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                with self._lock:
+                    self.checkpoints[epoch] = metric
+                    self._prune()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _best_epoch(self):
+        scored = [(metric, epoch) for epoch, metric in self.checkpoints.items() if metric is not None]
+        return max(scored)[1] if scored else None
+
+    def _prune(self):
+        keep = set(sorted(self.checkpoints)[-self.keep_last :]) if self.keep_last > 0 else set()
+        keep.add(self._best_epoch())
+        keep |= self.held
+        for epoch in [epoch for epoch in self.checkpoints if epoch not in keep]:
+            if os.path.exists(self.path(epoch)):
+                os.remove(self.path(epoch))
+            del self.checkpoints[epoch]
+
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump(self.checkpoints, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
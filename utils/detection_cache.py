@@ -0,0 +1,98 @@
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+import torch
+
+
+class DetectionCache(object):
+    """
+    Post-NMS detections keyed by a blake2b hash of the image content (encoded bytes or a decoded array) and of
+    'identity' (model, thresholds, input size...), so repeated images skip decoding and the forward.
+    Keeps the 'max_entries' most recently used entries in memory and, with a 'directory', every entry on disk.
+    Callers report the compute of misses with record_compute, stats estimates the compute saved by the hits.
+    """
+
+    def __init__(self, identity, max_entries=10000, directory=None):
+        self.identity = repr(identity).encode()
+        self.max_entries = max_entries
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self.compute_time, self.computed = 0.0, 0
+
+    def key(self, data, *identity):
+        """ Key of 'data', optional extra 'identity' values (e.g. the model of a request) are hashed along """
+        digest = hashlib.blake2b(self.identity, digest_size=16)
+        if identity:
+            digest.update(repr(identity).encode())
+        digest.update(np.ascontiguousarray(data) if isinstance(data, np.ndarray) else data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def _remember(self, key, detections):
+        self.entries[key] = detections
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        """ Returns (hit, detections), detections is None for an image without detections """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+        if self.directory is not None:
+            try:
+                array = np.load(self._path(key))
+            except (OSError, ValueError):
+                array = None
+            if array is not None:
+                detections = torch.from_numpy(array) if len(array) else None
+                with self.lock:
+                    self._remember(key, detections)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return True, detections
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, detections):
+        with self.lock:
+            self._remember(key, detections)
+        if self.directory is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            array = detections.cpu().numpy() if detections is not None else np.zeros((0, 7), dtype=np.float32)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                np.save(fp, array)
+            os.replace(tmp_path, path)
+
+    def record_compute(self, seconds):
+        """ Time spent on a miss (decode, forward, NMS), used to estimate the compute saved by hits """
+        with self.lock:
+            self.compute_time += seconds
+            self.computed += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            mean_compute = self.compute_time / self.computed if self.computed else 0.0
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_compute_s": self.hits * mean_compute,
+            }
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+
+from utils.utils import detections_to_dicts
+
+# Column name -> dtype of the columnar format
+COLUMNS = [
+    ("image", np.int64),
+    ("x1", np.float32),
+    ("y1", np.float32),
+    ("x2", np.float32),
+    ("y2", np.float32),
+    ("object_conf", np.float32),
+    ("class_conf", np.float32),
+    ("class", np.int32),
+]
+
+
+class JsonlDetectionWriter(object):
+    """ Writes one JSON line {"path", "detections"} per image, flushed after every batch """
+
+    def __init__(self, path, class_names=None):
+        self.fp = open(path, "w")
+        self.class_names = class_names
+
+    def write(self, paths, detections):
+        for path, image_detections in zip(paths, detections):
+            record = {"path": path, "detections": detections_to_dicts(image_detections, self.class_names)}
+            self.fp.write(json.dumps(record) + "\n")
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class ColumnarDetectionWriter(object):
+    """
+    Appends detections to one raw file per column in 'directory' (see COLUMNS), readable with
+    read_columnar_detections. The "image" column indexes the lines of paths.txt.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.columns = [(open(os.path.join(directory, f"{name}.bin"), "wb"), dtype) for name, dtype in COLUMNS]
+        self.paths = open(os.path.join(directory, "paths.txt"), "w")
+        self.num_images = 0
+
+    def write(self, paths, detections):
+        rows = []
+        for path, image_detections in zip(paths, detections):
+            if image_detections is not None:
+                image_detections = image_detections.cpu().numpy()
+                image_column = np.full((len(image_detections), 1), self.num_images, dtype=np.float64)
+                rows.append(np.concatenate((image_column, image_detections), 1))
+            self.paths.write(path + "\n")
+            self.num_images += 1
+        if rows:
+            rows = np.concatenate(rows)
+            for i, (fp, dtype) in enumerate(self.columns):
+                rows[:, i].astype(dtype).tofile(fp)
+        for fp, _ in self.columns:
+            fp.flush()
+        self.paths.flush()
+
+    def close(self):
+        for fp, _ in self.columns:
+            fp.close()
+        self.paths.close()
+
+
+def read_columnar_detections(directory):
+    """ Returns (paths, {column: array}) of a ColumnarDetectionWriter output, the columns are memory-mapped """
+    with open(os.path.join(directory, "paths.txt")) as fp:
+        paths = fp.read().splitlines()
+    columns = {}
+    for name, dtype in COLUMNS:
+        path = os.path.join(directory, f"{name}.bin")
+        columns[name] = np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+    return paths, columns
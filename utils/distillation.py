@@ -0,0 +1,123 @@
+import hashlib
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utils.utils import bbox_wh_iou
+
+
+def match_heads(student_heads, teacher_heads, student_anchors, teacher_anchors):
+    """
+    Defines which teacher predictions every student prediction is trained on: the heads correspond when
+    their grids have the same size (same stride), and every student anchor takes the teacher anchor of that
+    head with the highest wh-IoU. When several teacher heads share the grid, the one whose anchors cover
+    the student ones best is used.
+    Returns a list of (student head, teacher head, teacher anchor index per student anchor).
+    """
+    matches = []
+    for s, head in enumerate(student_heads):
+        best = None
+        for t, teacher_head in enumerate(teacher_heads):
+            if teacher_head.shape[2:4] != head.shape[2:4]:
+                continue
+            t_anchors = torch.tensor(teacher_anchors[t], dtype=torch.float)
+            ious = torch.stack([bbox_wh_iou(torch.tensor(anchor, dtype=torch.float), t_anchors) for anchor in student_anchors[s]])
+            score, anchor_idx = ious.max(1)
+            if best is None or score.sum() > best[0]:
+                best = (score.sum(), t, anchor_idx)
+        if best is None:
+            raise ValueError(f"No teacher yolo layer has the {head.size(2)}x{head.size(3)} grid of student yolo layer {s}")
+        matches.append((s, best[1], best[2]))
+    return matches
+
+
+def distillation_loss(student_heads, teacher_heads, student_anchors, teacher_anchors):
+    """
+    Soft loss between the raw head outputs (see Darknet.forward_heads) of a student and a teacher predicting
+    the same classes: objectness against the teacher objectness everywhere, classes and boxes against the
+    teacher ones weighted by the teacher objectness. Teacher widths / heights are rescaled to the student anchors.
+    """
+    loss = 0
+    for s, t, anchor_idx in match_heads(student_heads, teacher_heads, student_anchors, teacher_anchors):
+        student = student_heads[s]
+        teacher = teacher_heads[t][:, anchor_idx.to(student.device)].detach()
+        if student.size(-1) != teacher.size(-1):
+            raise ValueError("The teacher and the student must predict the same classes")
+
+        t_conf = torch.sigmoid(teacher[..., 4])
+        norm = t_conf.sum() + 1e-16
+        loss_conf = F.binary_cross_entropy_with_logits(student[..., 4], t_conf)
+
+        loss_cls = F.binary_cross_entropy_with_logits(student[..., 5:], torch.sigmoid(teacher[..., 5:]), reduction="none")
+        loss_cls = (loss_cls.mean(-1) * t_conf).sum() / norm
+
+        s_anchors = torch.tensor(student_anchors[s], dtype=torch.float, device=student.device)
+        t_anchors = torch.tensor(teacher_anchors[t], dtype=torch.float, device=student.device)[anchor_idx]
+        t_wh = teacher[..., 2:4] + torch.log(t_anchors / s_anchors).view(1, -1, 1, 1, 2)
+        loss_box = ((torch.sigmoid(student[..., :2]) - torch.sigmoid(teacher[..., :2])) ** 2).sum(-1)
+        loss_box = loss_box + ((student[..., 2:4] - t_wh) ** 2).sum(-1)
+        loss_box = (loss_box * t_conf).sum() / norm
+
+        loss = loss + loss_conf + loss_cls + loss_box
+    return loss
+
+
+class TeacherOutputs(object):
+    """
+    Runs a frozen teacher Darknet and returns its raw head outputs. With a 'cache_dir', the outputs of every
+    image are stored there in fp16, keyed by a hash of the teacher weights and of the image tensor, so
+    images seen again (e.g. in later epochs without augmentation) skip the teacher forward.
+    """
+
+    def __init__(self, teacher, cache_dir=None):
+        self.teacher = teacher.eval().requires_grad_(False)
+        self.anchors = [yolo.anchors for yolo in teacher.yolo_layers]
+        self.cache_dir = None
+        self.hits, self.misses = 0, 0
+        if cache_dir is not None:
+            fingerprint = hashlib.blake2b(digest_size=8)
+            for name, tensor in teacher.state_dict().items():
+                fingerprint.update(name.encode())
+                fingerprint.update(tensor.cpu().numpy().tobytes())
+            self.cache_dir = os.path.join(cache_dir, fingerprint.hexdigest())
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, img):
+        key = hashlib.blake2b(str(tuple(img.shape)).encode(), digest_size=16)
+        key.update(img.cpu().contiguous().numpy().tobytes())
+        return os.path.join(self.cache_dir, key.hexdigest() + ".npz")
+
+    def __call__(self, imgs):
+        if self.cache_dir is None:
+            with torch.no_grad():
+                return self.teacher.forward_heads(imgs)
+
+        paths = [self._path(img) for img in imgs]
+        cached = []
+        for path in paths:
+            try:
+                with np.load(path) as f:
+                    cached.append([f[f"arr_{h}"] for h in range(len(f.files))])
+            except (OSError, ValueError):
+                cached.append(None)
+
+        missing = [i for i, outputs in enumerate(cached) if outputs is None]
+        if missing:
+            with torch.no_grad():
+                heads = self.teacher.forward_heads(imgs[missing])
+            for j, i in enumerate(missing):
+                cached[i] = [head[j].half().cpu().numpy() for head in heads]
+                # Written to a temporary file first, concurrent readers never see a partial entry
+                tmp_path = f"{paths[i]}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as fp:
+                    np.savez(fp, *cached[i])
+                os.replace(tmp_path, paths[i])
+        self.hits += len(imgs) - len(missing)
+        self.misses += len(missing)
+
+        return [
+            torch.from_numpy(np.stack([outputs[h] for outputs in cached])).float().to(imgs.device)
+            for h in range(len(cached[0]))
+        ]
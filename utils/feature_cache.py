@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+import numpy as np
+import torch
+
+
+def _open_memmap(path, dtype, shape):
+    """ Opens the memmap at 'path', creating it zero-filled if needed (safe against concurrent creators) """
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+
+class FeatureCache(object):
+    """
+    Outputs of the frozen layers 0..last_layer of a Darknet that the trainable layers read, computed once per
+    image and resolution and stored in fp16 memmaps under 'directory'. The frozen layers always run in eval
+    mode (batch norm with running statistics), so the cached outputs only depend on the image: the images
+    must not be augmented. Calling the cache with a batch returns the layer_outputs to pass to Darknet.forward.
+    """
+
+    def __init__(self, model, last_layer, img_files, directory):
+        self.model = model
+        self.last_layer = last_layer
+        self.index = {path: i for i, path in enumerate(img_files)}
+        self.layers = {last_layer}
+        for i in range(last_layer + 1, len(model.module_defs)):
+            self.layers.update(layer_i for layer_i in model.layer_inputs(i) if layer_i <= last_layer)
+        if any(model.module_defs[i]["type"] == "yolo" for i in range(last_layer + 1)):
+            raise ValueError("The cached layers can't contain a yolo layer")
+        self.layers = sorted(self.layers)
+
+        # Files of different frozen weights never mix
+        fingerprint = hashlib.blake2b(digest_size=8)
+        for name, tensor in model.module_list[: last_layer + 1].state_dict().items():
+            fingerprint.update(name.encode())
+            fingerprint.update(tensor.cpu().numpy().tobytes())
+        self.directory = os.path.join(directory, fingerprint.hexdigest())
+        os.makedirs(self.directory, exist_ok=True)
+        self.stores = {}  # img size -> (valid flags, {layer: features})
+        self.hits, self.misses = 0, 0
+
+    def _prefix(self, imgs):
+        """ Runs the frozen layers in eval mode, returns the outputs of the cached layers """
+        modes = [module.training for module in self.model.module_list[: self.last_layer + 1]]
+        self.model.module_list[: self.last_layer + 1].eval()
+        layer_outputs = []
+        x = imgs
+        with torch.no_grad():
+            for i in range(self.last_layer + 1):
+                x = self.model._layer_forward(i, x, layer_outputs)
+                layer_outputs.append(x)
+        for module, mode in zip(self.model.module_list[: self.last_layer + 1], modes):
+            module.train(mode)
+        return {i: layer_outputs[i] for i in self.layers}
+
+    def _store(self, img_size, imgs):
+        if img_size not in self.stores:
+            shapes = {i: tuple(output.shape[1:]) for i, output in self._prefix(imgs[:1]).items()}
+            valid = _open_memmap(os.path.join(self.directory, f"{img_size}_valid.u8"), np.uint8, (len(self.index),))
+            features = {
+                i: _open_memmap(os.path.join(self.directory, f"{img_size}_layer{i}.f16"), np.float16, (len(self.index),) + shape)
+                for i, shape in shapes.items()
+            }
+            self.stores[img_size] = (valid, features)
+        return self.stores[img_size]
+
+    def __call__(self, paths, imgs):
+        valid, features = self._store(imgs.size(2), imgs)
+        indices = [self.index[path] for path in paths]
+        missing = [j for j, index in enumerate(indices) if not valid[index]]
+        if missing:
+            outputs = self._prefix(imgs[missing])
+            for i, output in outputs.items():
+                output = output.half().cpu().numpy()
+                for k, j in enumerate(missing):
+                    features[i][indices[j]] = output[k]
+            # Flags are set after the features, an interrupted write is recomputed
+            for j in missing:
+                valid[indices[j]] = 1
+        self.hits += len(indices) - len(missing)
+        self.misses += len(missing)
+
+        layer_outputs = [None] * (self.last_layer + 1)
+        for i in self.layers:
+            batch = np.stack([features[i][index] for index in indices])
+            layer_outputs[i] = torch.from_numpy(batch).to(imgs.device).float()
+        return layer_outputs
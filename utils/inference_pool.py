@@ -0,0 +1,195 @@
+import collections
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future, wait
+
+import torch
+import torch.multiprocessing as mp
+
+from utils.utils import non_max_suppression
+
+
+def _pool_worker(index, model, cores, n_threads, tasks, results, output, conf_thres, nms_thres):
+    """
+    Runs in a forked process: pins itself to 'cores' and serves batches until it gets None. The detections of
+    image i are written to output[i], only their counts (-1 for None) go through the 'results' queue.
+    """
+    if cores:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(n_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, imgs = task
+        try:
+            with torch.no_grad():
+                detections = non_max_suppression(model(imgs), conf_thres, nms_thres)
+            counts = []
+            for i, image_detections in enumerate(detections):
+                if image_detections is None:
+                    counts.append(-1)
+                    continue
+                # Sorted by score, the best ones are kept
+                n = min(len(image_detections), output.shape[1])
+                output[i, :n] = image_detections[:n]
+                counts.append(n)
+            results.put((index, task_id, counts, None))
+        except Exception as e:
+            results.put((index, task_id, None, repr(e)))
+
+
+class _Worker(object):
+    def __init__(self, index, cores, output):
+        self.index = index
+        self.cores = cores
+        self.output = output
+        self.process = None
+        self.tasks = None
+        self.task = None  # (task id, future) in flight
+
+
+class InferencePool(object):
+    """
+    Forks 'num_workers' processes sharing the weights of 'model' (moved to shared memory once), each pinned to
+    its own set of cores with as many intra-op threads. Batches travel through torch.multiprocessing queues,
+    which pass tensors through shared memory instead of pickling their data, and every worker writes its
+    detections into its own shared (max_batch_size, max_detections, 7) buffer allocated once, so results
+    don't allocate shared memory per batch (at most 'max_detections' per image, the best ones, are returned).
+    Workers run one batch at a time, the others wait in this process: a worker that dies fails the future of
+    its batch with a RuntimeError and is forked again.
+    submit(images) returns a Future of the per image detections (non_max_suppression format).
+    Create the pool before running the model in this process: forking after OpenMP threads started isn't safe.
+    """
+
+    def __init__(self, model, num_workers=2, threads_per_worker=None, conf_thres=0.5, nms_thres=0.4,
+                 max_batch_size=32, max_detections=300):
+        model.eval()
+        model.share_memory()
+        self.model = model
+        self.conf_thres = conf_thres
+        self.nms_thres = nms_thres
+        self.max_batch_size = max_batch_size
+        cores = sorted(os.sched_getaffinity(0))
+        self.threads_per_worker = threads_per_worker or max(1, len(cores) // num_workers)
+
+        self.ctx = mp.get_context("fork")
+        self.results = self.ctx.Queue()
+        self.workers = []
+        for i in range(num_workers):
+            # Workers get disjoint core sets while there are enough cores, otherwise they share all of them
+            worker_cores = cores[i * self.threads_per_worker:(i + 1) * self.threads_per_worker]
+            if len(worker_cores) < self.threads_per_worker:
+                worker_cores = cores
+            output = torch.zeros(max_batch_size, max_detections, 7).share_memory_()
+            worker = _Worker(i, worker_cores, output)
+            self._start(worker)
+            self.workers.append(worker)
+
+        self.futures = {}
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count()
+        self.restarts = 0
+        self.closed = False
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def _start(self, worker):
+        # A fresh task queue, the dead process may have left the previous one locked
+        worker.tasks = self.ctx.Queue()
+        worker.process = self.ctx.Process(
+            target=_pool_worker,
+            args=(worker.index, self.model, worker.cores, self.threads_per_worker, worker.tasks, self.results,
+                  worker.output, self.conf_thres, self.nms_thres),
+            daemon=True,
+        )
+        worker.process.start()
+
+    def submit(self, images):
+        """ 'images' is a (batch, 3, size, size) tensor or a list of (3, size, size) tensors """
+        if isinstance(images, (list, tuple)):
+            images = torch.stack(images)
+        if len(images) > self.max_batch_size:
+            raise ValueError(f"Batch of {len(images)} images, the pool was created with max_batch_size={self.max_batch_size}")
+        future = Future()
+        with self.lock:
+            task_id = next(self.task_ids)
+            self.futures[task_id] = future
+            self.pending.append((task_id, images.cpu()))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """ Hands pending batches to the idle workers, called with the lock held """
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker.task is None:
+                task_id, imgs = self.pending.popleft()
+                worker.task = (task_id, self.futures[task_id])
+                worker.tasks.put((task_id, imgs))
+
+    def _check_workers(self):
+        """ Fails the batch of every dead worker and forks it again """
+        failed = []
+        with self.lock:
+            if self.closed:
+                return
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    continue
+                exitcode = worker.process.exitcode
+                if worker.task is not None:
+                    task_id, future = worker.task
+                    self.futures.pop(task_id, None)
+                    failed.append((future, RuntimeError(f"Inference worker {worker.index} died (exit code {exitcode})")))
+                    worker.task = None
+                self._start(worker)
+                self.restarts += 1
+            self._dispatch()
+        for future, error in failed:
+            future.set_exception(error)
+
+    def _collect(self):
+        while True:
+            try:
+                result = self.results.get(timeout=0.1)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if result is None:
+                return
+            worker_index, task_id, counts, error = result
+            worker = self.workers[worker_index]
+            with self.lock:
+                # A result of a worker already declared dead was failed, its buffer may be rewritten
+                if worker.task is None or worker.task[0] != task_id:
+                    continue
+                future = self.futures.pop(task_id)
+                if error is None:
+                    # Copied out before the worker gets its next batch
+                    detections = [None if n < 0 else worker.output[i, :n].clone() for i, n in enumerate(counts)]
+                worker.task = None
+                self._dispatch()
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(detections)
+            self._check_workers()
+
+    def close(self):
+        """ Serves the batches already submitted, then stops the workers """
+        with self.lock:
+            futures = list(self.futures.values())
+        wait(futures)
+        with self.lock:
+            self.closed = True
+        for worker in self.workers:
+            worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join()
+        self.results.put(None)
+        self.collector.join()
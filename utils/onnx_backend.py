@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision.ops import batched_nms
+
+
+class DetectionsWithNMS(nn.Module):
+    """
+    Appends confidence thresholding and class-aware NMS (torchvision batched_nms, exported as the ONNX
+    NonMaxSuppression op) to the decoded outputs of 'model'. Returns one row per kept detection:
+    (image index, x1, y1, x2, y2, object_conf, class_score, class_pred), sorted by score.
+    Unlike non_max_suppression, overlapping boxes are dropped instead of merged.
+    """
+
+    def __init__(self, model, num_classes, conf_thres=0.5, nms_thres=0.4):
+        super(DetectionsWithNMS, self).__init__()
+        self.model = model
+        self.num_classes = num_classes
+        self.conf_thres = conf_thres
+        self.nms_thres = nms_thres
+
+    def forward(self, x):
+        outputs = self.model(x)
+        image_idx = torch.arange(outputs.size(0), device=outputs.device).view(-1, 1).expand(outputs.shape[:2])
+        outputs, image_idx = outputs.reshape(-1, outputs.size(2)), image_idx.reshape(-1)
+        keep = outputs[:, 4] >= self.conf_thres
+        outputs, image_idx = outputs[keep], image_idx[keep]
+
+        class_conf, class_pred = outputs[:, 5:].max(1)
+        boxes = torch.cat((outputs[:, :2] - outputs[:, 2:4] / 2, outputs[:, :2] + outputs[:, 2:4] / 2), 1)
+        keep = batched_nms(boxes, outputs[:, 4] * class_conf, image_idx * self.num_classes + class_pred, self.nms_thres)
+        return torch.cat(
+            (
+                image_idx[keep].unsqueeze(1).float(),
+                boxes[keep],
+                outputs[keep, 4:5],
+                class_conf[keep].unsqueeze(1),
+                class_pred[keep].unsqueeze(1).float(),
+            ),
+            1,
+        )
+
+
+def export_onnx(model, path, img_size=416, opset=17):
+    """
+    Exports 'model' (an InferenceDarknet, optionally wrapped in DetectionsWithNMS) to ONNX with dynamic batch,
+    height and width axes. The input is "images", the output "detections".
+    """
+    model.eval()
+    dynamic_axes = {"images": {0: "batch", 2: "height", 3: "width"}, "detections": {0: "batch", 1: "boxes"}}
+    if isinstance(model, DetectionsWithNMS):
+        dynamic_axes["detections"] = {0: "boxes"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            torch.rand(1, 3, img_size, img_size),
+            path,
+            input_names=["images"],
+            output_names=["detections"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+
+class OnnxDarknet(object):
+    """
+    Runs an exported graph with onnxruntime on CPU. Graphs exported without NMS are a drop-in replacement
+    for a Darknet in inference (detect.py, evaluate): calling it returns the decoded outputs as a CPU tensor.
+    """
+
+    def __init__(self, path, n_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads:
+            options.intra_op_num_threads = n_threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.has_nms = len(self.session.get_outputs()[0].shape) == 2
+
+    def eval(self):
+        return self
+
+    def set_precision(self, precision="fp32", channels_last=False):
+        if precision != "fp32" or channels_last:
+            raise ValueError("ONNX models only run in fp32")
+        return self
+
+    def __call__(self, imgs):
+        imgs = np.ascontiguousarray(imgs.detach().cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self.session.run(None, {self.input_name: imgs})[0])
+
+    def detect(self, imgs):
+        """ Per image detections of a graph exported with NMS, in the format of non_max_suppression """
+        if not self.has_nms:
+            raise ValueError("The graph was exported without NMS")
+        rows = self(imgs)
+        return [
+            rows[rows[:, 0] == i, 1:] if bool((rows[:, 0] == i).any()) else None
+            for i in range(imgs.size(0))
+        ]
@@ -20,6 +20,18 @@ def parse_model_config(path):
 
     return module_defs
 
+def write_model_config(path, hyperparams, module_defs):
+    """Writes the [net] block 'hyperparams' and 'module_defs' back to a layer configuration file"""
+    with open(path, 'w') as fp:
+        for module_def in [hyperparams] + module_defs:
+            fp.write('[%s]\n' % module_def['type'])
+            for key, value in module_def.items():
+                # The parser reads every value back as a string, only write batch_normalize when it is set
+                if key == 'type' or (key == 'batch_normalize' and not int(value)):
+                    continue
+                fp.write('%s=%s\n' % (key, value))
+            fp.write('\n')
+
 def parse_data_config(path):
     """Parses the data configuration file"""
     options = dict()
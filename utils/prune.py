@@ -0,0 +1,196 @@
+import copy
+import math
+
+import torch
+
+
+class _Spaces(object):
+    """ Union-find over channel spaces: spaces joined by a shortcut must keep the same channels """
+
+    def __init__(self):
+        self.parent = []
+        self.sizes = []
+        self.prunable = []
+
+    def add(self, size, prunable):
+        self.parent.append(len(self.parent))
+        self.sizes.append(size)
+        self.prunable.append(prunable)
+        return len(self.parent) - 1
+
+    def find(self, space):
+        while self.parent[space] != space:
+            self.parent[space] = self.parent[self.parent[space]]
+            space = self.parent[space]
+        return space
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            if self.sizes[a] != self.sizes[b]:
+                raise ValueError("Shortcut between layers with a different number of channels")
+            self.parent[b] = a
+            self.prunable[a] = self.prunable[a] and self.prunable[b]
+
+
+def channel_spaces(module_defs, in_channels=3):
+    """
+    Resolves which channels of every layer output are tied together by shortcut and route layers.
+    Returns (spaces, layer_segments, conv_spaces) where layer_segments[i] is the output of layer i as a list of
+    space ids (route outputs are the concatenation of their sources) and conv_spaces maps the index of every
+    batch normalized conv layer to the space of its output channels. Convs without batch norm (the yolo
+    heads) and the network input are not prunable.
+    """
+    spaces = _Spaces()
+    input_segments = [spaces.add(in_channels, False)]
+    layer_segments, conv_spaces = [], {}
+    for i, module_def in enumerate(module_defs):
+        previous = layer_segments[i - 1] if i > 0 else input_segments
+        if module_def["type"] == "convolutional":
+            bn = int(module_def["batch_normalize"])
+            space = spaces.add(int(module_def["filters"]), bool(bn))
+            if bn:
+                conv_spaces[i] = space
+            segments = [space]
+        elif module_def["type"] == "route":
+            layers = [int(layer_i) for layer_i in module_def["layers"].split(",")]
+            segments = sum([layer_segments[layer_i if layer_i >= 0 else i + layer_i] for layer_i in layers], [])
+        elif module_def["type"] == "shortcut":
+            layer_i = int(module_def["from"])
+            source = layer_segments[layer_i if layer_i >= 0 else i + layer_i]
+            if len(source) != len(previous):
+                raise ValueError(f"Shortcut {i} joins outputs with a different layout")
+            for a, b in zip(previous, source):
+                spaces.union(a, b)
+            segments = previous
+        elif module_def["type"] == "yolo":
+            segments = []
+        else:  # maxpool, upsample
+            segments = previous
+        layer_segments.append(segments)
+    return spaces, layer_segments, conv_spaces
+
+
+def select_channels(model, ratio, min_keep=0.1, divisor=1):
+    """
+    Ranks the channels of the batch normalized conv layers of the Darknet 'model' by BN gamma magnitude
+    (averaged over the layers a shortcut ties together) and drops the lowest 'ratio' of them globally.
+    Every space keeps at least 'min_keep' of its channels, and a multiple of 'divisor' channels.
+    Returns a keep mask (bool tensor) per prunable space root; spaces without a mask are left untouched.
+    """
+    spaces, _, conv_spaces = channel_spaces(model.module_defs, int(model.hyperparams["channels"]))
+
+    scores, members = {}, {}
+    for i, space in conv_spaces.items():
+        root = spaces.find(space)
+        if not spaces.prunable[root]:
+            continue
+        gamma = model.module_list[i][1].weight.detach().abs().float().cpu()
+        scores[root] = scores.get(root, 0) + gamma
+        members[root] = members.get(root, 0) + 1
+    scores = {root: score / members[root] for root, score in scores.items()}
+    if not scores:
+        return {}
+
+    all_scores = torch.cat(list(scores.values()))
+    num_pruned = int(ratio * all_scores.numel())
+    threshold = all_scores.sort()[0][num_pruned - 1] if num_pruned > 0 else -1
+
+    masks = {}
+    for root, score in scores.items():
+        size = score.numel()
+        keep = int((score > threshold).sum())
+        keep = max(keep, int(math.ceil(min_keep * size)), 1)
+        keep = min(size, int(math.ceil(keep / divisor)) * divisor)
+        mask = torch.zeros(size, dtype=torch.bool)
+        mask[score.argsort(descending=True)[:keep]] = True
+        masks[root] = mask
+    return masks
+
+
+def prune_module_defs(model, masks):
+    """ Returns a copy of the module definitions of 'model' with the filters of the pruned convs reduced """
+    spaces, _, conv_spaces = channel_spaces(model.module_defs, int(model.hyperparams["channels"]))
+    module_defs = copy.deepcopy(model.module_defs)
+    for i, space in conv_spaces.items():
+        mask = masks.get(spaces.find(space))
+        if mask is not None:
+            module_defs[i]["filters"] = str(int(mask.sum()))
+    return module_defs
+
+
+def copy_pruned_weights(model, pruned_model, masks):
+    """ Copies the kept channels of every conv / batch norm of 'model' into 'pruned_model' (built from the pruned cfg) """
+    in_channels = int(model.hyperparams["channels"])
+    spaces, layer_segments, _ = channel_spaces(model.module_defs, in_channels)
+
+    def segments_mask(segments):
+        parts = []
+        for space in segments:
+            mask = masks.get(spaces.find(space))
+            parts.append(mask if mask is not None else torch.ones(spaces.sizes[space], dtype=torch.bool))
+        return torch.cat(parts)
+
+    for i, module_def in enumerate(model.module_defs):
+        if module_def["type"] != "convolutional":
+            continue
+        in_mask = segments_mask(layer_segments[i - 1] if i > 0 else [0])
+        out_mask = segments_mask(layer_segments[i])
+
+        conv, pruned_conv = model.module_list[i][0], pruned_model.module_list[i][0]
+        pruned_conv.weight.data.copy_(conv.weight.data[out_mask][:, in_mask])
+        if conv.bias is not None:
+            pruned_conv.bias.data.copy_(conv.bias.data[out_mask])
+        if int(module_def["batch_normalize"]):
+            bn, pruned_bn = model.module_list[i][1], pruned_model.module_list[i][1]
+            for name in ["weight", "bias", "running_mean", "running_var"]:
+                getattr(pruned_bn, name).data.copy_(getattr(bn, name).data[out_mask])
+    pruned_model.seen = model.seen
+    return pruned_model
+
+
+def head_channels(num_anchors, num_classes, class_ids):
+    """ Output channels of a yolo head conv kept for 'class_ids': the layout is anchor-major, (x, y, w, h, conf, classes...) """
+    keep = []
+    for a in range(num_anchors):
+        base = a * (num_classes + 5)
+        keep += [base + c for c in range(5)] + [base + 5 + c for c in class_ids]
+    return torch.tensor(keep, dtype=torch.long)
+
+
+def slice_classes(model, class_ids):
+    """
+    Derives a Darknet from 'model' whose yolo heads only predict 'class_ids': the conv feeding every yolo
+    layer keeps the box, objectness and selected class channels, and class j of the new model is
+    class_ids[j] of 'model'. Returns the new model, its module definitions start with the [net] block.
+    """
+    class_ids = list(class_ids)
+    if not class_ids:
+        raise ValueError("At least one class must be kept")
+    if len(set(class_ids)) != len(class_ids):
+        raise ValueError("Duplicate class ids")
+
+    module_defs = copy.deepcopy([model.hyperparams] + model.module_defs)
+    state_dict = model.state_dict()
+    for i, module_def in enumerate(model.module_defs):
+        if module_def["type"] != "yolo":
+            continue
+        head_def = model.module_defs[i - 1]
+        if i == 0 or head_def["type"] != "convolutional" or int(head_def["batch_normalize"]):
+            raise ValueError(f"Yolo layer {i} isn't fed by a conv layer without batch norm")
+        num_classes = int(module_def["classes"])
+        if not all(0 <= c < num_classes for c in class_ids):
+            raise ValueError(f"Class ids must be in [0, {num_classes})")
+
+        num_anchors = len(module_def["mask"].split(","))
+        keep = head_channels(num_anchors, num_classes, class_ids)
+        module_defs[i]["filters"] = str(len(keep))  # [net] is at index 0, this is the head conv
+        module_defs[i + 1]["classes"] = str(len(class_ids))
+        for name in ["weight", "bias"]:
+            key = f"module_list.{i - 1}.conv_{i - 1}.{name}"
+            state_dict[key] = state_dict[key][keep]
+
+    sliced_model = type(model)(module_defs, img_size=model.img_size)
+    sliced_model.load_state_dict(state_dict)
+    sliced_model.seen = model.seen
+    return sliced_model
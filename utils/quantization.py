@@ -0,0 +1,139 @@
+import torch
+import torch.nn as nn
+from torch.ao.nn.quantized import FloatFunctional
+from torch.ao.quantization import (
+    DeQuantStub,
+    QuantStub,
+    convert,
+    fuse_modules,
+    fuse_modules_qat,
+    get_default_qat_qconfig,
+    get_default_qconfig,
+    prepare,
+    prepare_qat,
+)
+
+from utils.utils import to_cpu
+
+
+class QuantizableDarknet(nn.Module):
+    """
+    Runs the layers of a Darknet for eager mode static quantization: the input is quantized, route and
+    shortcut layers go through FloatFunctional and the input of every yolo layer is dequantized, so
+    decoding and the loss stay in float. Activation checkpointing, bf16 and channels_last aren't supported,
+    a model configured with any of them is rejected rather than silently run without it.
+    """
+
+    def __init__(self, model):
+        super(QuantizableDarknet, self).__init__()
+        if getattr(model, "checkpoint_segments", None):
+            raise ValueError("Quantized models don't support activation checkpointing, disable it before quantizing")
+        if getattr(model, "precision", "fp32") != "fp32" or getattr(model, "memory_format", None) == torch.channels_last:
+            raise ValueError("Quantized models only run in their own precision and memory format, use fp32 before quantizing")
+        self.module_defs = model.module_defs
+        self.hyperparams = model.hyperparams
+        self.module_list = model.module_list
+        self.yolo_layers = model.yolo_layers
+        self.img_size = model.img_size
+        self.seen = model.seen
+        self.header_info = model.header_info
+        self.quant = QuantStub()
+        self.dequant = nn.ModuleDict(
+            {str(i): DeQuantStub() for i, module_def in enumerate(self.module_defs) if module_def["type"] == "yolo"}
+        )
+        self.functional = nn.ModuleDict(
+            {
+                str(i): FloatFunctional()
+                for i, module_def in enumerate(self.module_defs)
+                if module_def["type"] in ["route", "shortcut"]
+            }
+        )
+
+    def set_precision(self, precision="fp32", channels_last=False):
+        if precision != "fp32" or channels_last:
+            raise ValueError("Quantized models only run in their own precision and memory format")
+        return self
+
+    def forward(self, x, targets=None):
+        img_dim = x.shape[2]
+        loss = 0
+        x = self.quant(x)
+        layer_outputs, yolo_outputs = [], []
+        for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
+            if module_def["type"] in ["convolutional", "upsample", "maxpool"]:
+                x = module(x)
+            elif module_def["type"] == "route":
+                inputs = [layer_outputs[int(layer_i)] for layer_i in module_def["layers"].split(",")]
+                x = self.functional[str(i)].cat(inputs, 1) if len(inputs) > 1 else inputs[0]
+            elif module_def["type"] == "shortcut":
+                layer_i = int(module_def["from"])
+                x = self.functional[str(i)].add(layer_outputs[-1], layer_outputs[layer_i])
+            elif module_def["type"] == "yolo":
+                x, layer_loss = module[0](self.dequant[str(i)](x), targets, img_dim)
+                loss += layer_loss
+                yolo_outputs.append(x)
+            layer_outputs.append(x)
+        yolo_outputs = to_cpu(torch.cat(yolo_outputs, 1))
+        return yolo_outputs if targets is None else (loss, yolo_outputs)
+
+
+def prepare_quantization(model, backend="fbgemm", qat=False):
+    """
+    Fuses the conv / batch norm pairs of the Darknet 'model' (in place) and returns a QuantizableDarknet
+    with observers inserted for calibration, or fake-quantization modules for quantization-aware training.
+    The yolo layers are left in float.
+    """
+    torch.backends.quantized.engine = backend
+    qmodel = QuantizableDarknet(model)
+    qmodel.train(qat)
+
+    fuse = fuse_modules_qat if qat else fuse_modules
+    for i, (module_def, module) in enumerate(zip(qmodel.module_defs, qmodel.module_list)):
+        if module_def["type"] == "convolutional" and module_def["batch_normalize"]:
+            fuse(module, [[f"conv_{i}", f"batch_norm_{i}"]], inplace=True)
+        elif module_def["type"] == "yolo":
+            module.qconfig = None
+
+    qmodel.qconfig = get_default_qat_qconfig(backend) if qat else get_default_qconfig(backend)
+    return prepare_qat(qmodel, inplace=True) if qat else prepare(qmodel, inplace=True)
+
+
+def calibrate(qmodel, dataloader, num_images):
+    """ Runs at least 'num_images' images of 'dataloader' through the prepared model to collect statistics """
+    qmodel.eval()
+    seen = 0
+    with torch.no_grad():
+        for batch in dataloader:
+            imgs = batch[1]
+            qmodel(imgs.float())
+            seen += imgs.size(0)
+            if seen >= num_images:
+                break
+    return seen
+
+
+def convert_quantized(qmodel):
+    """ Converts a calibrated (or quantization-aware trained) model to a real int8 model """
+    qmodel.eval()
+    return convert(qmodel.cpu(), inplace=True)
+
+
+def save_quantized_model(qmodel, path, backend="fbgemm"):
+    """ Saves a converted int8 model, load it back with load_model(model_cfg, path) """
+    qmodel.header_info[3] = qmodel.seen
+    torch.save({"quantization": backend, "seen": int(qmodel.seen), "state_dict": qmodel.state_dict()}, path)
+
+
+def load_quantized_model(model, state):
+    """
+    Rebuilds the int8 model saved by save_quantized_model from the float Darknet 'model' (modified in place).
+    'model' may be allocated without being initialized (load_model uses to_empty): its convs and batch norms
+    are reset first, so fusing and converting only see finite values before the saved state replaces them.
+    """
+    for module in model.modules():
+        if isinstance(module, (nn.Conv2d, nn.BatchNorm2d)):
+            module.reset_parameters()
+    qmodel = convert_quantized(prepare_quantization(model, backend=state["quantization"]))
+    qmodel.load_state_dict(state["state_dict"])
+    qmodel.seen = state["seen"]
+    return qmodel
@@ -0,0 +1,117 @@
+import collections
+import hashlib
+import os
+import threading
+
+import torch
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """ blake2b digest of the content of the file at 'path' """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_nbytes(model):
+    """
+    Memory held by the parameters and buffers of 'model', each storage counted once. Storages that are views
+    of a memory-mapped checkpoint (see Darknet.load_checkpoint with assign) are page cache, not counted.
+    """
+    mapped = getattr(model, "mapped_storages", set())
+    storages = {}
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in mapped:
+            storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+class ModelRegistry(object):
+    """
+    Lazily loads Darknet models with 'loader(model_cfg, model_weights, img_size=..., device=...)' (models.load_model)
+    and shares them between callers, keyed by (cfg path, weights hash, img_size, precision, channels_last): the
+    same weights under another path are loaded once, rewritten weights are loaded again. The least recently used
+    models are dropped once the loaded ones exceed 'memory_budget_mb' (the most recent one is always kept), then
+    'on_evict(model)' is called; callers still holding a dropped model keep it alive.
+    Every model runs one forward of zeros per size of 'warmup_sizes' (img_size by default) when loaded, so the
+    yolo grid caches are filled before the first request.
+    """
+
+    def __init__(self, loader, memory_budget_mb=2048, device="cpu", warmup_sizes=None, on_evict=None):
+        self.loader = loader
+        self.on_evict = on_evict
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.device = device
+        self.warmup_sizes = warmup_sizes
+        self.models = collections.OrderedDict()  # key -> (model, nbytes), least recently used first
+        self.hashes = {}  # (path, size, mtime) -> weights hash
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def _weights_hash(self, path):
+        if path is None:
+            return None
+        stat = os.stat(path)
+        stat_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self.hashes:
+            self.hashes[stat_key] = file_hash(path)
+        return self.hashes[stat_key]
+
+    def key(self, model_cfg, model_weights=None, img_size=416, precision="fp32", channels_last=False):
+        return (os.path.realpath(model_cfg), self._weights_hash(model_weights), img_size, precision, channels_last)
+
+    def get(self, model_cfg, model_weights=None, img_size=416, precision="fp32", channels_last=False):
+        """ Returns the shared model in eval mode, loading it if needed """
+        key = self.key(model_cfg, model_weights, img_size, precision, channels_last)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.hits += 1
+                return self.models[key][0]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent callers of the same key wait for a single load
+        with key_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    self.hits += 1
+                    return self.models[key][0]
+            model = self.loader(model_cfg, model_weights, img_size=img_size, device=self.device)
+            model.set_precision(precision, channels_last)
+            model.eval()
+            with torch.no_grad():
+                for size in self.warmup_sizes or [img_size]:
+                    model(torch.zeros(1, 3, size, size, device=self.device))
+            with self.lock:
+                self.misses += 1
+                self.models[key] = (model, model_nbytes(model))
+                evicted = self._evict()
+        # Outside the lock, the callback may take a while (e.g. stopping a batcher)
+        if self.on_evict is not None:
+            for evicted_model in evicted:
+                self.on_evict(evicted_model)
+        return model
+
+    def _evict(self):
+        evicted = []
+        while len(self.models) > 1 and sum(nbytes for _, nbytes in self.models.values()) > self.memory_budget:
+            key, (model, _) = self.models.popitem(last=False)
+            self.key_locks.pop(key, None)
+            self.evictions += 1
+            evicted.append(model)
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": len(self.models),
+                "memory_mb": sum(nbytes for _, nbytes in self.models.values()) / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
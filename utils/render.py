@@ -0,0 +1,93 @@
+import colorsys
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def class_palette(num_classes):
+    """ One stable BGR color per class id, hues spread by the golden ratio so neighbouring ids differ """
+    palette = []
+    for i in range(num_classes):
+        r, g, b = colorsys.hsv_to_rgb((i * 0.618033988749895) % 1.0, 0.75, 0.95)
+        palette.append((int(b * 255), int(g * 255), int(r * 255)))
+    return palette
+
+
+class DetectionRenderer(object):
+    """
+    Draws detections (non_max_suppression format, frame coordinates) on BGR uint8 frames with OpenCV.
+    The class colors are computed once and the label images (text on its class color) are rendered once per
+    text and then copied into the frame, so drawing a box costs one cv2.rectangle and one array copy.
+    """
+
+    def __init__(self, class_names, font_scale=0.5, thickness=2, text_color=(255, 255, 255)):
+        self.class_names = list(class_names)
+        self.palette = class_palette(len(self.class_names))
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.text_color = text_color
+        self.sprites = {}  # (text, class id) -> label image
+
+    def label_sprite(self, text, cls_id):
+        key = (text, cls_id)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            (text_width, text_height), _ = cv2.getTextSize(text, FONT, fontScale=self.font_scale, thickness=1)
+            sprite = np.empty((text_height + 3, text_width + 3, 3), dtype=np.uint8)
+            sprite[:] = self.palette[cls_id]
+            cv2.putText(sprite, text, (0, text_height + 1), FONT, fontScale=self.font_scale, color=self.text_color, thickness=1)
+            self.sprites[key] = sprite
+        return sprite
+
+    def _blit(self, frame, sprite, x, y):
+        """ Copies 'sprite' with its top left corner at (x, y), clipped to the frame """
+        height, width = frame.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + sprite.shape[1], width), min(y + sprite.shape[0], height)
+        if x0 < x1 and y0 < y1:
+            frame[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    def draw(self, frame, detections, only_classes=None, confidence_threshold=0, plot_labels=True, plot_class_confidence=False):
+        """ Draws in place on 'frame' and returns it, 'only_classes' is a list of class names to keep """
+        if detections is None or len(detections) == 0:
+            return frame
+        if not isinstance(detections, np.ndarray):
+            detections = detections.detach().cpu().numpy()
+        keep = detections[:, 5] >= confidence_threshold
+        if only_classes:
+            allowed = [i for i, name in enumerate(self.class_names) if name in only_classes]
+            keep &= np.isin(detections[:, 6].astype(np.int64), allowed)
+        detections = detections[keep]
+
+        boxes = detections[:, :4].astype(np.int64)
+        cls_confs = detections[:, 5]
+        cls_ids = detections[:, 6].astype(np.int64)
+        for (x1, y1, x2, y2), cls_conf, cls_id in zip(boxes.tolist(), cls_confs.tolist(), cls_ids.tolist()):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color=self.palette[cls_id], thickness=self.thickness)
+            if plot_labels:
+                sprite = self.label_sprite(self.class_names[cls_id], cls_id)
+                self._blit(frame, sprite, x1, y1 - sprite.shape[0])
+            if plot_class_confidence:
+                sprite = self.label_sprite("{0:.2f}".format(cls_conf), cls_id)
+                self._blit(frame, sprite, x1, y2 - sprite.shape[0])
+        return frame
+
+    def render(self, frame, detections, out=None, **kwargs):
+        """ Draws on a copy of 'frame' in 'out' (a reusable buffer of the same shape, allocated if None) """
+        if out is None or out.shape != frame.shape:
+            out = np.empty_like(frame)
+        np.copyto(out, frame)
+        return self.draw(out, detections, **kwargs)
+
+
+_renderers = {}
+
+
+def get_renderer(class_names, font_scale=0.5, thickness=2, text_color=(255, 255, 255)):
+    """ Shared renderer per (class names, style), its palette and label images are built once """
+    key = (tuple(class_names), font_scale, thickness, tuple(text_color))
+    if key not in _renderers:
+        _renderers[key] = DetectionRenderer(class_names, font_scale, thickness, text_color)
+    return _renderers[key]
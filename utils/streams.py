@@ -0,0 +1,217 @@
+import collections
+import threading
+import time
+
+import cv2
+import torch
+
+from utils.batching import BatchingMetrics, letterbox_frame
+from utils.utils import non_max_suppression, rescale_boxes
+from utils.video import StageStats, open_capture
+
+
+class StreamSource(object):
+    """
+    Reads a video source on a background thread and keeps only its latest frame. With 'fps', frames are
+    released at that rate (a file then behaves like a live camera, a fake stream), with 'loop' the file restarts
+    at its end. 'notify' (a threading.Condition) is notified on every new frame. An error of the reader thread
+    (e.g. a source that can't be opened) ends the stream and is kept in 'error'.
+    """
+
+    def __init__(self, stream_id, source, fps=None, loop=False, notify=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.fps = fps
+        self.loop = loop
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.latest = None  # (frame index, capture time, frame)
+        self.frames_read = 0
+        self.ended = False
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read, name=f"stream-{stream_id}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _publish(self, item):
+        with self.lock:
+            self.latest = item
+            self.frames_read += 1
+        if self.notify is not None:
+            with self.notify:
+                self.notify.notify_all()
+
+    def _read(self):
+        capture = None
+        index = 0
+        next_time = time.time()
+        try:
+            capture = open_capture(self.source)
+            while not self.stopped.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    if self.loop and index:
+                        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                if self.fps:
+                    next_time += 1 / self.fps
+                    self.stopped.wait(max(0.0, next_time - time.time()))
+                self._publish((index, time.time(), frame))
+                index += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            if capture is not None:
+                capture.release()
+            self.ended = True
+            if self.notify is not None:
+                with self.notify:
+                    self.notify.notify_all()
+
+    def take(self, after_index):
+        """ Latest (frame index, capture time, frame) if newer than 'after_index', None otherwise """
+        with self.lock:
+            if self.latest is None or self.latest[0] <= after_index:
+                return None
+            return self.latest
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class MultiStreamScheduler(object):
+    """
+    Batches the latest frames of many streams: every tick, the streams with a frame newer than the last one
+    processed contribute it, one forward and one non_max_suppression run over the batch, and
+    'on_detections(stream_id, frame_index, frame, detections)' receives each stream's detections (frame coordinates).
+
+    - Fairness: when more than 'max_batch_size' streams are ready, the least recently served go first, so
+      every stream is served at least every ceil(streams / max_batch_size) ticks.
+    - Staleness: frames captured more than 'max_staleness' seconds before the tick are skipped (and counted),
+      the stream is served with its next frame instead.
+    - Frames replaced by a newer one before their tick are never processed, they count as superseded.
+
+    'tick' is the minimum time between two batches (0: batch as soon as a forward finishes and a frame is ready).
+    """
+
+    def __init__(self, model, sources, img_size=416, conf_thres=0.5, nms_thres=0.4, max_batch_size=16,
+                 tick=0.0, max_staleness=None, device="cpu", on_detections=None):
+        self.model = model
+        self.img_size = img_size
+        self.conf_thres = conf_thres
+        self.nms_thres = nms_thres
+        self.max_batch_size = max_batch_size
+        self.tick = tick
+        self.max_staleness = max_staleness
+        self.device = device
+        self.on_detections = on_detections
+
+        self.frame_ready = threading.Condition()
+        self.streams = collections.OrderedDict()
+        for stream_id, source in sources.items():
+            if not isinstance(source, StreamSource):
+                source = StreamSource(stream_id, source)
+            source.notify = self.frame_ready
+            self.streams[stream_id] = source
+        self.last_index = {stream_id: -1 for stream_id in self.streams}
+        self.last_served = {stream_id: -1 for stream_id in self.streams}
+        self.stream_stats = {stream_id: StageStats() for stream_id in self.streams}
+        self.metrics = BatchingMetrics()
+        self.ticks = 0
+        self.stopped = threading.Event()
+
+    def _ready(self, now):
+        """ (stream id, frame index, capture time, frame) of the streams to serve this tick, fairest first """
+        ready = []
+        for stream_id, source in self.streams.items():
+            item = source.take(self.last_index[stream_id])
+            if item is None:
+                continue
+            index, capture_time, frame = item
+            self.last_index[stream_id] = index
+            if self.max_staleness is not None and now - capture_time > self.max_staleness:
+                self.stream_stats[stream_id].record_drop()
+                continue
+            ready.append((stream_id, index, capture_time, frame))
+        ready.sort(key=lambda item: self.last_served[item[0]])
+        # The streams left out keep their frame for the next tick
+        for stream_id, index, _, _ in ready[self.max_batch_size:]:
+            self.last_index[stream_id] = index - 1
+        return ready[:self.max_batch_size]
+
+    def step(self):
+        """ Runs one tick, returns the number of frames processed """
+        batch = self._ready(time.time())
+        if not batch:
+            return 0
+        stream_ids, indices, capture_times, frames = zip(*batch)
+        imgs = torch.stack([letterbox_frame(frame, self.img_size) for frame in frames]).to(self.device)
+        with torch.no_grad():
+            detections = non_max_suppression(self.model(imgs), self.conf_thres, self.nms_thres)
+        now = time.time()
+        self.metrics.record_batch([now - capture_time for capture_time in capture_times])
+        for stream_id, index, capture_time, frame, frame_detections in zip(
+            stream_ids, indices, capture_times, frames, detections
+        ):
+            if frame_detections is not None:
+                frame_detections = rescale_boxes(frame_detections, self.img_size, frame.shape[:2])
+            self.last_served[stream_id] = self.ticks
+            self.stream_stats[stream_id].record(now - capture_time)
+            if self.on_detections is not None:
+                self.on_detections(stream_id, index, frame, frame_detections)
+        self.ticks += 1
+        return len(batch)
+
+    def run(self, duration=None):
+        """
+        Serves the streams until they all end, stop() is called or 'duration' seconds passed.
+        Raises the error of the first stream whose reader failed.
+        """
+        for source in self.streams.values():
+            if not source.thread.is_alive() and not source.ended:
+                source.start()
+        start_time = time.time()
+        try:
+            while not self.stopped.is_set():
+                for source in self.streams.values():
+                    if source.error is not None:
+                        raise source.error
+                if duration is not None and time.time() - start_time > duration:
+                    break
+                tick_start = time.time()
+                if not self.step():
+                    if all(source.ended for source in self.streams.values()):
+                        # A last tick for the frames published right before the end
+                        if not self.step():
+                            break
+                    with self.frame_ready:
+                        self.frame_ready.wait(timeout=0.05)
+                    continue
+                if self.tick:
+                    self.stopped.wait(max(0.0, self.tick - (time.time() - tick_start)))
+        finally:
+            for source in self.streams.values():
+                source.stop()
+        return self.stats()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        """ Batch statistics and, per stream, frames read, processed, stale and superseded and their latency """
+        streams = {}
+        for stream_id, source in self.streams.items():
+            stats = self.stream_stats[stream_id].snapshot()
+            streams[stream_id] = {
+                "read": source.frames_read,
+                "processed": stats["items"],
+                "stale": stats["dropped"],
+                "superseded": source.frames_read - stats["items"] - stats["dropped"],
+                "latency_ms": stats["latency_ms"],
+            }
+        return {"batches": self.metrics.snapshot(), "streams": streams}
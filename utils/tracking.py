@@ -0,0 +1,264 @@
+import itertools
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+
+def box_iou_matrix(boxes1, boxes2):
+    """ (N, M) IoU of two arrays of x1y1x2y2 boxes """
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    return inter / (area1[:, None] + area2[None, :] - inter + 1e-16)
+
+
+def greedy_match(iou, threshold):
+    """ Pairs (row, column) by decreasing IoU, each row and column used once, IoU at least 'threshold' """
+    matches = []
+    if iou.size == 0:
+        return matches
+    rows, cols = np.unravel_index(np.argsort(-iou, axis=None), iou.shape)
+    used_rows, used_cols = set(), set()
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if iou[row, col] < threshold:
+            break
+        if row not in used_rows and col not in used_cols:
+            matches.append((row, col))
+            used_rows.add(row)
+            used_cols.add(col)
+    return matches
+
+
+def xyxy_to_cxcywh(box):
+    return np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2, box[2] - box[0], box[3] - box[1]])
+
+
+def cxcywh_to_xyxy(state):
+    cx, cy, w, h = state[:4]
+    return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+
+class KalmanBoxFilter(object):
+    """
+    Constant velocity Kalman filter of a box (cx, cy, w, h) and its velocity. The noise is proportional to
+    the box height, so small and large objects are tracked alike.
+    """
+
+    std_position = 1 / 20
+    std_velocity = 1 / 160
+
+    def __init__(self, box):
+        self.state = np.concatenate((xyxy_to_cxcywh(box), np.zeros(4)))
+        h = self.state[3]
+        std = [2 * self.std_position * h] * 4 + [10 * self.std_velocity * h] * 4
+        self.covariance = np.diag(np.square(std))
+        self.transition = np.eye(8)
+        self.transition[:4, 4:] = np.eye(4)
+        self.projection = np.eye(4, 8)
+
+    def predict(self):
+        h = self.state[3]
+        std = [self.std_position * h] * 4 + [self.std_velocity * h] * 4
+        self.state = self.transition @ self.state
+        self.state[2:4] = np.maximum(self.state[2:4], 1)
+        self.covariance = self.transition @ self.covariance @ self.transition.T + np.diag(np.square(std))
+        return cxcywh_to_xyxy(self.state)
+
+    def update(self, box):
+        std = [self.std_position * self.state[3]] * 4
+        innovation_cov = self.projection @ self.covariance @ self.projection.T + np.diag(np.square(std))
+        gain = self.covariance @ self.projection.T @ np.linalg.inv(innovation_cov)
+        self.state = self.state + gain @ (xyxy_to_cxcywh(box) - self.projection @ self.state)
+        self.covariance = (np.eye(8) - gain @ self.projection) @ self.covariance
+        return cxcywh_to_xyxy(self.state)
+
+
+class Track(object):
+    def __init__(self, track_id, detection):
+        self.track_id = track_id
+        self.filter = KalmanBoxFilter(detection[:4])
+        self.box = detection[:4].copy()
+        self.scores = detection[4:6].copy()
+        self.cls = detection[6]
+        self.confidence = 1.0
+        self.misses = 0
+
+    def detection(self):
+        """ non_max_suppression row, the confidences scaled by the tracking confidence """
+        return np.concatenate((self.box, self.scores * self.confidence, [self.cls]))
+
+
+class Tracker(object):
+    """
+    Propagates detections (non_max_suppression format, frame coordinates) between keyframes.
+    update(detections) associates a keyframe's detections to the tracks by greedy class-aware IoU with their
+    predicted boxes, predict() moves the tracks one frame without detections.
+    The confidence of a track starts at 1 on a matched keyframe and is multiplied on every predicted frame by
+    'decay' and by the IoU of its box before and after the prediction, so fast or accelerating objects lose
+    confidence quicker than still ones. Tracks missed by 'max_misses' keyframes in a row are removed.
+    """
+
+    def __init__(self, iou_threshold=0.3, decay=0.95, max_misses=1):
+        self.iou_threshold = iou_threshold
+        self.decay = decay
+        self.max_misses = max_misses
+        self.tracks = []
+        self.track_ids = itertools.count()
+
+    def update(self, detections):
+        detections = _to_numpy(detections)
+        predicted = np.array([track.filter.predict() for track in self.tracks]).reshape(-1, 4)
+        iou = box_iou_matrix(predicted, detections[:, :4])
+        # Only associate detections of the same class
+        iou[np.array([track.cls for track in self.tracks])[:, None] != detections[None, :, 6]] = 0
+        matched_tracks, matched_detections = set(), set()
+        for track_i, detection_i in greedy_match(iou, self.iou_threshold):
+            track, detection = self.tracks[track_i], detections[detection_i]
+            track.filter.update(detection[:4])
+            track.box = detection[:4].copy()
+            track.scores = detection[4:6].copy()
+            track.confidence = 1.0
+            track.misses = 0
+            matched_tracks.add(track_i)
+            matched_detections.add(detection_i)
+
+        tracks = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+                track.box = cxcywh_to_xyxy(track.filter.state)
+                track.confidence *= self.decay
+            tracks.append(track)
+        for i, detection in enumerate(detections):
+            if i not in matched_detections:
+                tracks.append(Track(next(self.track_ids), detection))
+        self.tracks = tracks
+        return self.detections()
+
+    def predict(self):
+        for track in self.tracks:
+            box = track.filter.predict()
+            iou = box_iou_matrix(track.box[None], box[None])[0, 0]
+            track.box = box
+            track.confidence *= self.decay * iou
+        return self.detections()
+
+    def confidence(self):
+        """ Lowest confidence of the tracks, 1 without tracks """
+        return min((track.confidence for track in self.tracks), default=1.0)
+
+    def detections(self):
+        """ The tracks as non_max_suppression output (None without tracks) and their ids """
+        if not self.tracks:
+            return None, []
+        detections = torch.from_numpy(np.array([track.detection() for track in self.tracks], dtype=np.float32))
+        return detections, [track.track_id for track in self.tracks]
+
+
+def _to_numpy(detections):
+    if detections is None:
+        return np.zeros((0, 7), dtype=np.float32)
+    if isinstance(detections, torch.Tensor):
+        return detections.detach().cpu().numpy()
+    return np.asarray(detections, dtype=np.float32)
+
+
+class KeyframeScheduler(object):
+    """
+    Decides which frames run the detector: every 'interval' frames, or with 'adaptive' as soon as the tracking
+    confidence reported by report() falls under 'min_confidence' or the frame differs from the last keyframe by
+    more than 'scene_change' (mean absolute difference of 64x36 gray thumbnails, 0-255), and at least every
+    'max_interval' frames. Thread-safe, the video pipeline asks and reports from different stages: reports
+    lag behind the decisions, so those tagged with a frame index older than the last keyframe are ignored
+    (they describe tracks the keyframe is about to refresh).
+    """
+
+    def __init__(self, interval=5, adaptive=False, min_confidence=0.5, scene_change=20.0, max_interval=30):
+        self.interval = interval
+        self.adaptive = adaptive
+        self.min_confidence = min_confidence
+        self.scene_change = scene_change
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+        self.since_keyframe = None
+        self.last_keyframe = -1
+        self.keyframe_thumbnail = None
+        self.tracking_confidence = 1.0
+        self.frames = 0
+        self.keyframes = 0
+
+    @staticmethod
+    def thumbnail(frame):
+        return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA)
+
+    def should_detect(self, frame, index=None):
+        """ Whether to run the detector on 'frame', 'index' defaults to the number of frames seen before """
+        with self.lock:
+            index = self.frames if index is None else index
+            self.frames += 1
+            if self.since_keyframe is None:
+                detect = True
+            elif not self.adaptive:
+                detect = self.since_keyframe >= self.interval
+            elif self.since_keyframe >= self.max_interval or self.tracking_confidence < self.min_confidence:
+                detect = True
+            else:
+                thumbnail = self.thumbnail(frame)
+                difference = cv2.absdiff(thumbnail, self.keyframe_thumbnail).mean()
+                detect = difference > self.scene_change
+            if detect:
+                self.keyframes += 1
+                self.since_keyframe = 1
+                self.last_keyframe = index
+                # The tracks will be refreshed by this keyframe
+                self.tracking_confidence = 1.0
+                if self.adaptive:
+                    self.keyframe_thumbnail = self.thumbnail(frame)
+            else:
+                self.since_keyframe += 1
+            return detect
+
+    def report(self, confidence, index=None):
+        """ Tracking confidence after the frame 'index' (None: the latest frame) """
+        with self.lock:
+            if index is not None and index < self.last_keyframe:
+                return
+            self.tracking_confidence = confidence
+
+    def stats(self):
+        with self.lock:
+            return {
+                "frames": self.frames,
+                "keyframes": self.keyframes,
+                "keyframe_ratio": self.keyframes / self.frames if self.frames else 0.0,
+            }
+
+
+class KeyframeDetector(object):
+    """
+    Frame by frame keyframe detection: 'detect(frame)' (detections in frame coordinates, e.g. video.detect_frame)
+    runs on the frames selected by 'scheduler', the tracker propagates the boxes on the others.
+    process(frame) returns (detections, track ids, whether the detector ran).
+    """
+
+    def __init__(self, detect, scheduler, tracker=None):
+        self.detect = detect
+        self.scheduler = scheduler
+        self.tracker = tracker or Tracker()
+
+    def process(self, frame):
+        keyframe = self.scheduler.should_detect(frame)
+        if keyframe:
+            detections, track_ids = self.tracker.update(self.detect(frame))
+        else:
+            detections, track_ids = self.tracker.predict()
+        self.scheduler.report(self.tracker.confidence())
+        return detections, track_ids, keyframe
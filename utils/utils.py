@@ -16,6 +16,7 @@ from matplotlib.ticker import NullLocator
 from PIL import Image
 import copy
 import cv2
+from utils.render import get_renderer
 
 
 
@@ -41,6 +42,50 @@ def weights_init_normal(m):
         torch.nn.init.constant_(m.bias.data, 0.0)
 
 
+def count_flops(module_defs, in_channels=3, img_size=416, layers=None):
+    """
+    Counts the multiply-accumulates of the conv layers in 'module_defs' (without the [net] block)
+    for one square image of side 'img_size', and returns them as FLOPs (2 per multiply-accumulate).
+    With 'layers', only the conv layers at those indices are counted.
+    yolov3.cfg at 416 counts 65.9 GFLOPs, its three heads 0.09, 0.18 and 0.35.
+    """
+    shapes = []  # (channels, height) of every layer output
+    channels, size = in_channels, img_size
+    macs = 0
+    for i, module_def in enumerate(module_defs):
+        if module_def["type"] == "convolutional":
+            kernel_size, stride = int(module_def["size"]), int(module_def["stride"])
+            size = (size + 2 * ((kernel_size - 1) // 2) - kernel_size) // stride + 1
+            filters = int(module_def["filters"])
+            if layers is None or i in layers:
+                macs += kernel_size * kernel_size * channels * filters * size * size
+            channels = filters
+        elif module_def["type"] == "maxpool":
+            kernel_size, stride = int(module_def["size"]), int(module_def["stride"])
+            if kernel_size == 2 and stride == 1:
+                size += 1
+            size = (size + 2 * ((kernel_size - 1) // 2) - kernel_size) // stride + 1
+        elif module_def["type"] == "upsample":
+            size *= int(module_def["stride"])
+        elif module_def["type"] == "route":
+            route_layers = [int(layer_i) for layer_i in module_def["layers"].split(",")]
+            sources = [shapes[layer_i if layer_i >= 0 else i + layer_i] for layer_i in route_layers]
+            channels, size = sum(source[0] for source in sources), sources[0][1]
+        shapes.append((channels, size))
+    return 2 * macs
+
+
+def measure_latency(model, img_size, runs):
+    """ Mean batch-1 forward latency in milliseconds """
+    imgs = torch.rand(1, 3, img_size, img_size)
+    with torch.no_grad():
+        model(imgs)  # warm up
+        start_time = time.time()
+        for _ in range(runs):
+            model(imgs)
+    return 1000 * (time.time() - start_time) / runs
+
+
 def rescale_boxes(boxes, current_dim, original_shape):
     """ Rescales bounding boxes to the original shape """
     orig_h, orig_w = original_shape
@@ -272,26 +317,42 @@ def non_max_suppression(prediction, conf_thres=0.5, nms_thres=0.4):
     return output
 
 
-def build_targets(pred_boxes, pred_cls, target, anchors, ignore_thres):
+def detections_to_dicts(detections, class_names=None):
+    """
+    Converts the detections of one image (non_max_suppression format, None if empty) to JSON serializable dicts
+    """
+    if detections is None:
+        return []
+    objects = []
+    for x1, y1, x2, y2, conf, cls_conf, cls_pred in detections.tolist():
+        obj = {
+            "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+            "object_conf": conf, "class_conf": cls_conf, "class": int(cls_pred),
+        }
+        if class_names is not None:
+            obj["label"] = class_names[int(cls_pred)]
+        objects.append(obj)
+    return objects
+
 
-    ByteTensor = torch.cuda.ByteTensor if pred_boxes.is_cuda else torch.ByteTensor
-    FloatTensor = torch.cuda.FloatTensor if pred_boxes.is_cuda else torch.FloatTensor
+def build_targets(pred_boxes, pred_cls, target, anchors, ignore_thres):
 
     nB = pred_boxes.size(0)
     nA = pred_boxes.size(1)
     nC = pred_cls.size(-1)
     nG = pred_boxes.size(2)
 
-    # Output tensors
-    obj_mask = ByteTensor(nB, nA, nG, nG).fill_(0)
-    noobj_mask = ByteTensor(nB, nA, nG, nG).fill_(1)
-    class_mask = FloatTensor(nB, nA, nG, nG).fill_(0)
-    iou_scores = FloatTensor(nB, nA, nG, nG).fill_(0)
-    tx = FloatTensor(nB, nA, nG, nG).fill_(0)
-    ty = FloatTensor(nB, nA, nG, nG).fill_(0)
-    tw = FloatTensor(nB, nA, nG, nG).fill_(0)
-    th = FloatTensor(nB, nA, nG, nG).fill_(0)
-    tcls = FloatTensor(nB, nA, nG, nG, nC).fill_(0)
+    # Output tensors, always fp32 on the device of the predictions
+    device = pred_boxes.device
+    obj_mask = torch.zeros(nB, nA, nG, nG, dtype=torch.bool, device=device)
+    noobj_mask = torch.ones(nB, nA, nG, nG, dtype=torch.bool, device=device)
+    class_mask = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    iou_scores = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    tx = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    ty = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    tw = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    th = torch.zeros(nB, nA, nG, nG, dtype=torch.float, device=device)
+    tcls = torch.zeros(nB, nA, nG, nG, nC, dtype=torch.float, device=device)
 
     # Convert to position relative to box
     target_boxes = target[:, 2:6] * nG
@@ -409,7 +470,7 @@ def cv2_put_text(img, text, text_offset_x, text_offset_y, font_scale = 0.35, bac
     
 def annotate_frame_with_objects(original_frame, objects_bboxes, class_names, model_input_size,  only_classes=None,
                                 confidence_threshold= 0, plot_labels=True, plot_class_confidence=False, text_color=(255,255,255),
-                                thickness= 2, text_font_scale=0.5):
+                                thickness= 2, text_font_scale=0.5, out=None):
     """
     This function plots detected objects bounding boxes over images with class name and accuracy
     :param original_frame: A Frame(Image) from video
@@ -419,63 +480,23 @@ def annotate_frame_with_objects(original_frame, objects_bboxes, class_names, mod
     :param confidence_threshold:
     :param plot_labels: Whether to write down class label over bounding boxes or not
     :param plot_class_confidence: Whether to write down class confidence over bounding boxes or not
+    :param out: A reusable frame buffer the masked frame is drawn into, allocated if None
     :return: Masked Frame
     """
-    masked_frame = copy.copy(original_frame)
+    if objects_bboxes is None:
+        return get_renderer(class_names).render(original_frame, None, out=out)
 
     # Rescale boxes to original image
-    if not (model_input_size, model_input_size) == masked_frame.shape[:2]:
-        detections = rescale_boxes(objects_bboxes, model_input_size, masked_frame.shape[:2])
+    if not (model_input_size, model_input_size) == original_frame.shape[:2]:
+        detections = rescale_boxes(objects_bboxes, model_input_size, original_frame.shape[:2])
     else:
         detections = objects_bboxes
 
-    # Create Colors
-    cmap = plt.get_cmap("tab20b")
-    colors = [cmap(i) for i in np.linspace(0, 1, 20)]
-    unique_labels = detections[:, -1].cpu().unique()
-    n_cls_preds = len(unique_labels)
-    bbox_colors = random.sample(colors, n_cls_preds)
-
-    for x1, y1, x2, y2, conf, cls_conf, cls_id in detections.cpu().data.numpy():
-        x1 = int(x1)
-        x2 = int(x2)
-        y1 = int(y1)
-        y2 = int(y2)
-        conf = float(conf)
-        cls_conf = float(cls_conf)
-        cls_id = int(cls_id)
-
-        if only_classes and not class_names[cls_id] in only_classes:
-            continue
-
-        if cls_conf<confidence_threshold:
-            continue
-
-        # Calculate the width and height of the bounding box relative to the size of the image.
-        box_w = x2 - x1
-        box_h = y2 - y1
-
-        # get color
-        bb_color = bbox_colors[int(np.where(unique_labels == int(cls_id))[0])]
-        bb_color =  tuple([ int(ch*255) for ch in bb_color])[:3]
-
-        cv2.rectangle( masked_frame, (x1, y1), ( x2, y2),
-                      color = bb_color,
-                      thickness=  thickness)
-
-        if plot_labels:
-            # Define x and y offsets for the labels
-            lxc = (masked_frame.shape[1] * 0.266) / 100
-            lyc = (masked_frame.shape[0] * 1.180) / 100
-
-            # Plot class name
-            cv2_put_text(masked_frame, class_names[cls_id], x1, y1-1, font_scale=text_font_scale, background_color=bb_color, text_color=text_color)
-
-        if plot_class_confidence:
-            # Plot probability
-            cv2_put_text(masked_frame, "{0:.2f}".format(cls_conf), x1, y2, font_scale=text_font_scale,  background_color=bb_color, text_color=text_color)
-
-    return masked_frame
+    renderer = get_renderer(class_names, font_scale=text_font_scale, thickness=thickness, text_color=text_color)
+    return renderer.render(
+        original_frame, detections, out=out, only_classes=only_classes, confidence_threshold=confidence_threshold,
+        plot_labels=plot_labels, plot_class_confidence=plot_class_confidence,
+    )
 
 def generate_yolo_train_test_files(images_dir, output_dir, classes, train_valid_split=0.8):
 
@@ -0,0 +1,378 @@
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from utils.batching import letterbox_frame, percentile
+from utils.utils import non_max_suppression, rescale_boxes
+from utils.render import get_renderer
+from utils.tracking import Tracker
+
+# Marks the end of the stream in the stage queues
+_END = object()
+
+STAGES = ["decode", "preprocess", "infer", "postprocess", "encode"]
+
+
+def is_live_source(source):
+    """ Camera indices and network streams are live, files are offline """
+    return isinstance(source, int) or str(source).isdigit() or "://" in str(source)
+
+
+def open_capture(source):
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Can't open video source {source}")
+    return capture
+
+
+def video_writer(path, fps, width, height):
+    fourcc = cv2.VideoWriter_fourcc(*("MJPG" if path.endswith(".avi") else "mp4v"))
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError(f"Can't write video {path}")
+    return writer
+
+
+def write_synthetic_video(path, num_frames=300, height=480, width=640, fps=30, num_objects=5, seed=0):
+    """
+    Writes a video of 'num_objects' colored rectangles moving at constant speed (bouncing off the borders)
+    over a static textured background. Returns the ground truth boxes of every frame, (num_objects, 4) x1y1x2y2.
+    """
+    rng = np.random.RandomState(seed)
+    background = cv2.GaussianBlur(rng.randint(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 5)
+    sizes = rng.uniform(0.1, 0.3, (num_objects, 2)) * [width, height]
+    positions = rng.uniform(0, 1, (num_objects, 2)) * ([width, height] - sizes)
+    velocities = rng.uniform(-4, 4, (num_objects, 2))
+    colors = rng.randint(0, 256, (num_objects, 3)).tolist()
+
+    writer = video_writer(path, fps, width, height)
+    boxes = []
+    for _ in range(num_frames):
+        frame = background.copy()
+        frame_boxes = np.concatenate((positions, positions + sizes), 1)
+        for (x1, y1, x2, y2), color in zip(frame_boxes.astype(int).tolist(), colors):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, cv2.FILLED)
+        writer.write(frame)
+        boxes.append(frame_boxes.astype(np.float32))
+        positions += velocities
+        bounce = (positions < 0) | (positions + sizes > [width, height])
+        velocities[bounce] *= -1
+        positions = np.clip(positions, 0, [width, height] - sizes)
+    writer.release()
+    return boxes
+
+
+def detect_frame(model, frame, img_size=416, conf_thres=0.5, nms_thres=0.4, device="cpu"):
+    """ Detections (non_max_suppression format) of one BGR frame, in frame coordinates """
+    with torch.no_grad():
+        predictions = model(letterbox_frame(frame, img_size).unsqueeze(0).to(device))
+    detections = non_max_suppression(predictions, conf_thres, nms_thres)[0]
+    if detections is not None:
+        detections = rescale_boxes(detections, img_size, frame.shape[:2])
+    return detections
+
+
+class StageStats(object):
+    """ Thread-safe service time window, item and drop counts of a pipeline stage """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.items = 0
+        self.dropped = 0
+        self.busy_time = 0.0
+
+    def record(self, seconds, items=1):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.items += items
+            self.busy_time += seconds
+
+    def record_drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            items, dropped, busy_time = self.items, self.dropped, self.busy_time
+        return {
+            "items": items,
+            "dropped": dropped,
+            "busy_s": busy_time,
+            "latency_ms": {f"p{q}": 1000 * percentile(latencies, q) for q in [50, 90, 99]},
+        }
+
+
+class StageQueue(object):
+    """
+    Bounded queue between two stages. With the "none" policy a full queue blocks the producer (backpressure
+    up to the decoder), with "drop_oldest" the oldest waiting item is discarded so the consumer always gets
+    the most recent frames. Blocking puts give up once 'stopped' is set so a failed stage can't deadlock the others.
+    """
+
+    def __init__(self, maxsize, policy, stats, stopped):
+        if policy not in ("none", "drop_oldest"):
+            raise ValueError(f"Unknown drop policy {policy}")
+        self.queue = queue.Queue(maxsize)
+        self.policy = policy
+        self.stats = stats
+        self.stopped = stopped
+
+    def put(self, item):
+        if self.policy == "drop_oldest" and item is not _END:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    pass
+                try:
+                    self.queue.get_nowait()
+                    self.stats.record_drop()
+                except queue.Empty:
+                    pass
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        while not self.stopped.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class VideoPipeline(object):
+    """
+    Runs detection on a video source with one thread per stage, connected by bounded queues:
+
+        decode -> preprocess -> infer -> postprocess -> encode
+
+    decode reads frames with cv2.VideoCapture, preprocess letterboxes them, infer runs the model on batches of
+    up to 'batch_size' waiting frames, postprocess runs the NMS, rescales the boxes to the frame and draws them,
+    encode writes the annotated frames to 'output' (a video path) and calls 'on_detections(index, detections)'.
+    Frames are processed in order. drop_policy is "none" (offline, every frame is processed, a slow stage slows
+    down the decoder) or "drop_oldest" (live, stale frames are discarded), by default "drop_oldest" for cameras
+    and network streams only. run() returns the per stage statistics, see stats().
+    With a KeyframeScheduler as 'keyframes', only the frames it selects are letterboxed and run through the
+    model, the boxes of the other frames are propagated by a Tracker (its tracking confidence is reported back
+    to the scheduler by postprocess).
+    """
+
+    def __init__(self, model, source, output=None, class_names=None, img_size=416, conf_thres=0.5, nms_thres=0.4,
+                 batch_size=1, queue_size=4, drop_policy=None, device="cpu", render=True, on_detections=None,
+                 keyframes=None, tracker=None):
+        self.model = model
+        self.source = source
+        self.output = output
+        self.class_names = class_names
+        self.img_size = img_size
+        self.conf_thres = conf_thres
+        self.nms_thres = nms_thres
+        self.batch_size = batch_size
+        self.device = device
+        self.render = render and output is not None and class_names is not None
+        self.on_detections = on_detections
+        self.keyframes = keyframes
+        self.tracker = tracker or (Tracker() if keyframes is not None else None)
+        self.drop_policy = drop_policy or ("drop_oldest" if is_live_source(source) else "none")
+
+        self.stopped = threading.Event()
+        self.error = None
+        self.stage_stats = collections.OrderedDict((stage, StageStats()) for stage in STAGES)
+        # Queue i feeds stage i + 1, drops are counted against the stage that missed the frame
+        self.queues = [
+            StageQueue(queue_size, self.drop_policy, self.stage_stats[stage], self.stopped) for stage in STAGES[1:]
+        ]
+        self.end_to_end = StageStats()
+        self.stopped_reading = threading.Event()
+        self.threads = []
+        self.fps = None
+        self.start_time = None
+        self.end_time = None
+
+    def stop(self):
+        """
+        Stops reading the source, the frames already read are still processed. Safe to call from any thread
+        (or a signal handler), follow with join() to wait for the last frames to be written.
+        """
+        self.stopped_reading.set()
+
+    def _stage(self, name, target):
+        def run():
+            try:
+                target()
+            except Exception as e:
+                self.error = self.error or e
+                self.stopped.set()
+
+        return threading.Thread(target=run, name=f"video-{name}", daemon=True)
+
+    def _decode(self):
+        capture = open_capture(self.source)
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 30
+        output = self.queues[0]
+        index = 0
+        try:
+            while not self.stopped.is_set() and not self.stopped_reading.is_set():
+                start_time = time.time()
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.stage_stats["decode"].record(time.time() - start_time)
+                output.put((index, start_time, frame))
+                index += 1
+        finally:
+            capture.release()
+            output.put(_END)
+
+    def _preprocess(self):
+        inputs, output = self.queues[0], self.queues[1]
+        while True:
+            item = inputs.get()
+            if item is _END:
+                output.put(_END)
+                return
+            start_time = time.time()
+            index, capture_time, frame = item
+            img = None
+            if self.keyframes is None or self.keyframes.should_detect(frame, index):
+                img = letterbox_frame(frame, self.img_size)
+            self.stage_stats["preprocess"].record(time.time() - start_time)
+            output.put((index, capture_time, frame, img))
+
+    def _infer(self):
+        inputs, output = self.queues[1], self.queues[2]
+        end = False
+        while not end:
+            item = inputs.get()
+            if item is _END:
+                break
+            # Batch the frames that are already waiting, never wait for more
+            batch = [item]
+            while len(batch) < self.batch_size:
+                item = inputs.get_nowait()
+                if item is None:
+                    break
+                if item is _END:
+                    end = True
+                    break
+                batch.append(item)
+            start_time = time.time()
+            indices, capture_times, frames, imgs = zip(*batch)
+            # Frames skipped by the keyframe scheduler have no image, the predictions only cover the others
+            is_keyframe = [img is not None for img in imgs]
+            predictions = None
+            if any(is_keyframe):
+                with torch.no_grad():
+                    predictions = self.model(torch.stack([img for img in imgs if img is not None]).to(self.device))
+            self.stage_stats["infer"].record(time.time() - start_time, sum(is_keyframe))
+            output.put((indices, capture_times, frames, is_keyframe, predictions))
+        output.put(_END)
+
+    def _postprocess(self):
+        inputs, output = self.queues[2], self.queues[3]
+        while True:
+            item = inputs.get()
+            if item is _END:
+                output.put(_END)
+                return
+            start_time = time.time()
+            indices, capture_times, frames, is_keyframe, predictions = item
+            detections = iter([])
+            if predictions is not None:
+                detections = iter(non_max_suppression(predictions, self.conf_thres, self.nms_thres))
+            for index, capture_time, frame, keyframe in zip(indices, capture_times, frames, is_keyframe):
+                frame_detections = next(detections) if keyframe else None
+                if frame_detections is not None:
+                    frame_detections = rescale_boxes(frame_detections, self.img_size, frame.shape[:2])
+                if self.tracker is not None:
+                    if keyframe:
+                        frame_detections, _ = self.tracker.update(frame_detections)
+                    else:
+                        frame_detections, _ = self.tracker.predict()
+                    if self.keyframes is not None:
+                        self.keyframes.report(self.tracker.confidence(), index)
+                if self.render:
+                    get_renderer(self.class_names).draw(frame, frame_detections)
+                output.put((index, capture_time, frame, frame_detections))
+            self.stage_stats["postprocess"].record(time.time() - start_time, len(indices))
+
+    def _encode(self):
+        inputs = self.queues[3]
+        writer = None
+        try:
+            while True:
+                item = inputs.get()
+                if item is _END:
+                    return
+                start_time = time.time()
+                index, capture_time, frame, detections = item
+                if self.output is not None:
+                    if writer is None:
+                        writer = video_writer(self.output, self.fps, frame.shape[1], frame.shape[0])
+                    writer.write(frame)
+                if self.on_detections is not None:
+                    self.on_detections(index, detections)
+                now = time.time()
+                self.stage_stats["encode"].record(now - start_time)
+                self.end_to_end.record(now - capture_time)
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def start(self):
+        """ Starts the stage threads and returns, see join() """
+        self.start_time = time.time()
+        self.threads = [self._stage(name, getattr(self, f"_{name}")) for name in STAGES]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        """ Processes the whole source (or until stop()), raises the first error of a stage """
+        self.start()
+        return self.join()
+
+    def join(self):
+        """
+        Waits for the stages to finish (the output video is then complete), raises the first error of a stage
+        and returns the statistics. Can be called again after an interrupted join(), e.g. after stop() on Ctrl-C.
+        """
+        for thread in self.threads:
+            thread.join()
+        self.end_time = time.time()
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self):
+        """ Frames written, throughput, end to end latency (capture to encode) and per stage statistics """
+        elapsed = (self.end_time or time.time()) - self.start_time
+        end_to_end = self.end_to_end.snapshot()
+        stats = {
+            "frames": end_to_end["items"],
+            "dropped": sum(stats.dropped for stats in self.stage_stats.values()),
+            "fps": end_to_end["items"] / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": end_to_end["latency_ms"],
+            "stages": {name: stage_stats.snapshot() for name, stage_stats in self.stage_stats.items()},
+        }
+        if self.keyframes is not None:
+            stats["keyframes"] = self.keyframes.stats()
+        return stats
@@ -0,0 +1,78 @@
+from __future__ import division
+
+from models import *
+from utils.utils import *
+from utils.onnx_backend import *
+from utils.detection_io import *
+from utils.video import *
+from utils.tracking import *
+
+import json
+import argparse
+
+import torch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs detection on a video file, camera or stream")
+    parser.add_argument("--source", type=str, required=True, help="video file, camera index or stream url")
+    parser.add_argument("--output", type=str, help="annotated video (.mp4 or .avi)")
+    parser.add_argument("--detections", type=str, help="write the detections of every frame to this jsonl file")
+    parser.add_argument("--model_def", type=str, default="config/yolov3.cfg", help="path to model definition file")
+    parser.add_argument("--weights_path", type=str, default="weights/yolov3.weights", help="path to weights file")
+    parser.add_argument("--class_path", type=str, default="data/coco.names", help="path to class label file")
+    parser.add_argument("--conf_thres", type=float, default=0.8, help="object confidence threshold")
+    parser.add_argument("--nms_thres", type=float, default=0.4, help="iou thresshold for non-maximum suppression")
+    parser.add_argument("--img_size", type=int, default=416, help="size of each image dimension")
+    parser.add_argument("--precision", type=str, default="fp32", help="precision of the conv stack: fp32 or bf16")
+    parser.add_argument("--channels_last", action="store_true", help="run the conv stack in channels_last memory format")
+    parser.add_argument("--onnx", type=str, help="run this exported ONNX graph (without NMS) with onnxruntime instead")
+    parser.add_argument("--batch_size", type=int, default=1, help="maximum number of waiting frames per forward")
+    parser.add_argument("--queue_size", type=int, default=4, help="capacity of the queues between stages")
+    parser.add_argument("--drop_policy", type=str, help="none or drop_oldest, drop_oldest for live sources by default")
+    parser.add_argument("--keyframe_interval", type=int, default=1, help="run the detector every n frames and track in between")
+    parser.add_argument("--adaptive", action="store_true", help="choose the keyframes from the tracking confidence and scene changes")
+    parser.add_argument("--min_track_confidence", type=float, default=0.5, help="adaptive: detect when a track's confidence falls under this")
+    parser.add_argument("--max_keyframe_interval", type=int, default=30, help="adaptive: detect at least every n frames")
+    opt = parser.parse_args()
+    print(opt)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    if opt.onnx:
+        model = OnnxDarknet(opt.onnx)
+    else:
+        model = load_model(opt.model_def, opt.weights_path, img_size=opt.img_size, device=device)
+    model.set_precision(opt.precision, opt.channels_last)
+    model.eval()
+
+    classes = load_classes(opt.class_path)
+    writer = JsonlDetectionWriter(opt.detections, classes) if opt.detections else None
+
+    keyframes = None
+    if opt.keyframe_interval > 1 or opt.adaptive:
+        keyframes = KeyframeScheduler(
+            interval=opt.keyframe_interval, adaptive=opt.adaptive,
+            min_confidence=opt.min_track_confidence, max_interval=opt.max_keyframe_interval,
+        )
+
+    def on_detections(index, detections):
+        if writer is not None:
+            writer.write([f"{opt.source}#{index}"], [detections])
+
+    pipeline = VideoPipeline(
+        model, opt.source, output=opt.output, class_names=classes, img_size=opt.img_size,
+        conf_thres=opt.conf_thres, nms_thres=opt.nms_thres, batch_size=opt.batch_size,
+        queue_size=opt.queue_size, drop_policy=opt.drop_policy, device=device, on_detections=on_detections,
+        keyframes=keyframes,
+    )
+    try:
+        stats = pipeline.run()
+    except KeyboardInterrupt:
+        # Let the frames already read reach the output so the video is finalized
+        pipeline.stop()
+        stats = pipeline.join()
+    finally:
+        if writer is not None:
+            writer.close()
+    print(json.dumps(stats, indent=2))